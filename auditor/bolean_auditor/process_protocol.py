@@ -1,10 +1,11 @@
 import json
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
 from ipaddress import IPv4Address, IPv6Address
 from typing import List, Dict, Any
 
 from dateutil import parser
+from django.db import transaction
 from django.db.models import Count
 from django.utils import timezone
 
@@ -15,13 +16,32 @@ from statistic.serializers import IPMapSerializer, RiskSrcCountrySerializer, \
     AttackStatisticSerializer, DeviceAlertDistributionSerializer, \
     IncrementTrendSerializer, AbnormalIPSerializer, ExternalIPTopSerializer, \
     PortRankSerializer, IPRankSerializer
-from utils.helper import safe_divide, send_websocket_message
+from utils.db import counted_upsert
+from utils.helper import safe_divide, send_websocket_message, get_today, \
+    get_next_day
 from utils.ip_search import ip_search, IPRecord
-from utils.unified_redis import rs, cache, IPDuplicate, IPRedisQueue
+from utils.unified_redis import rs, cache, IPDuplicate, IPRedisQueue, \
+    SlidingWindowTopN
 
 WEBSOCKET_TYPE = 'unified_push'
 
 
+def ip_rank_percent(data: List) -> List[Dict]:
+    """
+    :param data: [(ip, count), ...]，按count降序
+    :return: [{'ip': xxx, 'count': xxx, 'percent': xxx}]，percent是相对第一名的比例
+    """
+    result = []
+    if not data:
+        return result
+    top = int(data[0][1])
+    for i in data:
+        count = int(i[1])
+        percent = safe_divide(count * 100, top)
+        result.append({'ip': i[0], 'count': count, 'percent': percent})
+    return result
+
+
 class _Processor(ABC):
     @abstractmethod
     def set_next(self, processor):
@@ -346,6 +366,7 @@ class PortRank(Processor):
 class ProtocolIPRank(Processor):
     """
     协议审计，流量源TOP5和目的TOP5
+    按小时分桶计数，桶自动过期，不再需要每天删除key
     """
     src_ip_pattern = 'auditor_src_ip'
     dst_ip_pattern = 'auditor_dst_ip'
@@ -353,8 +374,8 @@ class ProtocolIPRank(Processor):
 
     def __init__(self, current: datetime):
         super().__init__(current)
-        self.src_key = self.src_ip_pattern + self.get_date()
-        self.dst_key = self.dst_ip_pattern + self.get_date()
+        self.src_window = SlidingWindowTopN(self.src_ip_pattern)
+        self.dst_window = SlidingWindowTopN(self.dst_ip_pattern)
         self._data: Dict[str, Dict[str, int]] = {
             'src_ip': {}, 'dst_ip': {},
         }
@@ -375,12 +396,8 @@ class ProtocolIPRank(Processor):
         super().process(data)
 
     def save(self):
-        src_ips = self._data['src_ip']
-        for ip, count in src_ips.items():
-            self.set_src_ip(ip, count)
-        dst_ips = self._data['dst_ip']
-        for ip, count in dst_ips.items():
-            self.set_dst_ip(ip, count)
+        self.src_window.incr(self._data['src_ip'], self.current)
+        self.dst_window.incr(self._data['dst_ip'], self.current)
         self.websocket_send()
         super().save()
 
@@ -411,36 +428,35 @@ class ProtocolIPRank(Processor):
             data[ip] = 1
 
     def set_src_ip(self, ip: str, count: int = 1):
-        cache.zincrby(self.src_key, count, ip)
+        self.src_window.incr({ip: count}, self.current)
 
     def set_dst_ip(self, ip: str, count: int = 1):
-        cache.zincrby(self.dst_key, count, ip)
+        self.dst_window.incr({ip: count}, self.current)
+
+    def window(self):
+        """
+        统计窗口是current所在的这一天
+        """
+        start = get_today(self.current)
+        end = get_next_day(self.current) - timedelta(seconds=1)
+        return start, end
 
     def get_top_n_src_ip(self, n: int = 5):
-        data = cache.zrevrange(self.src_key, 0, n - 1, withscores=True)
-        result = []
-        if not data:
-            return result
-        top = int(data[0][1])
-        for i in data:
-            count = int(i[1])
-            percent = safe_divide(count * 100, top)
-            result.append({'ip': i[0], 'count': count,
-                           'percent': percent})
-        return result
+        return ip_rank_percent(self.src_window.top_n(n, *self.window()))
 
     def get_top_n_dst_ip(self, n: int = 5):
-        data = cache.zrevrange(self.dst_key, 0, n - 1, withscores=True)
-        result = []
-        if not data:
-            return result
-        top = int(data[0][1])
-        for i in data:
-            count = int(i[1])
-            percent = safe_divide(count * 100, top)
-            result.append({'ip': i[0], 'count': count,
-                           'percent': percent})
-        return result
+        return ip_rank_percent(self.dst_window.top_n(n, *self.window()))
+
+    def get_top_n_last_hours(self, n: int = 10, hours: int = 1):
+        """
+        最近hours个小时内的源IP和目的IP TopN
+        """
+        return {
+            'src_ip': ip_rank_percent(
+                self.src_window.top_n_last(n, self.current, hours)),
+            'dst_ip': ip_rank_percent(
+                self.dst_window.top_n_last(n, self.current, hours)),
+        }
 
     def get_top_n(self, n: int = 5):
         """
@@ -532,8 +548,7 @@ class IPSource(Processor):
         for city, data in self._city_data.items():
             self.save_city_ip(city, data)
 
-        for c, count in self._country_data.items():
-            self.save_country_ip(c, count)
+        self.save_country_ip(self._country_data)
         self.save_attack_data()
         self.websocket_send()
         super().save()
@@ -658,17 +673,17 @@ class IPSource(Processor):
             city_data['count'] += value['count']
         cache.hset(self.city_key, city, json.dumps(city_data))
 
-    def save_country_ip(self, country: str, count=1):
+    def save_country_ip(self, country_data: Dict[str, int]):
         """
-        {'中国'： 100}
+        一条INSERT ... ON CONFLICT累加这一批所有国家的通信次数
+        :param country_data: {'中国'： 100}
         :return:
         """
-        try:
-            r = RiskCountry.objects.get(country=country)
-            r.count = r.count + count
-            r.save()
-        except RiskCountry.DoesNotExist:
-            RiskCountry.objects.create(country=country, count=count)
+        counted_upsert(
+            RiskCountry,
+            [{'country': c, 'count': count} for c, count in
+             country_data.items()],
+            conflict_fields=('country',), count_fields=('count',))
 
     def save_attack_data(self):
         cache.hincrby(self.attack_key, 'count', self._attack_data['count'])
@@ -716,27 +731,33 @@ class AlertCategoryDistribution(Processor):
         super().process(data)
 
     def save(self):
-        distribution = AlertDistribution.objects.first()
-        if distribution:
-            data = self.get_distribution(distribution.update_time)
-            distribution.scan += data.get(DeviceAllAlert.CATEGORY_SCAN, 0)
-            distribution.flaw += data.get(DeviceAllAlert.CATEGORY_FLAW, 0)
-            distribution.penetration += data.get(
-                DeviceAllAlert.CATEGORY_PENETRATION, 0)
-            distribution.apt += data.get(DeviceAllAlert.CATEGORY_APT, 0)
-            distribution.other += data.get(DeviceAllAlert.CATEGORY_OTHER, 0)
-            distribution.update_time = self.current
-            distribution.save()
-        else:
-            data = self.get_distribution()
-            distribution = AlertDistribution.objects.create(
-                scan=data.get(DeviceAllAlert.CATEGORY_SCAN, 0),
-                flaw=data.get(DeviceAllAlert.CATEGORY_FLAW, 0),
-                penetration=data.get(DeviceAllAlert.CATEGORY_PENETRATION, 0),
-                apt=data.get(DeviceAllAlert.CATEGORY_APT, 0),
-                other=data.get(DeviceAllAlert.CATEGORY_OTHER, 0),
-                update_time=self.current
-            )
+        # 多台审计并发同步时锁住累计值这一行，后面的线程读到的update_time已经
+        # 是前一个线程更新过的，同一段时间的威胁不会重复累加
+        with transaction.atomic():
+            distribution = AlertDistribution.objects.select_for_update(
+            ).first()
+            if distribution:
+                data = self.get_distribution(distribution.update_time)
+                distribution.scan += data.get(DeviceAllAlert.CATEGORY_SCAN, 0)
+                distribution.flaw += data.get(DeviceAllAlert.CATEGORY_FLAW, 0)
+                distribution.penetration += data.get(
+                    DeviceAllAlert.CATEGORY_PENETRATION, 0)
+                distribution.apt += data.get(DeviceAllAlert.CATEGORY_APT, 0)
+                distribution.other += data.get(
+                    DeviceAllAlert.CATEGORY_OTHER, 0)
+                distribution.update_time = self.current
+                distribution.save()
+            else:
+                data = self.get_distribution()
+                distribution = AlertDistribution.objects.create(
+                    scan=data.get(DeviceAllAlert.CATEGORY_SCAN, 0),
+                    flaw=data.get(DeviceAllAlert.CATEGORY_FLAW, 0),
+                    penetration=data.get(
+                        DeviceAllAlert.CATEGORY_PENETRATION, 0),
+                    apt=data.get(DeviceAllAlert.CATEGORY_APT, 0),
+                    other=data.get(DeviceAllAlert.CATEGORY_OTHER, 0),
+                    update_time=self.current
+                )
         self.distribution = distribution
         self.websocket_send()
         super().save()
@@ -919,6 +940,7 @@ class IPQueueProcess(Processor):
 class AttackIPRank(Processor):
     """
     协议审计，统计外网访问内网的情况下的攻击源IP和被攻击IP
+    按小时分桶计数，桶自动过期，不再需要每天删除key
     """
     src_ip_pattern = 'auditor_attack_src_ip'
     dst_ip_pattern = 'auditor_attack_dst_ip'
@@ -926,8 +948,8 @@ class AttackIPRank(Processor):
 
     def __init__(self, current: datetime):
         super().__init__(current)
-        self.src_key = self.src_ip_pattern + self.get_date()
-        self.dst_key = self.dst_ip_pattern + self.get_date()
+        self.src_window = SlidingWindowTopN(self.src_ip_pattern)
+        self.dst_window = SlidingWindowTopN(self.dst_ip_pattern)
         self._data: Dict[str, Dict[str, int]] = {
             'src_ip': {}, 'dst_ip': {},
         }
@@ -945,12 +967,9 @@ class AttackIPRank(Processor):
         super().process(data)
 
     def save(self):
-        src_ips = self._data['src_ip']
-        for ip, count in src_ips.items():
-            self.set_src_ip(ip, count)
-        dst_ips = self._data['dst_ip']
-        for ip, count in dst_ips.items():
-            self.set_dst_ip(ip, count)
+        # 一批IP的ZINCRBY通过pipeline一次发送，不再每个IP一个往返
+        self.src_window.incr(self._data['src_ip'], self.current)
+        self.dst_window.incr(self._data['dst_ip'], self.current)
         self.websocket_send()
         super().save()
 
@@ -972,36 +991,35 @@ class AttackIPRank(Processor):
             data[ip] = 1
 
     def set_src_ip(self, ip: str, count: int = 1):
-        cache.zincrby(self.src_key, count, ip)
+        self.src_window.incr({ip: count}, self.current)
 
     def set_dst_ip(self, ip: str, count: int = 1):
-        cache.zincrby(self.dst_key, count, ip)
+        self.dst_window.incr({ip: count}, self.current)
+
+    def window(self):
+        """
+        统计窗口是current所在的这一天
+        """
+        start = get_today(self.current)
+        end = get_next_day(self.current) - timedelta(seconds=1)
+        return start, end
 
     def get_top_n_src_ip(self, n: int = 5):
-        data = cache.zrevrange(self.src_key, 0, n - 1, withscores=True)
-        result = []
-        if not data:
-            return result
-        top = int(data[0][1])
-        for i in data:
-            count = int(i[1])
-            percent = safe_divide(count * 100, top)
-            result.append({'ip': i[0], 'count': count,
-                           'percent': percent})
-        return result
+        return ip_rank_percent(self.src_window.top_n(n, *self.window()))
 
     def get_top_n_dst_ip(self, n: int = 5):
-        data = cache.zrevrange(self.dst_key, 0, n - 1, withscores=True)
-        result = []
-        if not data:
-            return result
-        top = int(data[0][1])
-        for i in data:
-            count = int(i[1])
-            percent = safe_divide(count * 100, top)
-            result.append({'ip': i[0], 'count': count,
-                           'percent': percent})
-        return result
+        return ip_rank_percent(self.dst_window.top_n(n, *self.window()))
+
+    def get_top_n_last_hours(self, n: int = 10, hours: int = 1):
+        """
+        最近hours个小时内的源IP和目的IP TopN
+        """
+        return {
+            'src_ip': ip_rank_percent(
+                self.src_window.top_n_last(n, self.current, hours)),
+            'dst_ip': ip_rank_percent(
+                self.dst_window.top_n_last(n, self.current, hours)),
+        }
 
     def get_top_n(self, n: int = 5):
         """
@@ -1,4 +1,5 @@
 import logging
+import time
 import traceback
 from abc import abstractmethod, ABC
 from collections import OrderedDict
@@ -31,6 +32,12 @@ logger = logging.getLogger()
 WEBSOCKET_TYPE = 'unified_push'
 
 
+class DeadlineExceeded(Exception):
+    """
+    超过本次同步的截止时间，剩下的请求留到下一次同步
+    """
+
+
 class DeviceCache(object):
     key_pattern = 'audit-device-cache'
     expire = 5
@@ -78,17 +85,37 @@ class Synchronize(ABC):
     uri = None
     scheme = settings.AUDIT_SCHEME
     port = settings.AUDIT_PORT
+    timeout = 30  # 单次请求的超时时间，避免审计无响应时一直阻塞
 
-    def __init__(self, device: Device):
+    def __init__(self, device: Device, deadline: Optional[float] = None):
+        """
+        :param deadline: 本次同步的截止时间(time.time())，requests的超时只限制
+        单次socket操作，分页请求时每一页之前都要检查剩余的时间
+        """
         self.device = device
+        self.deadline = deadline
 
-    def synchronize(self):
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def synchronize(self) -> bool:
+        """
+        :return: 同步是否成功
+        """
         try:
             response = self.request_for_data()
             self.save(response)
+            return True
+        except DeadlineExceeded as e:
+            logging.warning('审计{}同步超过截止时间, {}'.format(
+                self.device.ip, e))
+            return False
         except Exception as e:
             logging.error('审计同步失败')
             logging.error(e)
+            return False
 
     @abstractmethod
     def request_for_data(self, *args, **kwargs) -> Dict:
@@ -99,12 +126,18 @@ class Synchronize(ABC):
         pass
 
     def do_request(self, payload=None):
+        timeout = self.timeout
+        remaining = self.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded('{} {}'.format(self.uri, payload))
+            timeout = min(timeout, remaining)
         if settings.TEST:
             return self.do_faker_request(payload)
         headers = {'secret': self.device.secret}
         response = requests.get('{}://{}:{}/{}'.format(
             self.scheme, self.device.ip, self.port, self.uri
-        ), params=payload, headers=headers, verify=False)
+        ), params=payload, headers=headers, verify=False, timeout=timeout)
         response.raise_for_status()
         response = response.json()
         return response
@@ -117,8 +150,9 @@ class AuditorSynchronize(Synchronize):
     uri = 'v2/unified-management/sec-alert/'
     audit_event_blacklist = 1
 
-    def __init__(self, device: Device, current: datetime):
-        super().__init__(device)
+    def __init__(self, device: Device, current: datetime,
+                 deadline: Optional[float] = None):
+        super().__init__(device, deadline)
         self.current = current
         self._cache = DeviceCache()
         self.location, _ = Location.objects.get_or_create(id=1)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
@@ -6,6 +7,7 @@ from django.utils import timezone
 
 from base_app.models import BaseStrategy, TerminalLog, Device, AuditorStrategy
 from utils.core.mixins import UniqueAttrMixin
+from utils.partition import partition_register
 from utils.validators import MAC_VALIDATOR
 from log.models import DeviceAllAlert
 
@@ -213,6 +215,8 @@ class AuditIPMACBondStrategy(UniqueAttrMixin, AuditorStrategy):
         return '{} {}'.format(self.id, self.name)
 
 
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class AuditSecAlert(TerminalLog):
     """
     审计设备安全告警
@@ -286,11 +290,20 @@ class AuditSecAlert(TerminalLog):
     class Meta:
         verbose_name = '安全告警'
         ordering = ['-last_at']
+        indexes = [
+            models.Index(fields=['last_at'], name='audit_sec_last_at_idx'),
+            # 首页最近的未读告警
+            models.Index(fields=['-occurred_time'],
+                         name='audit_sec_unread_idx',
+                         condition=models.Q(is_read=False)),
+        ]
 
     def __str__(self):
         return '{} {}'.format(self.id, self.get_category_display())
 
 
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class AuditSysAlert(TerminalLog):
     """
     审计设备系统事件，原审计系统告警以及系统日志
@@ -336,6 +349,11 @@ class AuditSysAlert(TerminalLog):
     class Meta:
         verbose_name = '系统告警'
         ordering = ['-occurred_time']
+        indexes = [
+            models.Index(fields=['occurred_time'], name='audit_sys_time_idx'),
+            models.Index(fields=['device', 'occurred_time'],
+                         name='audit_sys_device_time_idx'),
+        ]
 
     def __str__(self):
         return '{} {}'.format(self.id, self.get_category_display())
@@ -406,7 +424,7 @@ class TimeScaleAuditLog(models.Model):
 
 
 class RiskCountry(models.Model):
-    country = models.CharField('国家', max_length=200)
+    country = models.CharField('国家', max_length=200, unique=True)
     count = models.PositiveIntegerField('通信次数')
     update_time = models.DateTimeField(auto_now=True)
 
@@ -1,10 +1,23 @@
 from __future__ import absolute_import, unicode_literals
 
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict
+
+from dateutil import parser
+from django.db import connections
+from django.utils import timezone
 
 from auditor.bolean_auditor import AuditorSynchronize, AuditorSynchronizeLog
 from base_app.models import Device
+from utils.async_lock import RedisLock, ForceDropError
 from utils.runnable import TaskRun
+from utils.unified_redis import cache
+
+logger = logging.getLogger('auditor_task')
 
 HTTP = 'https'
 PORT = 443
@@ -29,18 +42,139 @@ def get_audit_log_task():
                                     'audit_log_max_id'])
 
 
+class AuditorCircuitBreaker(object):
+    """
+    审计同步的熔断器，状态存在redis里
+    同一台审计连续失败threshold次之后熔断，熔断的recovery秒内不再去请求这台审计，
+    熔断结束后放行一次，成功则清除失败次数，失败则立即再次熔断
+    """
+    failure_key_pattern = 'auditor-sync-failure-'
+    open_key_pattern = 'auditor-sync-open-'
+
+    def __init__(self, device_id: int, threshold: int = 3,
+                 recovery: int = 300):
+        self.failure_key = self.failure_key_pattern + str(device_id)
+        self.open_key = self.open_key_pattern + str(device_id)
+        self.threshold = threshold
+        self.recovery = recovery
+
+    def allow(self) -> bool:
+        return not cache.exists(self.open_key)
+
+    def success(self):
+        cache.delete(self.failure_key, self.open_key)
+
+    def failure(self):
+        count = cache.incr(self.failure_key)
+        if count >= self.threshold:
+            cache.set(self.open_key, 1, ex=self.recovery)
+
+
 class AuditorLogTask(TaskRun):
+    """
+    模块：审计事件和日志同步
+    更新周期：1分钟
+    描述：每台审计在各自的线程里同步，一台审计慢或者连不上不会拖累其他审计，
+    整体耗时取决于最慢的一台而不是所有审计的总和
+    """
+    max_workers = 10
+    # 每台审计单次同步的最长时间，要小于任务周期；每次请求之前检查剩余时间，
+    # 单次请求的超时也不超过剩余时间
+    deadline = 50
+    # 锁的过期时间要大于单次同步最坏的耗时(截止时间加上最后一次入库)，
+    # 只用来防止进程异常退出后锁一直不释放
+    lock_ttl = 300
+    lock_key_pattern = 'auditor-sync-lock-'
+    metrics_key = 'auditor-sync-metrics'
+
     @classmethod
     def run(cls, current: datetime):
-        auditors = Device.objects.filter(type=Device.AUDITOR,
-                                         register_status=Device.REGISTERED)
-        for auditor in auditors:
-            # 同步黑名单告警到告警威胁
-            sec_sync = AuditorSynchronize(auditor, current)
-            sec_sync.synchronize()
-            # 同步审计日志
-            log_sync = AuditorSynchronizeLog(auditor)
-            log_sync.synchronize()
-            auditor.save(update_fields=['audit_sec_alert_max_id',
-                                        'audit_sys_alert_max_id',
-                                        'audit_log_max_id'])
+        auditors = list(Device.objects.filter(
+            type=Device.AUDITOR, register_status=Device.REGISTERED))
+        if not auditors:
+            return
+        with ThreadPoolExecutor(min(len(auditors), cls.max_workers)) as pool:
+            tasks = [pool.submit(cls.sync_device, auditor, current)
+                     for auditor in auditors]
+        for t in tasks:
+            t.result()
+
+    @classmethod
+    def sync_device(cls, auditor: Device, current: datetime):
+        breaker = AuditorCircuitBreaker(auditor.id)
+        if not breaker.allow():
+            logger.warning('审计{}同步连续失败，熔断中，跳过本次同步'.format(
+                auditor.ip))
+            return
+        start = time.time()
+        try:
+            # 同一台审计的同步没有结束时，下一次同步直接放弃
+            with RedisLock(cls.lock_key_pattern + str(auditor.id),
+                           expired_time=cls.lock_ttl, force_drop=True):
+                success = cls._sync_device(auditor, current, start)
+        except ForceDropError:
+            logger.warning('审计{}的上一次同步还未结束'.format(auditor.ip))
+            return
+        except Exception as e:
+            logger.error('审计{}同步失败, {}'.format(auditor.ip, e))
+            success = False
+        finally:
+            connections.close_all()
+
+        if success:
+            breaker.success()
+        else:
+            breaker.failure()
+        cls.record_metrics(auditor, time.time() - start, success)
+
+    @classmethod
+    def _sync_device(cls, auditor: Device, current: datetime,
+                     start: float) -> bool:
+        deadline = start + cls.deadline
+        # 同步黑名单告警到告警威胁
+        sec_sync = AuditorSynchronize(auditor, current, deadline)
+        success = sec_sync.synchronize()
+        # 同步审计日志，只能用剩余的时间；超过截止时间时留到下一次同步
+        if time.time() < deadline:
+            log_sync = AuditorSynchronizeLog(auditor, deadline)
+            success = log_sync.synchronize() and success
+        else:
+            logger.warning('审计{}同步超过{}秒，审计日志留到下一次同步'.format(
+                auditor.ip, cls.deadline))
+        auditor.save(update_fields=['audit_sec_alert_max_id',
+                                    'audit_sys_alert_max_id',
+                                    'audit_log_max_id'])
+        return success
+
+    @classmethod
+    def record_metrics(cls, auditor: Device, duration: float, success: bool):
+        """
+        记录每台审计的同步耗时和同步延迟
+        lag: 距离上次同步成功过去的秒数，同步成功时为0
+        """
+        now = timezone.now()
+        last = cls.get_metrics().get(auditor.id, {})
+        last_success = now.isoformat() if success else last.get('last_success')
+        if last_success:
+            lag = (now - parser.parse(last_success)).total_seconds()
+        else:
+            lag = None
+        metrics = {
+            'duration': round(duration, 3),
+            'success': success,
+            'last_success': last_success,
+            'lag': lag,
+            'update_time': now.isoformat(),
+        }
+        cache.hset(cls.metrics_key, auditor.id, json.dumps(metrics))
+        logger.info('审计{}同步耗时{:.3f}s, 延迟{}s'.format(
+            auditor.ip, duration, lag))
+
+    @classmethod
+    def get_metrics(cls) -> Dict[int, Dict]:
+        """
+        :return: {device_id: {'duration': xx, 'success': xx, 'lag': xx,
+                  'last_success': xx, 'update_time': xx}}
+        """
+        data = cache.hgetall(cls.metrics_key)
+        return {int(k): json.loads(v) for k, v in data.items()}
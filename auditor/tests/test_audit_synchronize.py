@@ -1,7 +1,9 @@
+import time
 from copy import deepcopy
 from typing import Dict, List, Union
 
 import pytest
+import requests
 from django.db.models import Count
 from django.utils import timezone
 
@@ -9,13 +11,15 @@ from auditor.bolean_auditor import AuditorSynchronize
 from auditor.bolean_auditor.process_protocol import AlertCategoryDistribution, \
     IncrementDistributionProcess
 from auditor.bolean_auditor.synchronize import DeviceCache, \
-    AuditorSynchronizeLog
+    AuditorSynchronizeLog, DeadlineExceeded, Synchronize
 from auditor.models import AuditorBlackList
+from auditor.tasks import AuditorLogTask, AuditorCircuitBreaker
 from auditor.tests.data import alert_data
 from base_app.factory_data import DeviceFactory
 from base_app.models import Device
 from log.factory_data import DeviceAllAlertFactory
 from log.models import IncrementDistribution, AlertDistribution, DeviceAllAlert
+from utils.unified_redis import rs
 
 
 @pytest.fixture(scope='class')
@@ -378,3 +382,90 @@ class TestIncrementDistribution:
         assert distribution.flaw == 10
         assert distribution.apt == 10
         assert distribution.other == 10
+
+
+@pytest.mark.django_db
+class TestAuditorLogTask:
+    def test_circuit_breaker(self):
+        """
+        连续失败达到阈值后熔断，成功后恢复
+        """
+        breaker = AuditorCircuitBreaker(-1, threshold=2)
+        breaker.success()
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert not breaker.allow()
+        breaker.success()
+        assert breaker.allow()
+
+    def test_run_metrics(self, settings, monkeypatch):
+        """
+        每台审计同步之后记录耗时和延迟
+        """
+        settings.TEST = True
+        monkeypatch.setattr(Synchronize, 'do_faker_request',
+                            lambda s, payload: {'log_list': [], 'max_id': 0})
+        auditors = Device.objects.filter(type=Device.AUDITOR,
+                                         register_status=Device.REGISTERED)
+        for a in auditors:
+            AuditorCircuitBreaker(a.id).success()
+        AuditorLogTask.run(timezone.now())
+
+        metrics = AuditorLogTask.get_metrics()
+        for a in auditors:
+            assert a.id in metrics
+            assert metrics[a.id]['duration'] >= 0
+
+    def test_skip_when_circuit_open(self):
+        auditor = Device.objects.filter(
+            type=Device.AUDITOR, register_status=Device.REGISTERED).first()
+        breaker = AuditorCircuitBreaker(auditor.id, threshold=1)
+        breaker.failure()
+        rs.hdel(AuditorLogTask.metrics_key, auditor.id)
+
+        AuditorLogTask.sync_device(auditor, timezone.now())
+
+        assert auditor.id not in AuditorLogTask.get_metrics()
+        breaker.success()
+
+    def test_skip_log_after_deadline(self, monkeypatch):
+        """
+        威胁同步已经超过截止时间时，审计日志留到下一次同步
+        """
+        auditor = Device.objects.filter(
+            type=Device.AUDITOR, register_status=Device.REGISTERED).first()
+        called = []
+        monkeypatch.setattr(AuditorSynchronize, 'synchronize', lambda s: True)
+        monkeypatch.setattr(AuditorSynchronizeLog, 'synchronize',
+                            lambda s: called.append(s) or True)
+
+        assert AuditorLogTask._sync_device(
+            auditor, timezone.now(), time.time() - AuditorLogTask.deadline)
+        assert called == []
+
+    def test_deadline_before_each_request(self, settings, monkeypatch):
+        """
+        每次请求之前检查剩余时间，超过截止时间不再请求，单次请求的超时不超过剩余时间
+        """
+        auditor = Device.objects.filter(
+            type=Device.AUDITOR, register_status=Device.REGISTERED).first()
+        timeouts = []
+
+        def get(url, timeout=None, **kwargs):
+            timeouts.append(timeout)
+            raise requests.Timeout()
+
+        settings.TEST = False
+        monkeypatch.setattr(requests, 'get', get)
+
+        sync = AuditorSynchronizeLog(auditor, time.time() + 5)
+        assert not sync.synchronize()
+        assert 0 < timeouts[0] <= 5
+
+        sync = AuditorSynchronizeLog(auditor, time.time() - 1)
+        with pytest.raises(DeadlineExceeded):
+            sync.do_request()
+        assert not sync.synchronize()
+        assert len(timeouts) == 1
@@ -6,6 +6,9 @@ from base_app.models import Device, StrategyTemplate
 from firewall.factory_data import BaseFirewallStrategyFactory, FirewallWhiteListStrategyFactory, \
     FirewallLearnedWhiteListStrategyFactory, IndustryProtocolModbusStrategyFactory, IndustryProtocolS7StrategyFactory, \
     FirewallIPMACBondStrategyFactory, FirewallSecEventFactory, FirewallSysEventFactory
+from log.log_content.log_sink import audit_log_sink
+from setting.helpers import setting_cache
+from utils.core.authentication import token_user_cache
 from utils.base_testcase import BaseTest
 
 
@@ -57,3 +60,21 @@ def parent_lookup_kwargs(dev_or_temp, parent_lookup_map):
 @fixture(scope='class')
 def temp_or_device_kwargs(dev_or_temp, parent_lookup_map):
     return {'{}_id'.format(dev_or_temp): parent_lookup_map.get(dev_or_temp)}
+
+
+@fixture(autouse=True)
+def clear_process_cache():
+    """
+    每个测试的数据库事务都会回滚，进程内缓存的系统设置和token不能带到下一个测试
+    """
+    setting_cache.clear()
+    token_user_cache.clear()
+    yield
+
+
+@fixture(autouse=True)
+def sync_audit_log(monkeypatch):
+    """
+    测试的数据库事务对后台写入线程不可见，操作日志直接保存
+    """
+    monkeypatch.setattr(audit_log_sink, 'asynchronous', False)
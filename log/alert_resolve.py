@@ -0,0 +1,185 @@
+"""
+批量处理筛选条件下的安全威胁、安全事件，不再限制每次1000条：
+按主键范围分段执行 UPDATE ... WHERE 筛选条件，每段一个事务，只锁住这一段的行；
+数量超过ALERT_RESOLVE_SYNC_LIMIT时交给celery在后台执行，进度保存在redis里
+处理完成的数量同时从运营态势主视图的未处理总数里减掉
+"""
+import json
+import logging
+import uuid
+from typing import Dict, Optional, Type
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Max, Min
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from log.filters import AllDeviceAlertFilter, SecurityEventFilter
+from log.models import DeviceAllAlert, SecurityEvent
+from statistic.models import MainView
+from utils.unified_redis import cache
+
+logger = logging.getLogger(__name__)
+
+
+class BulkResolveJob(object):
+    """
+    :param job_id: 任务id
+    :param kind: alert(安全威胁) / security(安全事件)
+    :param params: urlencode之后的筛选条件，和列表接口的查询参数一致
+    :param data: 处理状态和备注
+    :param user_id: 处理人
+    """
+    KEY = 'alert-resolve-job:{}'
+    EXPIRE = 24 * 60 * 60
+
+    KIND_ALERT = 'alert'
+    KIND_SECURITY = 'security'
+    MODELS = {
+        KIND_ALERT: (DeviceAllAlert, AllDeviceAlertFilter),
+        KIND_SECURITY: (SecurityEvent, SecurityEventFilter),
+    }
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, job_id: str, kind: str, params: str, data: Dict,
+                 user_id: Optional[int], chunk_size: Optional[int] = None):
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self.data = data
+        self.user_id = user_id
+        self.chunk_size = chunk_size or settings.ALERT_RESOLVE_CHUNK_SIZE
+        self.time_resolved = None
+        self.state = {
+            'job_id': job_id,
+            'status': self.STATUS_PENDING,
+            'total': 0,
+            'resolved': 0,
+            'progress': 0,
+            'first_id': '',
+            'max_id': None,
+        }
+
+    @property
+    def model(self) -> Type[models.Model]:
+        return self.MODELS[self.kind][0]
+
+    @classmethod
+    def create(cls, kind: str, params: str, data: Dict,
+               user_id: Optional[int]) -> 'BulkResolveJob':
+        job = cls(uuid.uuid4().hex, kind, params, data, user_id)
+        # 和列表接口一样校验筛选条件，不合法的条件会被django-filter忽略，
+        # 变成处理全部未处理的数据
+        filterset = job.filterset()
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        # 只处理提交时已经存在的数据，之后产生的告警不在这次处理的范围内
+        job.state['max_id'] = job.queryset().aggregate(
+            max_id=Max('id'))['max_id']
+        queryset = job.queryset()
+        first = queryset.first()
+        job.state['first_id'] = first.id if first else ''
+        job.state['total'] = queryset.count()
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional['BulkResolveJob']:
+        value = cache.get(cls.KEY.format(job_id))
+        if not value:
+            return None
+        value = json.loads(value)
+        job = cls(job_id, value['kind'], value['params'], value['data'],
+                  value['user_id'])
+        job.state = value['state']
+        return job
+
+    def save(self):
+        value = {
+            'kind': self.kind,
+            'params': self.params,
+            'data': self.data,
+            'user_id': self.user_id,
+            'state': self.state,
+        }
+        cache.set(self.KEY.format(self.job_id), json.dumps(value),
+                  ex=self.EXPIRE)
+
+    def filterset(self):
+        model, filter_class = self.MODELS[self.kind]
+        return filter_class(QueryDict(self.params),
+                            queryset=model.objects.all())
+
+    def queryset(self) -> models.QuerySet:
+        queryset = self.filterset().qs.filter(
+            status_resolved=self.model.STATUS_UNRESOLVED)
+        if self.state.get('max_id') is not None:
+            queryset = queryset.filter(id__lte=self.state['max_id'])
+        return queryset
+
+    def resolve_range(self, lower: int, upper: int) -> int:
+        """
+        处理[lower, upper)范围内符合筛选条件的数据，一条UPDATE语句完成
+        """
+        with transaction.atomic():
+            count = self.queryset().filter(
+                id__gte=lower, id__lt=upper).update(
+                status_resolved=self.data['status_resolved'],
+                des_resolved=self.data.get('des_resolved'),
+                user_id=self.user_id, time_resolved=self.time_resolved)
+            self.update_rollup(count)
+        return count
+
+    def update_rollup(self, count: int):
+        """
+        主视图每分钟才重新统计一次，处理完的数量先从最新的未处理总数里减掉
+        """
+        if not count or \
+                self.data['status_resolved'] != self.model.STATUS_RESOLVED:
+            return
+        main = MainView.objects.first()
+        if main:
+            MainView.objects.filter(id=main.id).update(
+                un_resolved=F('un_resolved') - count)
+
+    def run(self) -> Dict:
+        """
+        从最小的id开始分段处理，每段处理完更新一次进度
+        """
+        # 提交时没有符合条件的数据
+        if self.state.get('max_id') is None:
+            self.state.update(status=self.STATUS_FINISHED, progress=100)
+            self.save()
+            return self.state
+        bounds = self.queryset().aggregate(lower=Min('id'), upper=Max('id'))
+        lower, upper = bounds['lower'], bounds['upper']
+        if lower is None:
+            self.state.update(status=self.STATUS_FINISHED, progress=100)
+            self.save()
+            return self.state
+
+        self.time_resolved = timezone.localtime()
+        self.state['status'] = self.STATUS_RUNNING
+        self.save()
+        try:
+            start = lower
+            while start <= upper:
+                end = start + self.chunk_size
+                self.state['resolved'] += self.resolve_range(start, end)
+                self.state['progress'] = min(
+                    int((end - lower) * 100 / (upper - lower + 1)), 100)
+                self.save()
+                start = end
+        except Exception as e:
+            logger.error('bulk resolve job %s failed: %s', self.job_id, e)
+            self.state['status'] = self.STATUS_FAILED
+        else:
+            self.state['status'] = self.STATUS_FINISHED
+        self.save()
+        return self.state
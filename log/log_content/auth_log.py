@@ -82,7 +82,7 @@ class UpdateUserAuthLogGenerator(AuthLogMixin, LogGenerator, HookAbstract):
         super().generate_log()
         if self.method == 'PATCH':
             # 更新用户的时候，需要记录两条日志，一个是权限的修改，另一个是状态的修改
-            self.log_cls.objects.create(**self._get_data())
+            self.save_log(self._get_data())
         elif self.method == 'POST':
             event = UserEventLog(content=self.content)
             event.generate()
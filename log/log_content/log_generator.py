@@ -7,6 +7,7 @@ from django.db.models import Model
 from django.urls import resolve
 from rest_framework.response import Response
 
+from log.log_content.log_sink import audit_log_sink
 from log.models import UnifiedForumLog
 
 
@@ -70,7 +71,13 @@ class LogGenerator(ABC):
         return self.data_template
 
     def generate_log(self):
-        self.log_cls.objects.create(**self.get_data())
+        self.save_log(self.get_data())
+
+    def save_log(self, data: Dict):
+        """
+        日志交给后台线程批量写入，不阻塞请求
+        """
+        audit_log_sink.put(self.log_cls(**data))
 
     def _check_template(self):
         assert self.data_template is not None, (
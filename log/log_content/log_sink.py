@@ -0,0 +1,185 @@
+"""
+操作日志的异步写入：请求处理完之后日志只放进进程内的有界队列，后台线程按批次
+bulk_create写入数据库，请求不再等待日志的INSERT
+队列满了直接丢弃并计数，进程退出时把队列里剩下的日志写完
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Model
+
+from utils.unified_redis import cache
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogSink(object):
+    """
+    :param maxsize: 队列最多缓存的日志数，超过之后丢弃新的日志
+    :param batch_size: 每次bulk_create最多写入的日志数
+    :param interval: 队列里不满一批时最多等待的秒数
+    :param asynchronous: False时直接保存，不经过队列，用于测试和命令行
+    """
+    STATS_KEY = 'audit-log-sink'
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 200,
+                 interval: float = 1.0, asynchronous: bool = True):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.asynchronous = asynchronous
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        atexit.register(self.stop)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, log: Model) -> bool:
+        """
+        :return: 日志是否被接收，队列满了被丢弃时返回False
+        """
+        if not self.asynchronous:
+            log.save()
+            return True
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(log)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning('audit log queue is full, dropped %s logs',
+                           self.dropped)
+            return False
+        return True
+
+    def _ensure_writer(self):
+        """
+        第一次写日志时才启动写入线程；uwsgi等fork出的子进程没有父进程的线程，
+        按进程号判断需要重新启动
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.maxsize)
+                self._stopping.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take(self.interval)
+            if batch:
+                self.write(batch)
+                close_old_connections()
+
+    def _take(self, timeout: float) -> List[Model]:
+        """
+        阻塞等待第一条日志，之后在interval内凑满一批
+        """
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch: List[Model]):
+        """
+        按日志的模型分组bulk_create，写入失败的日志计入failed，不影响后面的批次
+        """
+        groups: Dict[type, List[Model]] = defaultdict(list)
+        for log in batch:
+            groups[type(log)].append(log)
+        for model, logs in groups.items():
+            try:
+                model.objects.bulk_create(logs, batch_size=self.batch_size)
+                self.written += len(logs)
+            except Exception as e:
+                self.failed += len(logs)
+                logger.error('failed to write %s audit logs: %s',
+                             len(logs), e)
+        self.report()
+
+    def flush(self):
+        """
+        把队列里的日志全部写入数据库
+        """
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self.write(batch)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        进程退出时停止写入线程，并写完队列里剩下的日志；
+        没有在本进程写过日志时队列里可能是fork前父进程的日志，不能重复写入
+        """
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            'depth': self.depth,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+        }
+
+    def report(self):
+        """
+        每个进程的队列长度和计数保存在redis的hash里，按进程号区分
+        """
+        try:
+            cache.hset(self.STATS_KEY, os.getpid(), json.dumps(
+                dict(self.stats(), time=time.time())))
+        except Exception as e:
+            logger.warning('failed to report audit log stats: %s', e)
+
+    @classmethod
+    def load_stats(cls) -> Dict[int, Dict]:
+        return {int(k): json.loads(v)
+                for k, v in cache.hgetall(cls.STATS_KEY).items()}
+
+
+audit_log_sink = AuditLogSink(
+    maxsize=settings.AUDIT_LOG_QUEUE_SIZE,
+    asynchronous=settings.AUDIT_LOG_ASYNC,
+)
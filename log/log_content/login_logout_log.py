@@ -8,7 +8,7 @@ from django.urls import resolve
 
 from log.log_content.log_generator import LogGenerator, LogConfig, HookAbstract
 from log.models import UnifiedForumLog, DeviceAllAlert
-from setting.models import Setting
+from setting.helpers import get_setting
 from user.models import UserExtension
 
 login_logout_config = LogConfig()
@@ -85,7 +85,7 @@ class LoginLogGenerator(LoginLogMixin, LogGenerator):
             )
         self.user_extension, _ = UserExtension.objects.get_or_create(
             name=self.user.username)
-        self.setting, setting_exist = Setting.objects.get_or_create(id=1)
+        self.setting = get_setting()
         if self.user_extension.count >= self.setting.lockout_threshold:
             content = self.fail_content_template.format(
                 threshold=self.setting.lockout_threshold,
@@ -5,6 +5,7 @@ from typing import List, Tuple
 
 from log.log_content.log_generator import LogGenerator, LogConfig, HookAbstract
 from log.models import UnifiedForumLog
+from setting.helpers import get_setting
 from setting.models import Setting
 from log.security_event import IPSettingLog
 
@@ -90,7 +91,7 @@ class SettingLogGenerator(SystemLogMixin, LogGenerator):
         for key in data.keys():
             template = self.get_data()
             template['content'] = self._get_content(key, data[key])
-            self.log_cls.objects.create(**template)
+            self.save_log(template)
 
 
 @system_config.register('system-security', 'PATCH')
@@ -123,7 +124,7 @@ class SettingLogGenerator(SystemLogMixin, LogGenerator):
         for key in data.keys():
             template = self.get_data()
             template['content'] = self._get_content(key, data[key])
-            self.log_cls.objects.create(**template)
+            self.save_log(template)
 
 
 @system_config.register('ip-limit', 'PATCH', additional_info=True)
@@ -157,8 +158,7 @@ class IpLimitLogGenerator(SystemLogMixin, LogGenerator, HookAbstract):
 
     @classmethod
     def get_previous(cls, request):
-        setting = Setting.objects.get()
-        return {'item': setting}
+        return {'item': get_setting()}
 
     def get_add_delete(self) -> Tuple[List[IP], List[IP]]:
         """
@@ -3,7 +3,7 @@ from django.contrib.auth.models import AnonymousUser, User
 from base_app.models import Device
 from base_app.serializers import BatchOperationSerializer
 from log.models import UnifiedForumLog, DeviceAllAlert
-from setting.models import Setting
+from setting.helpers import get_setting
 from user.models import UserExtension
 from utils.helper import format_log_time
 
@@ -331,7 +331,7 @@ class LoginGenerator(LogGenerator):
 
         if user:
             current_ip = self.request.META.get("REMOTE_ADDR")
-            setting, setting_existe = Setting.objects.get_or_create(id=1)
+            setting = get_setting()
             ip_illegal = setting.ip_limit_enable and (current_ip in setting.allow_ip)
 
             if (user_ext and user_ext.banned is True) or ip_illegal:
@@ -357,7 +357,7 @@ class LoginGenerator(LogGenerator):
             user_exists = User.objects.filter(username=username).exists()
 
             if user_exists and user_ext.count >= 5:
-                setting, setting_exist = Setting.objects.get_or_create(id=1)
+                setting = get_setting()
                 lock_duration = setting.lockout_duration
                 fail_content_template = '{} 登录失败达到上限，账号锁定{}分钟'. \
                     format(username, lock_duration)
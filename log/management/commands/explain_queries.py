@@ -0,0 +1,141 @@
+"""
+对应用里高频的告警、日志查询执行EXPLAIN，找出大表上的顺序扫描
+查询只用来生成SQL，不会真正执行：第一条SQL被截获之后就中止，改为执行EXPLAIN
+"""
+import json
+from datetime import timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from auditor.models import AuditSecAlert, AuditSysAlert
+from firewall.models import FirewallSecEvent
+from log.models import DeviceAllAlert, SecurityEvent, UnifiedForumLog
+
+
+def _since(**kwargs):
+    return timezone.now() - timedelta(**kwargs)
+
+
+# (名称, 执行查询的函数)，和home/views.py、statistic/tasks.py、列表接口里的查询保持一致
+QUERY_CATALOGUE: List[Tuple[str, Callable]] = [
+    ('告警-未处理数', lambda: DeviceAllAlert.objects.filter(
+        status_resolved=DeviceAllAlert.STATUS_UNRESOLVED).count()),
+    ('告警-未处理高级告警数', lambda: DeviceAllAlert.objects.filter(
+        status_resolved=DeviceAllAlert.STATUS_UNRESOLVED,
+        level=DeviceAllAlert.LEVEL_HIGH).count()),
+    ('告警-24小时未处理数', lambda: DeviceAllAlert.objects.filter(
+        occurred_time__gte=_since(days=1),
+        status_resolved=DeviceAllAlert.STATUS_UNRESOLVED).count()),
+    ('告警-7天告警数', lambda: DeviceAllAlert.objects.filter(
+        occurred_time__gte=_since(days=7)).count()),
+    ('告警-资产最近告警', lambda: list(DeviceAllAlert.objects.filter(
+        device_id=1, occurred_time__gte=_since(days=1))[:10])),
+    ('告警-类型趋势', lambda: list(DeviceAllAlert.objects.filter(
+        occurred_time__gte=_since(days=1)).values('category', 'type'))),
+    ('告警-列表', lambda: list(DeviceAllAlert.objects.order_by('-id')[:10])),
+    ('安全事件-未处理数', lambda: SecurityEvent.objects.filter(
+        status_resolved=SecurityEvent.STATUS_UNRESOLVED).count()),
+    ('安全事件-是否已产生', lambda: SecurityEvent.objects.filter(
+        device_id=1, category=SecurityEvent.CATEGORY_OPERATION,
+        type=SecurityEvent.TYPE_ASSETS, occurred_time__gte=_since(days=1)
+    ).exists()),
+    ('本机日志-列表', lambda: list(UnifiedForumLog.objects.filter(
+        category=UnifiedForumLog.CATEGORY_OPERATION,
+        type__in=UnifiedForumLog.OPERATOR_TYPE)[:10])),
+    ('审计安全告警-时间范围', lambda: AuditSecAlert.objects.filter(
+        last_at__gte=_since(days=1), last_at__lt=timezone.now()).count()),
+    ('审计安全告警-最近未读', lambda: list(AuditSecAlert.objects.filter(
+        is_read=False).order_by('-occurred_time')[:10])),
+    ('审计系统告警-时间范围', lambda: AuditSysAlert.objects.filter(
+        occurred_time__gte=_since(days=1),
+        occurred_time__lt=timezone.now()).count()),
+    ('防火墙安全事件-最近未读', lambda: list(FirewallSecEvent.objects.filter(
+        is_read=False).order_by('-occurred_time')[:10])),
+    ('防火墙安全事件-时间范围', lambda: FirewallSecEvent.objects.filter(
+        occurred_time__gte=_since(days=1),
+        occurred_time__lt=timezone.now()).count()),
+]
+
+
+class CapturedQuery(Exception):
+    def __init__(self, sql: str, params):
+        super().__init__(sql)
+        self.sql = sql
+        self.params = params
+
+
+def capture(func: Callable) -> Optional[Tuple[str, tuple]]:
+    """
+    截获func执行的第一条SQL，不在数据库里执行
+    """
+    def wrapper(execute, sql, params, many, context):
+        raise CapturedQuery(sql, params)
+
+    with connection.execute_wrapper(wrapper):
+        try:
+            func()
+        except CapturedQuery as e:
+            return e.sql, e.params
+    return None
+
+
+def explain(sql: str, params) -> Dict:
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def seq_scans(plan: Dict) -> Iterator[str]:
+    """
+    执行计划里所有顺序扫描的表名
+    """
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def table_rows(table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                       [table])
+        row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+class Command(BaseCommand):
+    help = '对告警、日志的常用查询执行EXPLAIN，标记行数超过阈值的表上的顺序扫描'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=100000,
+                            help='表的估算行数达到多少时顺序扫描需要标记')
+        parser.add_argument('--fail', action='store_true',
+                            help='有需要标记的顺序扫描时返回错误，用于部署检查')
+
+    def handle(self, *args, **options):
+        min_rows = options['min_rows']
+        flagged = []
+        for name, func in QUERY_CATALOGUE:
+            captured = capture(func)
+            if captured is None:
+                continue
+            plan = explain(*captured)
+            self.stdout.write('{}: {} cost={} rows={}'.format(
+                name, plan['Node Type'], plan['Total Cost'],
+                plan['Plan Rows']))
+            for table in set(seq_scans(plan)):
+                rows = table_rows(table)
+                if rows >= min_rows:
+                    flagged.append(name)
+                    self.stdout.write(self.style.WARNING(
+                        '  顺序扫描 {} (约{}行)'.format(table, rows)))
+
+        if flagged and options['fail']:
+            raise CommandError('{}个查询在大表上顺序扫描: {}'.format(
+                len(flagged), ', '.join(flagged)))
@@ -8,6 +8,7 @@ from django.utils import timezone
 
 from base_app.models import EventLog
 from base_app.models import Log, Device
+from utils.partition import partition_register
 from utils.validators import MAC_VALIDATOR
 from user.models import User
 
@@ -15,6 +16,8 @@ MACAddrValidator = RegexValidator(regex=r'^([0-9A-F]{2}:){5}[0-9A-F]{2}$',
                                   message='Enter a valid MAC address, for example "12:AD:34:EC:4D:1B".')
 
 
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class UnifiedForumLog(Log):
     """
     合并原来的登录日志，授权日志，以及管理日志三个部分
@@ -98,6 +101,14 @@ class UnifiedForumLog(Log):
     class Meta:
         verbose_name = '本机日志'
         ordering = ['-occurred_time', 'id']
+        indexes = [
+            # 列表默认排序和keyset分页
+            models.Index(fields=['-occurred_time', 'id'],
+                         name='forumlog_time_id_idx'),
+            # 按日志类别、类型过滤的列表
+            models.Index(fields=['category', 'type', '-occurred_time'],
+                         name='forumlog_cate_type_time_idx'),
+        ]
 
     def __str__(self):
         return '{} {} {}'.format(self.id, self.user, self.get_type_display())
@@ -224,6 +235,8 @@ class ReportLog(models.Model):
         return '{} {}'.format(self.id, self.occurred_time)
 
 
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class DeviceAllAlert(Log):
     FIREWALL_ACTION_PASS = 0
     FIREWALL_ACTION_WARNING = 1
@@ -422,6 +435,16 @@ class DeviceAllAlert(Log):
     class Meta:
         verbose_name = '设备所有告警'
         ordering = ['id']
+        indexes = [
+            # 首页和统计里按时间范围计数、分组
+            models.Index(fields=['occurred_time'], name='alert_time_idx'),
+            models.Index(fields=['device', 'occurred_time'],
+                         name='alert_device_time_idx'),
+            # 未处理的告警只占很少一部分，部分索引覆盖未处理总数、未处理高级告警数
+            models.Index(fields=['level', 'occurred_time'],
+                         name='alert_unresolved_idx',
+                         condition=models.Q(status_resolved=0)),
+        ]
 
     def __str__(self):
         return '{} {}'.format(self.id, self.get_type_display())
@@ -505,6 +528,14 @@ class SecurityEvent(models.Model):
     class Meta:
         verbose_name = '安全事件'
         ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['occurred_time'], name='secevent_time_idx'),
+            # 判断同一资产是否已经产生过同样的事件
+            models.Index(fields=['device', 'occurred_time'],
+                         name='secevent_device_time_idx'),
+            models.Index(fields=['level'], name='secevent_unresolved_idx',
+                         condition=models.Q(status_resolved=0)),
+        ]
 
 
 class AlertDistribution(models.Model):
@@ -1,9 +1,10 @@
+import threading
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, time, timedelta
 
 from django.utils import timezone
-from django.db.models import Avg
+from django.db.models import Avg, Q
 
 from log.models import SecurityEvent
 from base_app.models import Device
@@ -27,13 +28,22 @@ class EventLog(ABC):
         self.content = self.get_content(**kwargs)
 
     def generate(self) -> SecurityEvent:
-        return SecurityEvent.objects.create(
+        """
+        在EventCollector里产生的事件先放在收集器里，退出时批量写入
+        """
+        event = SecurityEvent(
             device=self.device,
             level=self.level,
             category=self.category,
             type=self.type,
             content=self.content
         )
+        collector = EventCollector.current()
+        if collector:
+            collector.add(event)
+        else:
+            event.save()
+        return event
 
     def get_content(self, **kwargs) -> str:
         return kwargs.get('content')
@@ -46,6 +56,147 @@ class EventLog(ABC):
     def exists(self, **kwargs):
         return self.get_queryset(**kwargs).exists()
 
+    def occurred_since(self, since: datetime, device_id: Optional[int] = None
+                       ) -> bool:
+        """
+        since之后是否已经有同样的事件，用于去重
+        在EventCollector里时查内存中的索引，不再每个事件查一次数据库
+        """
+        collector = EventCollector.current()
+        if collector:
+            occurred = collector.occurred_since(self, since, device_id)
+            if occurred is not None:
+                return occurred
+        kwargs = {'content': self.content, 'occurred_time__gte': since}
+        if device_id:
+            kwargs['device_id'] = device_id
+        return self.exists(**kwargs)
+
+
+class EventCollector(object):
+    """
+    一次任务运行期间的安全事件收集器
+    进入时一次查询加载时间窗口内已经存在的事件作为去重索引，期间产生的事件先放在内存里，
+    退出时bulk_create批量写入，并且只推送一次websocket消息
+
+    with EventCollector(current):
+        for device in devices:
+            ProcessEvent(count, current, device=device).generate()
+    """
+    _local = threading.local()
+
+    def __init__(self, since: datetime, kinds: Optional[List] = None,
+                 notify: bool = True, batch_size: int = 500):
+        """
+        :param since: 去重索引加载的开始时间，早于这个时间的去重检查仍然查数据库
+        :param kinds: 需要去重的事件类，只加载这些类别的事件，None表示所有事件，
+        不需要去重时传[]，不查询数据库
+        :param notify: 有新事件时是否推送websocket消息
+        """
+        self.since = since
+        self.kinds = None if kinds is None else {
+            (k.category, k.type, k.level) for k in kinds}
+        self.notify = notify
+        self.batch_size = batch_size
+        # (category, type, level, device_id, content) -> 最近一次发生的时间
+        self._index: Dict[Tuple, datetime] = {}
+        self._events: List[SecurityEvent] = []
+        self._previous: Optional[EventCollector] = None
+
+    @classmethod
+    def current(cls) -> Optional['EventCollector']:
+        return getattr(cls._local, 'collector', None)
+
+    @classmethod
+    def key(cls, category: int, type_: int, level: int,
+            device_id: Optional[int], content: Optional[str]) -> Tuple:
+        return category, type_, level, device_id, content
+
+    def __enter__(self) -> 'EventCollector':
+        self.load()
+        self._previous = self.current()
+        self._local.collector = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.collector = self._previous
+        self._previous = None
+        self.flush()
+
+    def load(self):
+        self._index = {}
+        if self.kinds is not None and not self.kinds:
+            return
+        events = SecurityEvent.objects.filter(occurred_time__gte=self.since)
+        if self.kinds is not None:
+            condition = Q()
+            for category, type_, level in self.kinds:
+                condition |= Q(category=category, type=type_, level=level)
+            events = events.filter(condition)
+        events = events.values_list(
+            'category', 'type', 'level', 'device_id', 'content',
+            'occurred_time')
+        for *key, occurred_time in events:
+            self.index(self.key(*key), occurred_time)
+
+    def index(self, key: Tuple, occurred_time: datetime):
+        last = self._index.get(key)
+        if not last or last < occurred_time:
+            self._index[key] = occurred_time
+
+    def occurred_since(self, event: EventLog, since: datetime,
+                       device_id: Optional[int] = None) -> Optional[bool]:
+        """
+        :return: 是否已经有同样的事件，since早于索引的加载范围或者事件类别没有加载时
+        返回None，由调用方查数据库
+        """
+        if since < self.since:
+            return None
+        if self.kinds is not None and \
+                (event.category, event.type, event.level) not in self.kinds:
+            return None
+        last = self._index.get(self.key(
+            event.category, event.type, event.level, device_id, event.content))
+        return bool(last and last >= since)
+
+    def add(self, event: SecurityEvent):
+        if not event.occurred_time:
+            event.occurred_time = timezone.now()
+        self._events.append(event)
+        self.index(self.key(event.category, event.type, event.level,
+                            event.device_id, event.content),
+                   event.occurred_time)
+
+    def flush(self) -> List[SecurityEvent]:
+        """
+        批量写入收集到的事件
+        :return: 写入的事件
+        """
+        events, self._events = self._events, []
+        if not events:
+            return events
+        events = SecurityEvent.objects.bulk_create(
+            events, batch_size=self.batch_size)
+        if self.notify:
+            self.send_message(events)
+        return events
+
+    @classmethod
+    def send_message(cls, events: List[SecurityEvent]):
+        # statistic.serializers引用了本模块，这里延迟导入
+        from log.models import DeviceAllAlert
+        from statistic.serializers import AlertProcessSerializer
+        from utils.helper import send_websocket_message
+
+        message = {
+            'message': 'main',
+            'data': {
+                'alert_process': AlertProcessSerializer(
+                    DeviceAllAlert.objects.all()).data,
+            }
+        }
+        send_websocket_message('main', message)
+
 
 class AssetsEventLog(EventLog):
     """
@@ -238,10 +389,9 @@ class NetworkEvent(EventLog):
     def generate(self) -> Optional[SecurityEvent]:
         current = timezone.now()
         last = current - timedelta(minutes=self.duration)
-        if self.get_queryset(content=self.content, occurred_time__gt=last
-                             ).exists():
+        if self.occurred_since(last):
             return None
-        super().generate()
+        return super().generate()
 
 
 class SecurityEventLog(EventLog):
@@ -350,9 +500,7 @@ class LogAbnormalEvent(EventLog):
         今天已经有安全事件或者数据不异常，就不用生成安全事件
         :return:
         """
-        if self.get_queryset(
-                content=self.content, occurred_time__gte=self.today
-        ).exists() or not self.is_abnormal():
+        if self.occurred_since(self.today) or not self.is_abnormal():
             return None
         return super().generate()
 
@@ -364,11 +512,17 @@ class ProcessEvent(EventLog):
     category = SecurityEvent.CATEGORY_OPERATION
     type = SecurityEvent.TYPE_ASSETS
     level = SecurityEvent.LEVEL_MEDIUM
+    window = timedelta(hours=7)
 
-    def __init__(self, count: int, current: datetime, *args, **kwargs):
+    def __init__(self, count: int, current: datetime, *args,
+                 average: Optional[float] = None, **kwargs):
+        """
+        :param average: 已经批量计算好的平均进程数，为None时单独查询这个资产的平均值
+        """
         self.count = count
         self.current = current
         self.today = get_today(current)
+        self.average = average
         super().__init__(*args, **kwargs)
 
     def get_content(self, **kwargs) -> str:
@@ -379,10 +533,7 @@ class ProcessEvent(EventLog):
         每天只产生一条
         :return:
         """
-        if self.exists(
-                device_id=self.device.id, content=self.content,
-                occurred_time__gte=self.today
-        ):
+        if self.occurred_since(self.today, device_id=self.device.id):
             return None
         if not self.is_abnormal():
             return None
@@ -394,12 +545,32 @@ class ProcessEvent(EventLog):
         7天平均 * 2 < 今日 ==> 异常
         :return:
         """
-        avg = SNMPData.objects.filter(
-            device=self.device,
-            update_time__gte=self.current-timedelta(hours=7),
-            update_time__lt=self.current
-        ).aggregate(process=Avg('process_count'))
-        process_count = avg['process'] or 0
+        process_count = self.average
+        if process_count is None:
+            avg = SNMPData.objects.filter(
+                device=self.device,
+                update_time__gte=self.current - self.window,
+                update_time__lt=self.current
+            ).aggregate(process=Avg('process_count'))
+            process_count = avg['process'] or 0
         if process_count * 2 < self.count:
             return True
         return False
+
+    @classmethod
+    def averages(cls, device_ids: List[int], current: datetime
+                 ) -> Dict[int, float]:
+        """
+        一次分组查询所有资产的平均进程数，没有数据的资产平均值为0
+        :return: {资产ID: 平均进程数}
+        """
+        rows = SNMPData.objects.filter(
+            device_id__in=device_ids,
+            update_time__gte=current - cls.window,
+            update_time__lt=current
+        ).values('device_id').annotate(
+            process=Avg('process_count')).order_by()
+        result = {i: 0 for i in device_ids}
+        for row in rows:
+            result[row['device_id']] = row['process'] or 0
+        return result
@@ -1,18 +1,21 @@
 import os
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
 
 from celery import shared_task
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
 from base_app.models import Device
+from log.alert_resolve import BulkResolveJob
 from log.models import UnifiedForumLog
-from log.security_event import UnModifiedPasswordEvent, AssetsOfflineEvent
-from setting.models import Setting
+from log.security_event import UnModifiedPasswordEvent, AssetsOfflineEvent, \
+    EventCollector
+from setting.helpers import get_setting
 from statistic.serializers import MonitorCenterSerializer, \
     AssetsCenterSerializer, DeviceDistributionSerializer, AssetsIPSerializer, DeviceCountSerializer, RiskDeviceTopFiveSerializer
 from user.models import UserExtension
 from utils.helper import send_websocket_message
+from utils.ping import pinger, BatchPinger
 
 User = get_user_model()
 
@@ -30,6 +33,22 @@ def get_pwd_log_data(user: User, pwd_modified_duration: int):
 
 
 def ping_status(host):
+    return ping_hosts([host])[host]
+
+
+def ping_hosts(hosts: Iterable[str]) -> Dict[str, bool]:
+    """
+    一个ICMP socket批量ping所有主机，没有权限创建对应协议族的ICMP socket的主机
+    退回到ping命令
+    :return: {ip: 是否在线}
+    """
+    batch, others = BatchPinger.split(hosts)
+    result = {host: r.alive for host, r in pinger.ping(batch).items()}
+    result.update({host: _ping_command(host) for host in others})
+    return result
+
+
+def _ping_command(host):
     cmd = 'ping  -c 2 -t 5 {}'.format(host)
     result = os.popen(cmd).read()
     if 'ttl' in result:
@@ -38,25 +57,44 @@ def ping_status(host):
         return False
 
 
-# 检查 dvice 的状态，并更改其是否可以产生告警信息
-def update_device_alert_status(d: Device):
-
-    last_status = d.status
-    ping_status_now = ping_status(d.ip)
-    d.alert_status = False
+def device_status(last_status: int, ping_status_now: bool) -> Tuple[int, bool]:
+    """
+    根据ping的结果计算资产的状态，在线的资产ping不通时需要产生离线告警
+    :return: (status, alert_status)
+    """
+    status = last_status
+    alert_status = False
 
     if last_status == Device.ONLINE:
         if not ping_status_now:
-            d.alert_status = True
-            d.status = Device.OFFLINE
+            alert_status = True
+            status = Device.OFFLINE
     if ping_status_now:
-        d.status = Device.ONLINE
+        status = Device.ONLINE
+    return status, alert_status
+
+
+# 检查 dvice 的状态，并更改其是否可以产生告警信息
+def update_device_alert_status(d: Device, ping_status_now: Optional[bool] = None):
+    if ping_status_now is None:
+        ping_status_now = ping_status(d.ip)
+    d.status, d.alert_status = device_status(d.status, ping_status_now)
     d.save(update_fields=['alert_status', 'status'])
 
 
+@shared_task
+def bulk_resolve_alert(job_id: str):
+    """
+    后台批量处理筛选条件下的告警，进度通过BulkResolveJob.load查询
+    """
+    job = BulkResolveJob.load(job_id)
+    if job:
+        job.run()
+
+
 @shared_task
 def check_user_pwd_modified():
-    setting, exists = Setting.objects.get_or_create(id=1)
+    setting = get_setting()
     pwd_modified_duration = setting.change_psw_duration # 天
     all_users = User.objects.all()
 
@@ -79,14 +117,44 @@ def check_user_pwd_modified():
 
 
 def check_device_status_task():
-    all_devices = Device.objects.all()
-    pool = ThreadPoolExecutor(20)
-
-    tasks = []
-    for dev in all_devices:
-        tasks.append(pool.submit(device_offline_event, dev))
-    for t in tasks:
-        t.result()
+    """
+    资产心跳检查
+    批量ping所有资产，和数据库里上一次的状态比较，只用一次bulk_update更新状态有变化的
+    资产，资产在线状态有变化时才推送大屏和资产中心的数据
+    """
+    last_known = {
+        id_: (ip, status, alert_status)
+        for id_, ip, status, alert_status in Device.objects.values_list(
+            'id', 'ip', 'status', 'alert_status')
+    }
+    statuses = ping_hosts({ip for ip, _, _ in last_known.values()})
+
+    changed = {}
+    status_changed = False
+    for id_, (ip, status, alert_status) in last_known.items():
+        current = device_status(status, statuses[ip])
+        if current != (status, alert_status):
+            changed[id_] = current
+            status_changed = status_changed or current[0] != status
+    if not changed:
+        return
+
+    devices = Device.objects.in_bulk(list(changed))
+    for id_, device in devices.items():
+        device.status, device.alert_status = changed[id_]
+    Device.objects.bulk_update(devices.values(), ['status', 'alert_status'],
+                               batch_size=500)
+    with EventCollector(timezone.now(), kinds=[]):
+        for device in devices.values():
+            if device.alert_status:
+                event = AssetsOfflineEvent(device=device)
+                event.generate()
+
+    if status_changed:
+        send_device_status_message()
+
+
+def send_device_status_message():
     # 心跳检查之后推送最新的资产数据
     serializer = MonitorCenterSerializer(Device.objects.all())
     assets_serializer = AssetsCenterSerializer(Device.objects.all())
@@ -111,8 +179,8 @@ def check_device_status_task():
     send_websocket_message('assets', assets)
 
 
-def device_offline_event(device: Device):
-    update_device_alert_status(device)
+def device_offline_event(device: Device, ping_status_now: Optional[bool] = None):
+    update_device_alert_status(device, ping_status_now)
     if device.alert_status:
         event = AssetsOfflineEvent(device=device)
         event.generate()
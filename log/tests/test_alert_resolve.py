@@ -0,0 +1,101 @@
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework.test import APIClient
+
+from base_app.factory_data import DeviceFactory
+from log import views
+from log.alert_resolve import BulkResolveJob
+from log.factory_data import DeviceAllAlertFactory
+from log.models import DeviceAllAlert
+from statistic.models import MainView
+from utils.base_testcase import BaseViewTest
+
+
+class TestBulkResolveJob(BaseViewTest):
+    def test_run_chunks(self):
+        device = DeviceFactory.create_normal(name='批量处理')
+        DeviceAllAlertFactory.create_batch(
+            12, device=device, level=1, status_resolved=0)
+        DeviceAllAlertFactory.create_batch(
+            3, device=device, level=2, status_resolved=0)
+        main = MainView.objects.create(
+            alert_count=15, un_resolved=15, log_count=0,
+            update_time=timezone.now())
+
+        job = BulkResolveJob.create(
+            BulkResolveJob.KIND_ALERT, urlencode({'level': 1}),
+            {'status_resolved': 1, 'des_resolved': '分段处理'}, None)
+        job.chunk_size = 5
+        state = job.run()
+
+        assert state['status'] == BulkResolveJob.STATUS_FINISHED
+        assert state['total'] == state['resolved'] == 12
+        assert state['progress'] == 100
+        assert DeviceAllAlert.objects.filter(
+            device=device, status_resolved=1, des_resolved='分段处理').count() == 12
+        assert DeviceAllAlert.objects.filter(
+            device=device, level=2, status_resolved=0).count() == 3
+        assert MainView.objects.get(id=main.id).un_resolved == 3
+        assert BulkResolveJob.load(job.job_id).state == state
+
+    def test_skip_alerts_after_submit(self):
+        """
+        后台任务开始执行之前产生的新告警，不在提交时的处理范围内
+        """
+        DeviceAllAlertFactory.create_batch(
+            3, sec_desc='提交之后', status_resolved=0)
+        job = BulkResolveJob.create(
+            BulkResolveJob.KIND_ALERT, urlencode({'sec_desc': '提交之后'}),
+            {'status_resolved': 1, 'des_resolved': ''}, None)
+        late = DeviceAllAlertFactory.create(
+            sec_desc='提交之后', status_resolved=0)
+
+        state = BulkResolveJob.load(job.job_id).run()
+
+        assert state['resolved'] == 3
+        assert DeviceAllAlert.objects.get(id=late.id).status_resolved == 0
+
+    def test_invalid_filter(self, security_client: APIClient):
+        """
+        筛选条件不合法时返回400，不处理任何数据
+        """
+        DeviceAllAlertFactory.create_batch(3, status_resolved=0)
+        count = DeviceAllAlert.objects.filter(status_resolved=0).count()
+
+        response = security_client.put(
+            reverse('resolve-all-alert') + '?' +
+            urlencode({'start_time': '2020-13-45 10:00'}),
+            data={'des_resolved': '不合法', 'status_resolved': 1},
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert DeviceAllAlert.objects.filter(
+            status_resolved=0).count() == count
+
+    def test_resolve_in_background(self, security_client: APIClient,
+                                   settings, monkeypatch):
+        """
+        超过同步处理的数量时交给后台任务，返回job_id查询进度
+        """
+        settings.ALERT_RESOLVE_SYNC_LIMIT = 5
+        started = []
+        monkeypatch.setattr(views.bulk_resolve_alert, 'delay',
+                            lambda job_id: started.append(job_id))
+        DeviceAllAlertFactory.create_batch(10, level=1, status_resolved=0)
+
+        response = security_client.put(
+            reverse('resolve-all-alert') + '?level=1',
+            data={'des_resolved': '后台处理', 'status_resolved': 1},
+            format='json'
+        )
+
+        job_id = response.data['job_id']
+        assert started == [job_id]
+        assert response.data['detail']
+        response = security_client.get(
+            reverse('resolve-alert-job', args=(job_id, )))
+        assert response.data['status'] == BulkResolveJob.STATUS_PENDING
+        assert response.data['total'] == DeviceAllAlert.objects.filter(
+            level=1, status_resolved=0).count()
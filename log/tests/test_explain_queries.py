@@ -0,0 +1,37 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from log.management.commands.explain_queries import QUERY_CATALOGUE, \
+    capture, seq_scans
+from log.models import DeviceAllAlert
+
+
+class TestSeqScans:
+    def test_nested(self):
+        plan = {
+            'Node Type': 'Nested Loop',
+            'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'a'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'b', 'Plans': [
+                    {'Node Type': 'Seq Scan', 'Relation Name': 'c'},
+                ]},
+            ],
+        }
+        assert list(seq_scans(plan)) == ['a', 'c']
+
+
+@pytest.mark.django_db
+class TestExplainQueries:
+    def test_capture(self):
+        sql, _ = capture(lambda: DeviceAllAlert.objects.filter(
+            level=DeviceAllAlert.LEVEL_HIGH).count())
+        assert 'COUNT' in sql.upper()
+
+    def test_command(self):
+        out = StringIO()
+        call_command('explain_queries', min_rows=0, stdout=out)
+        output = out.getvalue()
+        for name, _ in QUERY_CATALOGUE:
+            assert name in output
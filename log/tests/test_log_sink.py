@@ -0,0 +1,50 @@
+import pytest
+
+from log.log_content.log_sink import AuditLogSink
+from log.models import UnifiedForumLog
+
+
+def make_log(content: str) -> UnifiedForumLog:
+    return UnifiedForumLog(content=content, user='admin', ip='127.0.0.1',
+                           category=UnifiedForumLog.CATEGORY_OPERATION,
+                           type=UnifiedForumLog.TYPE_SYSTEM, result=True)
+
+
+@pytest.mark.django_db
+class TestAuditLogSink:
+    @pytest.fixture
+    def sink(self, monkeypatch) -> AuditLogSink:
+        # 测试的数据库事务对写入线程不可见，不启动线程，直接调用flush写入
+        sink = AuditLogSink(maxsize=3, batch_size=2)
+        monkeypatch.setattr(sink, '_ensure_writer', lambda: None)
+        return sink
+
+    def test_flush(self, sink: AuditLogSink):
+        for i in range(3):
+            assert sink.put(make_log('sink-{}'.format(i)))
+        assert sink.depth == 3
+        assert not UnifiedForumLog.objects.filter(
+            content__startswith='sink-').exists()
+
+        sink.flush()
+
+        assert sink.depth == 0
+        assert sink.written == 3
+        assert UnifiedForumLog.objects.filter(
+            content__startswith='sink-').count() == 3
+        assert AuditLogSink.load_stats()
+
+    def test_drop(self, sink: AuditLogSink):
+        for i in range(5):
+            sink.put(make_log('sink-{}'.format(i)))
+
+        assert sink.depth == 3
+        assert sink.dropped == 2
+        assert sink.stats()['dropped'] == 2
+
+    def test_synchronous(self):
+        sink = AuditLogSink(asynchronous=False)
+        sink.put(make_log('sink-sync'))
+
+        assert sink.depth == 0
+        assert UnifiedForumLog.objects.filter(content='sink-sync').exists()
@@ -3,11 +3,15 @@ from datetime import timedelta
 import pytest
 from django.utils import timezone
 
+from base_app.factory_data import DeviceFactory
+from base_app.models import Device
 from log.models import UnifiedForumLog
 from user.models import User, Group, UserExtension
 from utils.base_testcase import BaseUser
 from setting.models import Setting
-from log.tasks import check_user_pwd_modified
+from log.tasks import check_user_pwd_modified, check_device_status_task, \
+    device_status
+from utils.ping import BatchPinger
 
 
 @pytest.mark.django_db
@@ -41,3 +45,33 @@ class TestCheckUserPassword:
         )
         assert log.exists()
 
+
+@pytest.mark.django_db
+class TestCheckDeviceStatus:
+    def test_device_status(self):
+        assert device_status(Device.ONLINE, False) == (Device.OFFLINE, True)
+        assert device_status(Device.OFFLINE, False) == (Device.OFFLINE, False)
+        assert device_status(Device.OFFLINE, True) == (Device.ONLINE, False)
+
+    @pytest.mark.skipif(not BatchPinger.available(),
+                        reason='没有创建ICMP socket的权限')
+    def test_only_changed_devices_written(self, django_assert_num_queries):
+        Device.objects.all().delete()
+        online = DeviceFactory.create_normal(ip='127.0.0.1',
+                                             status=Device.OFFLINE)
+        offline = DeviceFactory.create_normal(ip='255.255.255.255',
+                                              status=Device.ONLINE)
+
+        check_device_status_task()
+        online.refresh_from_db()
+        offline.refresh_from_db()
+        assert online.status == Device.ONLINE
+        assert (offline.status, offline.alert_status) == (Device.OFFLINE, True)
+
+        check_device_status_task()
+        offline.refresh_from_db()
+        assert offline.alert_status is False
+
+        # 状态没有变化时只查询一次，不更新也不推送
+        with django_assert_num_queries(1):
+            check_device_status_task()
@@ -17,7 +17,8 @@ from statistic.factory_data import SystemRunningFactory, LogStatisticDayFactory
 from log.factory_data import DeviceAllAlertFactory, SecurityEventFactory
 from log.models import DeviceAllAlert
 from snmp.snmp_run import SNMPClient
-from snmp.factory_data import SNMPSettingFactory
+from snmp.factory_data import SNMPSettingFactory, SNMPDataFactory
+from snmp.models import SNMPData
 
 
 @pytest.fixture(scope='class')
@@ -246,4 +247,72 @@ class TestLogAbnormalEvent:
         event = LogAbnormalEvent(200, last)
         event.generate()
 
-        assert LogAbnormalEvent.get_queryset(content='今日日志数量异常').exists()
\ No newline at end of file
+        assert LogAbnormalEvent.get_queryset(content='今日日志数量异常').exists()
+
+
+@pytest.mark.django_db
+class TestEventCollector:
+    def test_dedupe_in_memory(self, django_assert_num_queries):
+        current = timezone.now()
+        NetworkEvent(name='LAN1').generate()
+
+        collector = EventCollector(
+            current - timedelta(minutes=NetworkEvent.duration),
+            kinds=[NetworkEvent], notify=False)
+        with django_assert_num_queries(2):
+            # 进入时加载一次去重索引，退出时批量写入一次
+            with collector:
+                for name in ['LAN1', 'LAN2', 'LAN2', 'LAN3']:
+                    NetworkEvent(name=name).generate()
+
+        assert NetworkEvent.get_queryset(content='LAN1网口连接异常').count() == 1
+        assert NetworkEvent.get_queryset(content='LAN2网口连接异常').count() == 1
+        assert NetworkEvent.get_queryset(content='LAN3网口连接异常').count() == 1
+
+    def test_not_loaded_kind(self):
+        """
+        没有加载到索引里的事件类别仍然查数据库去重
+        """
+        device = DeviceFactory.create_normal()
+        current = timezone.now()
+        ProcessEvent(100, current, device=device).generate()
+
+        with EventCollector(current, kinds=[], notify=False):
+            ProcessEvent(100, current, device=device).generate()
+        assert ProcessEvent.get_queryset(device=device).count() == 1
+
+    def test_notify_once(self, monkeypatch):
+        sent = []
+        monkeypatch.setattr(EventCollector, 'send_message',
+                            classmethod(lambda cls, events: sent.append(events)))
+        device = DeviceFactory.create_normal()
+
+        with EventCollector(timezone.now(), kinds=[]):
+            for _ in range(3):
+                AssetsOfflineEvent(device=device).generate()
+            assert not AssetsOfflineEvent.get_queryset(device=device).exists()
+
+        assert AssetsOfflineEvent.get_queryset(device=device).count() == 3
+        assert len(sent) == 1 and len(sent[0]) == 3
+
+
+@pytest.mark.django_db
+class TestProcessEventAverages:
+    def test_averages(self, django_assert_num_queries):
+        current = timezone.now()
+        devices = DeviceFactory.create_batch_normal(3)
+        for device, counts in zip(devices, [[10, 20], [30], []]):
+            for count in counts:
+                SNMPDataFactory.create(device=device, process_count=count)
+        SNMPData.objects.update(update_time=current - timedelta(hours=1))
+
+        with django_assert_num_queries(1):
+            averages = ProcessEvent.averages([d.id for d in devices], current)
+        assert averages == {devices[0].id: 15, devices[1].id: 30,
+                            devices[2].id: 0}
+
+        for device in devices:
+            event = ProcessEvent(40, current, device=device,
+                                 average=averages[device.id])
+            single = ProcessEvent(40, current, device=device)
+            assert event.is_abnormal() == single.is_abnormal()
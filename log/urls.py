@@ -34,6 +34,8 @@ urlpatterns = [
         name='resolve-all-alert'),
     url(r'all-alert/resolve/batch/', views.BatchResolveAlertView.as_view(),
         name='batch-resolve-alert'),
+    url(r'all-alert/resolve/job/(?P<job_id>\w+)/',
+        views.ResolveAlertJobView.as_view(), name='resolve-alert-job'),
     url(r'all-alert/resolve/(?P<pk>\d+)/', views.ResolveAlertView.as_view(),
         name='resolve-alert'),
     url(r'security-event/resolve/all/', views.ResolveAllSecurityView.as_view(),
@@ -1,5 +1,6 @@
 import datetime
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.utils import timezone
@@ -27,6 +28,7 @@ from base_app.serializers import EventLogSerializer
 from firewall.filters import FirewallSysEventFilter
 from firewall.models import FirewallSysEvent
 from firewall.serializers import FirewallSysEventSerializer
+from log.alert_resolve import BulkResolveJob
 from log.filters import ServerRunLogFilter, TerminalDevInstallationLogFilter, \
     TerminalDevRunLogFilter, StrategyDistributionStatusLogFilter, \
     AllDeviceAlertFilter, UnifiedForumLogFilter, SecurityEventFilter
@@ -44,10 +46,12 @@ from log.serializers import ServerRunLogSerializer, \
     SecurityEventDetailSerializer, SecurityEventFilterSerializer, \
     StatisticInfoSerializer, AuditorProtocolQuerySerializer, \
     AuditorProtocolSerializer
+from log.tasks import bulk_resolve_alert
 from utils.core.exceptions import CustomError
 from utils.core.mixins import \
     ConfiEngineerPermissionsMixin as EngineerPermissionsMixin
 from utils.core.mixins import MultiActionConfViewSetMixin
+from utils.core.pagination import LargeTablePagination
 from utils.core.permissions import IsSecurityEngineer, IsConfiEngineer
 from utils.core.renders import ExportDOCXRenderer
 
@@ -80,6 +84,7 @@ class UnifiedForumLogView(BaseLogView):
     filter_class = UnifiedForumLogFilter
     permission_classes = (IsConfiEngineer,)
     ordering_fields = ('occurred_time', 'id')
+    pagination_class = LargeTablePagination
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -212,6 +217,7 @@ class FirewallSysEventView(BaseLogView):
     permission_classes = (IsConfiEngineer,)
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     ordering_fields = ('occurred_time',)
+    pagination_class = LargeTablePagination
 
 
 # 这是知识库的内容
@@ -277,6 +283,7 @@ class DeviceAllAlertView(MultiActionConfViewSetMixin, BaseLogView):
     filter_fields = ('level', 'type', 'status_resolved', 'category')
     filter_class = AllDeviceAlertFilter
     permission_classes = (IsConfiEngineer,)
+    pagination_class = LargeTablePagination
     serializer_action_classes = {
         'list': DeviceAllAlertSerializer,
         'retrieve': DeviceAllAlertDetailSerializer,
@@ -378,56 +385,59 @@ class ResolveAllAlertView(GenericAPIView):
     filter_class = AllDeviceAlertFilter
     filter_backends = [DjangoFilterBackend]
     model = DeviceAllAlert
-    message = '每次处理上限为1000，本次已处理了1000条安全威胁'
+    kind = BulkResolveJob.KIND_ALERT
+    message = '共{}条安全威胁，已在后台处理，可以通过job_id查询进度'
 
     @method_decorator(swagger_auto_schema(
         query_serializer=DeviceAlertFilterSerializer(),
         operation_summary='批量处理筛选条件下的告警',
-        operation_description='最多处理1000条安全威胁，超过1000条只处理前1000条，并'
-                              '在响应的detail字段提示'
+        operation_description='超过ALERT_RESOLVE_SYNC_LIMIT条时在后台处理，响应的'
+                              'detail字段提示，job_id用于查询处理进度'
     ))
     def put(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.data
-        user = request.user
 
-        error = False
-        first_id = ''
-        count = 0
+        # 记录下id和修改的数量用于日志的记录
+        job = BulkResolveJob.create(
+            self.kind, request.query_params.urlencode(),
+            {'status_resolved': data['status_resolved'],
+             'des_resolved': data.get('des_resolved')},
+            request.user.id)
+        count = job.state['total']
         message = ''
-        with transaction.atomic():
-            try:
-                first_id, count, message = self.resolve(data, user)
-            except Exception:
-                error = True
-
-        if error:
-            raise CustomError(error_code=CustomError.DEVICE_ALLERT_ERROR)
-
-        data.update({'first_id': first_id, 'count': count, 'detail': message})
+        if count > settings.ALERT_RESOLVE_SYNC_LIMIT:
+            bulk_resolve_alert.delay(job.job_id)
+            message = self.message.format(count)
+        else:
+            # 数量不多时直接处理，出错时全部回滚
+            with transaction.atomic():
+                state = job.run()
+                if state['status'] == BulkResolveJob.STATUS_FAILED:
+                    transaction.set_rollback(True)
+            if state['status'] == BulkResolveJob.STATUS_FAILED:
+                raise CustomError(error_code=CustomError.DEVICE_ALLERT_ERROR)
+            count = state['resolved']
+
+        data.update({'first_id': job.state['first_id'], 'count': count,
+                     'detail': message, 'job_id': job.job_id})
         return Response(data)
 
-    def resolve(self, data, user):
-        time = timezone.localtime()
-        queryset = self.filter_queryset(self.get_queryset()).filter(
-            status_resolved=self.model.STATUS_UNRESOLVED)
-        count = queryset.count()
-        message = ''
-        if count > 1000:
-            first_thousand = queryset[:1000]
-            queryset = queryset.filter(id__in=[i.id for i in first_thousand])
-            message = self.message
-        # 记录下id和修改的数量用于日志的记录
-        first = queryset.first()
-        first_id = first.id if first else ''
-        count = queryset.count()
-        with transaction.atomic():
-            queryset.update(status_resolved=data['status_resolved'],
-                            des_resolved=data['des_resolved'],
-                            user=user, time_resolved=time)
 
-        return first_id, count, message
+class ResolveAlertJobView(APIView):
+    permission_classes = (IsSecurityEngineer,)
+
+    @method_decorator(swagger_auto_schema(
+        operation_summary='查询批量处理告警、安全事件的进度',
+        operation_description='status: pending/running/finished/failed，'
+                              'progress为百分比'
+    ))
+    def get(self, request, job_id):
+        job = BulkResolveJob.load(job_id)
+        if not job:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(job.state)
 
 
 class BatchResolveAlertView(GenericAPIView):
@@ -626,6 +636,7 @@ class SecurityEventView(MultiActionConfViewSetMixin,
     serializer_class = SecurityEventListSerializer
     queryset = SecurityEvent.objects.all()
     filter_class = SecurityEventFilter
+    pagination_class = LargeTablePagination
     serializer_action_classes = {
         'list': SecurityEventListSerializer,
         'retrieve': SecurityEventDetailSerializer,
@@ -698,13 +709,14 @@ class ResolveAllSecurityView(ResolveAllAlertView):
     queryset = SecurityEvent.objects.all()
     filter_class = SecurityEventFilter
     model = SecurityEvent
-    message = '每次处理上限为1000，本次已处理了1000条安全事件'
+    kind = BulkResolveJob.KIND_SECURITY
+    message = '共{}条安全事件，已在后台处理，可以通过job_id查询进度'
 
     @method_decorator(swagger_auto_schema(
         query_serializer=SecurityEventFilterSerializer(),
         operation_summary='批量处理筛选条件下的安全事件',
-        operation_description='最多处理1000条安全事件，超过1000条只处理前1000条，并'
-                              '在响应的detail字段提示'
+        operation_description='超过ALERT_RESOLVE_SYNC_LIMIT条时在后台处理，响应的'
+                              'detail字段提示，job_id用于查询处理进度'
     ))
     def put(self, request):
         return super().put(request)
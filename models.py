@@ -1,9 +1,11 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 
 from base_app.models import BaseStrategy, TerminalLog, Device, FirewallStrategy
 from utils.core.mixins import UniqueAttrMixin, UniqueModelMixin
+from utils.partition import partition_register
 from utils.validators import MAC_VALIDATOR, IPV4_VALIDATOR
 
 User = get_user_model()
@@ -447,6 +449,8 @@ class FirewallIPMACUnknownDeviceActionStrategy(UniqueModelMixin, FirewallStrateg
     action = models.IntegerField('动作', choices=ACTION_CHOICES, default=ACTION_PASS)
 
 
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class FirewallSecEvent(TerminalLog):
     """
     防火墙安全事件表
@@ -515,8 +519,18 @@ class FirewallSecEvent(TerminalLog):
     class Meta:
         verbose_name = '防火墙安全事件'
         ordering = ['-occurred_time']
-
-
+        indexes = [
+            models.Index(fields=['occurred_time'], name='fw_sec_time_idx'),
+            models.Index(fields=['device', 'occurred_time'],
+                         name='fw_sec_device_time_idx'),
+            # 首页最近的未读事件
+            models.Index(fields=['-occurred_time'], name='fw_sec_unread_idx',
+                         condition=models.Q(is_read=False)),
+        ]
+
+
+@partition_register.register('occurred_time',
+                             retention_days=settings.EVENT_RETENTION_DAYS)
 class FirewallSysEvent(TerminalLog):
     """
     防火墙系统事件日志表
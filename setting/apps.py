@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SettingConfig(AppConfig):
     name = 'setting'
+
+    def ready(self):
+        import setting.signals  # noqa: F401
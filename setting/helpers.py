@@ -0,0 +1,67 @@
+import copy
+import threading
+import time
+from typing import Optional
+
+from django.db import transaction
+
+from setting.models import Setting
+from utils.unified_redis import cache
+
+SETTING_VERSION_KEY = 'setting-version'
+
+
+class SettingCache(object):
+    """
+    系统设置只有一条记录，读取很频繁但是很少修改，在进程内缓存
+    本进程修改设置时post_save直接清空缓存；其他进程通过redis里的版本号判断是否过期，
+    版本号最多每check_interval秒检查一次，稳定状态下读取设置不需要查询数据库
+
+    :param check_interval: 检查版本号的间隔秒数
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._setting: Optional[Setting] = None
+        self._version: Optional[str] = None
+        self._checked = 0.0
+
+    def get(self) -> Setting:
+        """
+        返回缓存的副本，调用方修改返回值不会影响缓存
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._setting and now - self._checked >= self.check_interval:
+                self._checked = now
+                if self.version() != self._version:
+                    self._setting = None
+            if not self._setting:
+                self._version = self.version()
+                self._setting, _ = Setting.objects.get_or_create(id=1)
+                self._checked = now
+            return copy.deepcopy(self._setting)
+
+    @classmethod
+    def version(cls) -> str:
+        return cache.get(SETTING_VERSION_KEY) or '0'
+
+    def clear(self):
+        with self._lock:
+            self._setting = None
+
+    def invalidate(self):
+        """
+        设置被修改：本进程立即清空缓存，事务提交之后再更新版本号通知其他进程，
+        避免其他进程在提交之前重新加载到旧的设置
+        """
+        self.clear()
+        transaction.on_commit(lambda: cache.incr(SETTING_VERSION_KEY))
+
+
+setting_cache = SettingCache()
+
+
+def get_setting() -> Setting:
+    return setting_cache.get()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from utils.partition import partition_register
+
+
+class Command(BaseCommand):
+    help = '查看按时间分区的表的分区情况，--convert把普通表转换成分区表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*',
+                            help='表名，默认所有注册了分区的表')
+        parser.add_argument('--convert', action='store_true',
+                            help='把普通表转换成分区表，会锁表，需要在维护窗口执行')
+
+    def handle(self, *args, **options):
+        tables = partition_register.get_all()
+        if options['tables']:
+            names = set(options['tables'])
+            unknown = names - {t.table for t in tables}
+            if unknown:
+                raise CommandError('没有注册分区的表: {}'.format(
+                    ', '.join(sorted(unknown))))
+            tables = [t for t in tables if t.table in names]
+
+        current = timezone.now()
+        for table in tables:
+            if options['convert']:
+                if table.convert(current):
+                    self.stdout.write(self.style.SUCCESS(
+                        '{} 已转换为分区表'.format(table.table)))
+            if not table.is_partitioned():
+                self.stdout.write('{}: 未分区'.format(table.table))
+                continue
+            self.stdout.write('{}: 按{}分区'.format(
+                table.table, '月' if table.interval == table.MONTH else '天'))
+            for name, lower, upper in table.partitions():
+                self.stdout.write('  {} [{}, {})'.format(
+                    name, lower or 'MINVALUE', upper or 'MAXVALUE'))
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from setting.helpers import setting_cache
+from setting.models import Setting
+
+
+@receiver(post_save, sender=Setting)
+@receiver(post_delete, sender=Setting)
+def setting_changed(sender, **kwargs):
+    setting_cache.invalidate()
@@ -1,12 +1,12 @@
 import psutil
 from django.conf import settings
-from psycopg2 import connect
+from django.utils import timezone
 
 from base_app.models import TerminalLog
 from log.models import UnifiedForumLog, DeviceAllAlert, SecurityEvent
 from log.security_event import DiskEvent, DiskCleanEvent
 from setting.models import Setting
-from unified_log.elastic import client as elastic_client
+from setting.system_check.disk_reclaim import DiskReclaimPlanner
 from utils.helper import get_subclasses
 
 
@@ -59,34 +59,25 @@ class DiskCheck(object):
             UnifiedForumLog.objects.create(**data)
 
     def do_clean(self, percent):
+        """
+        达到存储使用覆盖阈值后，按占用空间清理最早的日志、告警和elasticsearch索引，
+        清理到比覆盖阈值低DISK_RECLAIM_MARGIN的使用率为止
+        """
         if percent < self.clean_threshold or self.test:
             return None
-        connection_parameters = {
-            'host': settings.DATABASES.get('default').get('HOST'),
-            'port': settings.DATABASES.get('default').get('PORT'),
-            'database': settings.DATABASES.get('default').get('NAME'),
-            'user': settings.DATABASES.get('default').get('USER'),
-            'password': settings.DATABASES.get('default').get('PASSWORD'),
-        }
-
-        conn = connect(**connection_parameters)
-        conn.autocommit = True
         log_list = [UnifiedForumLog, DeviceAllAlert, SecurityEvent]
         log_list.extend(get_subclasses(TerminalLog))
-        # 达到存储使用覆盖阈值后，需要删除告警管理和日志管理各10%的历史数据
-        # 删除postgres里的数据
-        for model in log_list:
-            table_name = model.objects.model._meta.db_table
-
-            # Delete the earliest 10% rows of model.
-            if model.objects.count() > 1:
-                min_id = model.objects.earliest('id').id
-                max_id = model.objects.latest('id').id
-                mid_id = min_id + int((max_id - min_id) * 0.1)
-                with conn.cursor() as cursor:
-                    model_del_statement = 'DELETE FROM {} WHERE id BETWEEN {} AND {};'. \
-                        format(table_name, min_id, mid_id)
-
-                    cursor.execute(model_del_statement)
-        # 清理elasticsearch的日志内容
-        elastic_client.delete_index_by_percent('log-*', 0.1)
+        planner = DiskReclaimPlanner(
+            self.clean_threshold - settings.DISK_RECLAIM_MARGIN, log_list,
+            detach=settings.PARTITION_DETACH)
+        report = planner.run(timezone.now())
+        UnifiedForumLog.objects.create(
+            type=UnifiedForumLog.TYPE_STORAGE,
+            content='释放存储空间{}MB，可复用空间{}MB，清理{}项'.format(
+                report['freed'] // (1024 * 1024),
+                report['reusable'] // (1024 * 1024), len(report['actions'])),
+            result=True,
+            category=UnifiedForumLog.CATEGORY_SYSTEM,
+            ip='127.0.0.1',  # 本地 ip 地址
+        )
+        return report
@@ -0,0 +1,233 @@
+"""
+存储空间不足时的清理计划：统计每张表、每个分区、每个elasticsearch索引占用的空间，
+从最早的数据开始清理，每清理一项重新检查存储空间，达到目标使用率就停止
+优先整个删除分区和elasticsearch索引，空间立即还给操作系统；还不够时再从占用最大的表里
+按主键范围删除最早的数据并VACUUM。删除的行在表的开头，VACUUM之后这部分空间只能
+被后面写入的数据复用，不会还给操作系统，报告里单独记为可复用的空间
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Type
+
+import psutil
+from django.db import connection, models
+from django.utils import timezone
+
+from unified_log.elastic import client as elastic_client
+from utils.db import ChunkedDelete
+from utils.partition import partition_register
+from utils.unified_redis import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ReclaimCandidate(object):
+    """
+    一项可以释放空间的操作
+
+    :param kind: partition / index / rows
+    :param name: 分区名、索引名或表名
+    :param size: 预计释放的字节数，用于排序
+    :param time: 数据的时间，越早越先清理
+    :param action: 执行清理的函数，按行删除时返回可复用的字节数
+    """
+    KIND_PARTITION = 'partition'
+    KIND_INDEX = 'index'
+    KIND_ROWS = 'rows'
+
+    def __init__(self, kind: str, name: str, size: int,
+                 time: Optional[datetime], action: Callable):
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.time = time
+        self.action = action
+
+    def __repr__(self):
+        return '<ReclaimCandidate {} {} {}>'.format(self.kind, self.name,
+                                                    self.size)
+
+
+def relation_size(name: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_total_relation_size(%s::regclass)', [name])
+        return cursor.fetchone()[0]
+
+
+def table_rows(name: str) -> float:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                       [name])
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def vacuum(table: str):
+    """
+    普通的VACUUM不锁表，死元组占用的空间可以被后面写入的数据复用，
+    只有表末尾的空页会还给操作系统
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE {}'.format(
+            connection.ops.quote_name(table)))
+
+
+class DiskReclaimPlanner(object):
+    """
+    :param target_percent: 清理之后的目标使用率
+    :param log_models: 可以清理的日志、告警表
+    :param index_pattern: 可以清理的elasticsearch索引
+    :param delete_fraction: 按行删除时每张表最多删除最早的多少比例的数据
+    :param detach: 分区只分离不删除时不占用的空间不会释放，不作为清理的对象
+    """
+    REPORT_KEY = 'disk-reclaim-report'
+
+    def __init__(self, target_percent: float,
+                 log_models: List[Type[models.Model]],
+                 index_pattern: str = 'log-*', delete_fraction: float = 0.1,
+                 detach: bool = False, path: str = '/'):
+        self.target_percent = target_percent
+        self.log_models = log_models
+        self.index_pattern = index_pattern
+        self.delete_fraction = delete_fraction
+        self.detach = detach
+        self.path = path
+
+    def used(self) -> int:
+        return psutil.disk_usage(self.path).used
+
+    def need(self) -> int:
+        """
+        达到目标使用率需要释放的字节数
+        """
+        usage = psutil.disk_usage(self.path)
+        return max(int(usage.used - usage.total * self.target_percent / 100),
+                   0)
+
+    def droppable(self, current: datetime) -> List[ReclaimCandidate]:
+        """
+        可以整个删除的分区和索引，当前周期的分区和最新的索引不删除
+        """
+        candidates = []
+        for model in self.log_models:
+            table = partition_register.get(model)
+            if self.detach or not table or not table.is_partitioned():
+                continue
+            for name, lower, upper in table.partitions():
+                # 转换前的旧表按行删除，不整个删除
+                if lower is None or upper is None or \
+                        upper > table.period_start(current):
+                    continue
+                candidates.append(ReclaimCandidate(
+                    ReclaimCandidate.KIND_PARTITION, name, relation_size(name),
+                    lower, lambda t=table, n=name: t.drop_partition(n)))
+
+        # elasticsearch不可用时只清理数据库，不能因此什么都不释放
+        try:
+            indices = elastic_client.list_index_size(self.index_pattern)
+        except Exception as e:
+            logger.error('failed to list elasticsearch indices: %s', e)
+            indices = []
+        for index in indices[:-1]:
+            candidates.append(ReclaimCandidate(
+                ReclaimCandidate.KIND_INDEX, index['index'], index['size'],
+                datetime.fromtimestamp(index['created'] / 1000,
+                                       tz=timezone.utc),
+                lambda i=index['index']: elastic_client.delete_index(i)))
+        candidates.sort(key=lambda c: c.time)
+        return candidates
+
+    def deletable(self) -> List[ReclaimCandidate]:
+        """
+        按行删除的表，按占用空间从大到小排序；分区表只有旧表需要按行删除
+        """
+        candidates = []
+        for model in self.log_models:
+            table = partition_register.get(model)
+            name = model._meta.db_table
+            if table and table.is_partitioned():
+                partitions = table.partitions()
+                if not partitions or partitions[0][1] is not None:
+                    continue
+                name = partitions[0][0]
+            size = relation_size(name)
+            if not size:
+                continue
+            candidates.append(ReclaimCandidate(
+                ReclaimCandidate.KIND_ROWS, name,
+                int(size * self.delete_fraction), None,
+                lambda m=model, n=name: self.delete_oldest(m, n)))
+        candidates.sort(key=lambda c: c.size, reverse=True)
+        return candidates
+
+    def plan(self, current: datetime) -> List[ReclaimCandidate]:
+        """
+        清理的顺序：先按时间从早到晚整个删除分区和索引，再从占用最大的表开始按行删除
+        """
+        return self.droppable(current) + self.deletable()
+
+    def delete_oldest(self, model: Type[models.Model], table: str) -> int:
+        """
+        按主键删除表里最早的delete_fraction的数据，再VACUUM
+        :return: 删除的行可以被复用的字节数，按表的平均行大小估算
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT min(id), max(id) FROM {}'.format(
+                connection.ops.quote_name(table)))
+            min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return 0
+        cutoff_id = min_id + int((max_id - min_id) * self.delete_fraction)
+        cutoff = model.objects.filter(id__gte=cutoff_id).order_by(
+            'id').values_list('occurred_time', flat=True).first()
+        if not cutoff:
+            return 0
+        size, rows = relation_size(table), table_rows(table)
+        deleted = ChunkedDelete(model, 'occurred_time', cutoff,
+                                sleep=0).run()['deleted']
+        vacuum(table)
+        return int(deleted * size / rows) if rows > 0 else 0
+
+    def run(self, current: datetime) -> Dict:
+        """
+        每执行一项清理重新检查存储空间，达到目标使用率就停止；
+        按行删除不会降低存储空间的使用率，可复用的空间足够之后也停止，
+        否则会一直删除到表里没有数据
+        :return: 清理报告，同时保存在redis里
+        """
+        need = self.need()
+        before = self.used()
+        actions = []
+        reusable = 0
+        for candidate in self.plan(current):
+            if self.need() - reusable <= 0:
+                break
+            used = self.used()
+            try:
+                result = candidate.action()
+            except Exception as e:
+                logger.error('failed to reclaim %s: %s', candidate, e)
+                continue
+            action = {'kind': candidate.kind, 'name': candidate.name,
+                      'freed': max(used - self.used(), 0), 'reusable': 0}
+            if candidate.kind == ReclaimCandidate.KIND_ROWS:
+                action['reusable'] = result or 0
+                reusable += action['reusable']
+            actions.append(action)
+        report = {
+            'time': time.time(),
+            'need': need,
+            'freed': max(before - self.used(), 0),
+            'reusable': reusable,
+            'remaining': self.need(),
+            'actions': actions,
+        }
+        cache.set(self.REPORT_KEY, json.dumps(report))
+        return report
+
+    @classmethod
+    def load_report(cls) -> Optional[Dict]:
+        data = cache.get(cls.REPORT_KEY)
+        return json.loads(data) if data else None
@@ -2,11 +2,14 @@ import subprocess
 from datetime import datetime, timedelta
 
 from celery import shared_task
+from django.conf import settings
 
 from log.models import UnifiedForumLog
-from setting.models import Setting
+from setting.helpers import get_setting
 from setting.system_check import CPUCheck, MemoryCheck, DiskCheck
 from statistic.models import clean_register
+from utils.db import ChunkedDelete
+from utils.partition import partition_register
 from utils.runnable import TaskRun
 from snmp.models import SNMPData
 
@@ -14,14 +17,14 @@ from snmp.models import SNMPData
 class DiskCheckTask(TaskRun):
     @classmethod
     def run(cls, current: datetime):
-        setting, _ = Setting.objects.get_or_create(id=1)
+        setting = get_setting()
         check = DiskCheck(setting)
         check.run()
 
 
 @shared_task
 def cpu_memory_alert_task():
-    setting_rec, _ = Setting.objects.get_or_create(id=1)
+    setting_rec = get_setting()
 
     cpu_check = CPUCheck(setting_rec.cpu_alert_percent)
     memory_check = MemoryCheck(setting_rec.memory_alert_percent)
@@ -49,21 +52,62 @@ class StatisticDataCleanTask(TaskRun):
     def run(cls, current: datetime):
         classes = clean_register.get_all()
         classes.append(SNMPData)
-        clean, _ = Setting.objects.get_or_create(id=1)
+        clean = get_setting()
         duration = clean.security_center * 30
 
         delete_time = current - timedelta(days=duration)
 
+        deleted = 0
         for clz in classes:
-            clz.objects.filter(update_time__lte=delete_time).delete()
+            table = partition_register.get(clz)
+            if table:
+                # 已经分区的表先整个删除过期的分区，剩下的数据再DELETE
+                table.drop_before(delete_time, settings.PARTITION_DETACH)
+            # 统计数据没有被外键引用，按主键范围分批删除，不经过Django的delete
+            stats = ChunkedDelete(
+                clz, 'update_time', delete_time,
+                chunk_size=settings.RETENTION_CHUNK_SIZE,
+                sleep=settings.RETENTION_CHUNK_SLEEP,
+                max_seconds=settings.RETENTION_MAX_SECONDS).run()
+            deleted += stats['deleted']
         UnifiedForumLog.objects.create(
             type=UnifiedForumLog.TYPE_SECURITY,
-            content=f'定时清理{clean.security_center}个月前的安全中心统计数据',
+            content=f'定时清理{clean.security_center}个月前的安全中心统计数据，'
+                    f'共{deleted}条',
             result=True,
             category=UnifiedForumLog.CATEGORY_SYSTEM,
             ip='127.0.0.1'
         )
 
 
+class PartitionMaintainTask(TaskRun):
+    """
+    模块：日志、告警表的分区维护
+    更新周期：1天
+    描述：提前创建后面几个周期的分区，设置了保留天数的表删除过期的分区，
+    没有转换成分区表的表不处理
+    """
+    @classmethod
+    def run(cls, current: datetime):
+        removed = []
+        for table in partition_register.get_all():
+            table.ensure(current)
+            if table.retention_days:
+                removed.extend(table.drop_before(
+                    current - timedelta(days=table.retention_days),
+                    settings.PARTITION_DETACH))
+        if removed:
+            UnifiedForumLog.objects.create(
+                type=UnifiedForumLog.TYPE_STORAGE,
+                content='定时清理{}天前的日志和告警，{}分区{}'.format(
+                    settings.EVENT_RETENTION_DAYS,
+                    '分离' if settings.PARTITION_DETACH else '删除',
+                    '、'.join(removed)),
+                result=True,
+                category=UnifiedForumLog.CATEGORY_SYSTEM,
+                ip='127.0.0.1'
+            )
+
+
 if __name__ == '__main__':
     set_time.delay(datetime(2020, 9, 27, 10))
\ No newline at end of file
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import pytest
+from django.utils import timezone
+
+from base_app.factory_data import DeviceFactory
+from log.factory_data import DeviceAllAlertFactory
+from log.models import DeviceAllAlert, SecurityEvent
+from setting.system_check import disk_reclaim
+from setting.system_check.disk_reclaim import DiskReclaimPlanner, \
+    ReclaimCandidate
+from snmp.models import SNMPData
+from utils.partition import partition_register
+
+
+def candidate(kind, name, size, month=None, action=None):
+    time = timezone.make_aware(datetime(2020, month, 1)) if month else None
+    return ReclaimCandidate(kind, name, size, time, action or (lambda: None))
+
+
+class TestDiskReclaimPlanner:
+    @pytest.fixture(scope='function')
+    def planner(self, monkeypatch):
+        planner = DiskReclaimPlanner(80, [DeviceAllAlert, SecurityEvent])
+        monkeypatch.setattr(planner, 'droppable', lambda current: [
+            candidate(ReclaimCandidate.KIND_INDEX, 'log-202001', 100, 1),
+            candidate(ReclaimCandidate.KIND_PARTITION, 'alert_p202002', 300, 2),
+        ])
+        monkeypatch.setattr(planner, 'deletable', lambda: [
+            candidate(ReclaimCandidate.KIND_ROWS, 'log_devicealert', 500,
+                      action=lambda: 400),
+            candidate(ReclaimCandidate.KIND_ROWS, 'log_securityevent', 50,
+                      action=lambda: 40),
+        ])
+        return planner
+
+    def test_plan_order(self, planner):
+        """
+        先整个删除最早的分区、索引，再从占用最大的表开始按行删除
+        """
+        assert [c.name for c in planner.plan(timezone.now())] == [
+            'log-202001', 'alert_p202002', 'log_devicealert',
+            'log_securityevent']
+
+    def test_run_until_target(self, planner, monkeypatch):
+        """
+        每项清理之后重新检查存储空间，达到目标就停止
+        """
+        used = [1000]
+        monkeypatch.setattr(planner, 'used', lambda: used[0])
+        monkeypatch.setattr(planner, 'need', lambda: max(used[0] - 700, 0))
+        drop = planner.droppable(None)
+        drop[0].action = lambda: used.__setitem__(0, used[0] - 100)
+        drop[1].action = lambda: used.__setitem__(0, used[0] - 250)
+        monkeypatch.setattr(planner, 'droppable', lambda current: drop)
+
+        report = planner.run(timezone.now())
+
+        assert [a['name'] for a in report['actions']] == [
+            'log-202001', 'alert_p202002']
+        assert report['need'] == 300
+        assert report['freed'] == 350
+        assert report['remaining'] == 0
+        assert DiskReclaimPlanner.load_report() == report
+
+    def test_rows_only_reusable(self, planner, monkeypatch):
+        """
+        按行删除不降低存储空间使用率，可复用的空间单独记录，足够之后停止
+        """
+        monkeypatch.setattr(planner, 'used', lambda: 1000)
+        monkeypatch.setattr(planner, 'need', lambda: 800)
+
+        report = planner.run(timezone.now())
+
+        assert [a['name'] for a in report['actions']] == [
+            'log-202001', 'alert_p202002', 'log_devicealert',
+            'log_securityevent']
+        assert report['freed'] == 0
+        assert report['reusable'] == 440
+        assert report['actions'][2] == {
+            'kind': ReclaimCandidate.KIND_ROWS, 'name': 'log_devicealert',
+            'freed': 0, 'reusable': 400}
+
+
+@pytest.mark.django_db
+class TestDiskReclaimPartition:
+    def test_drop_partition_keeps_legacy(self, monkeypatch):
+        """
+        删除一个过期的分区时，转换前的旧表和其他分区都保留
+        """
+        table = partition_register.get(SNMPData)
+        current = timezone.now()
+        device = DeviceFactory.create()
+        SNMPData.objects.create(device=device)
+        table.convert(current - timedelta(days=62))
+        table.ensure(current)
+        monkeypatch.setattr(disk_reclaim.elastic_client, 'list_index_size',
+                            lambda pattern: [])
+
+        planner = DiskReclaimPlanner(80, [SNMPData])
+        candidates = planner.droppable(current)
+        assert candidates
+        assert table.legacy_table not in [c.name for c in candidates]
+
+        candidates[0].action()
+        names = [name for name, _, _ in table.partitions()]
+        assert table.legacy_table in names
+        assert candidates[0].name not in names
+        assert SNMPData.objects.filter(device=device).exists()
+
+    def test_elastic_unavailable(self, monkeypatch):
+        """
+        elasticsearch不可用时仍然清理数据库里的分区和数据
+        """
+        def list_index_size(pattern):
+            raise ConnectionError('elasticsearch is down')
+
+        monkeypatch.setattr(disk_reclaim.elastic_client, 'list_index_size',
+                            list_index_size)
+        DeviceAllAlertFactory.create()
+
+        planner = DiskReclaimPlanner(80, [DeviceAllAlert])
+        assert [c.kind for c in planner.plan(timezone.now())] == [
+            ReclaimCandidate.KIND_ROWS]
@@ -0,0 +1,50 @@
+import pytest
+from django.test import RequestFactory
+
+from setting.helpers import SettingCache, SETTING_VERSION_KEY, get_setting, \
+    setting_cache
+from setting.models import Setting
+from utils.middlewares import CheckIPAndTimeoutMiddleware
+from utils.unified_redis import cache
+
+
+@pytest.mark.django_db
+class TestSettingCache:
+    def test_cached(self, django_assert_num_queries):
+        setting_cache.clear()
+        get_setting()
+        with django_assert_num_queries(0):
+            for _ in range(10):
+                setting = get_setting()
+        # 修改返回值不影响缓存
+        setting.lockout_threshold = 100
+        assert get_setting().lockout_threshold != 100
+
+    def test_invalidate_on_save(self):
+        setting = get_setting()
+        setting.lockout_threshold = 3
+        setting.save()
+        assert get_setting().lockout_threshold == 3
+
+    def test_version_changed(self, django_assert_num_queries):
+        setting_cache_ = SettingCache(check_interval=0)
+        setting_cache_.get()
+        with django_assert_num_queries(0):
+            setting_cache_.get()
+
+        # 其他进程修改了设置
+        cache.incr(SETTING_VERSION_KEY)
+        with django_assert_num_queries(1):
+            setting_cache_.get()
+
+
+@pytest.mark.django_db
+class TestCheckIPAndTimeoutMiddleware:
+    def test_no_sql(self, django_assert_num_queries):
+        middleware = CheckIPAndTimeoutMiddleware(lambda request: None)
+        request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+        request.session = {}
+
+        with django_assert_num_queries(0):
+            for _ in range(10):
+                assert middleware.process_view(request, None, (), {}) is None
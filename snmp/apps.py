@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SnmpConfig(AppConfig):
     name = 'snmp'
+
+    def ready(self):
+        import snmp.signals  # noqa: F401
@@ -8,6 +8,7 @@ from rest_framework.exceptions import ValidationError
 
 from base_app.models import Device
 from statistic.models import clean_register
+from utils.partition import PartitionedTable, partition_register
 
 
 class BaseRule(models.Model):
@@ -236,6 +237,8 @@ class SNMPSetting(models.Model):
 
 
 @clean_register.register
+# 原始数据按天分区，过期的分区在降采样任务里清理
+@partition_register.register('update_time', PartitionedTable.DAY)
 class SNMPData(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     update_time = models.DateTimeField(auto_now=True)
@@ -265,3 +268,68 @@ class SNMPData(models.Model):
     class Meta:
         verbose_name = '资产性能数据'
         ordering = ('-id', )
+
+
+class SNMPDataRollup(models.Model):
+    """
+    资产性能数据的降采样，原始数据每分钟一条，按5分钟、1小时聚合为最小值、平均值、
+    最大值，各个粒度的数据有各自的保留时间
+    """
+    TIER_RAW = 60
+    TIER_5MIN = 5 * 60
+    TIER_1HOUR = 60 * 60
+    TIER_CHOICES = (
+        (TIER_5MIN, '5分钟'),
+        (TIER_1HOUR, '1小时'),
+    )
+    # 数据保留天数
+    RETENTION = {
+        TIER_RAW: 7,
+        TIER_5MIN: 30,
+        TIER_1HOUR: 365,
+    }
+    # 需要降采样的字段
+    FIELDS = ('cpu_in_use', 'memory_in_use', 'swap_memory_in_use',
+              'disk_in_use', 'network_in_speed', 'network_out_speed',
+              'process_count')
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE)
+    tier = models.IntegerField(help_text='聚合粒度(秒)', choices=TIER_CHOICES)
+    start_time = models.DateTimeField(help_text='聚合区间开始时间')
+    sample_count = models.IntegerField(help_text='聚合的原始数据条数', default=0)
+
+    cpu_in_use_min = models.FloatField(help_text='CPU使用率最小值', null=True)
+    cpu_in_use_avg = models.FloatField(help_text='CPU使用率平均值', null=True)
+    cpu_in_use_max = models.FloatField(help_text='CPU使用率最大值', null=True)
+
+    memory_in_use_min = models.FloatField(help_text='物理内存利用率最小值', null=True)
+    memory_in_use_avg = models.FloatField(help_text='物理内存利用率平均值', null=True)
+    memory_in_use_max = models.FloatField(help_text='物理内存利用率最大值', null=True)
+
+    swap_memory_in_use_min = models.FloatField(help_text='虚拟内存利用率最小值', null=True)
+    swap_memory_in_use_avg = models.FloatField(help_text='虚拟内存利用率平均值', null=True)
+    swap_memory_in_use_max = models.FloatField(help_text='虚拟内存利用率最大值', null=True)
+
+    disk_in_use_min = models.FloatField(help_text='磁盘使用率最小值', null=True)
+    disk_in_use_avg = models.FloatField(help_text='磁盘使用率平均值', null=True)
+    disk_in_use_max = models.FloatField(help_text='磁盘使用率最大值', null=True)
+
+    network_in_speed_min = models.FloatField(help_text='网卡 in 速度最小值', null=True)
+    network_in_speed_avg = models.FloatField(help_text='网卡 in 速度平均值', null=True)
+    network_in_speed_max = models.FloatField(help_text='网卡 in 速度最大值', null=True)
+
+    network_out_speed_min = models.FloatField(help_text='网卡 out 速度最小值', null=True)
+    network_out_speed_avg = models.FloatField(help_text='网卡 out 速度平均值', null=True)
+    network_out_speed_max = models.FloatField(help_text='网卡 out 速度最大值', null=True)
+
+    process_count_min = models.FloatField(help_text='进程数最小值', null=True)
+    process_count_avg = models.FloatField(help_text='进程数平均值', null=True)
+    process_count_max = models.FloatField(help_text='进程数最大值', null=True)
+
+    class Meta:
+        verbose_name = '资产性能数据降采样'
+        ordering = ('-start_time', )
+        unique_together = ('device', 'tier', 'start_time')
+        indexes = [
+            models.Index(fields=['tier', 'start_time']),
+        ]
@@ -0,0 +1,104 @@
+"""
+性能采集计划：资产、SNMP设置、模板和规则一次查询出来缓存在内存里，配置变化时才重新
+加载，资产按下次采集时间放在堆里调度，不用每轮遍历所有资产
+"""
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from base_app.models import Device
+from snmp.models import SNMPRule, SNMPSetting
+from utils.unified_redis import cache
+
+PLAN_VERSION_KEY = 'snmp-poll-plan-version'
+
+
+def invalidate_poll_plan():
+    """
+    采集配置发生变化，采集进程在下一轮检查版本号时重新加载采集计划
+    """
+    cache.incr(PLAN_VERSION_KEY)
+
+
+class SNMPPollPlanner(object):
+    def __init__(self):
+        self._version: Optional[str] = None
+        self._devices: Dict[int, Device] = {}
+        # 模板ID -> 模板的规则
+        self._rules: Dict[int, List[SNMPRule]] = {}
+        # (下次采集的时间戳, 资产ID)
+        self._heap: List[Tuple[float, int]] = []
+        # 资产ID -> 最近一次取出时比计划采集时间晚了多少秒
+        self._lags: Dict[int, float] = {}
+
+    def refresh(self):
+        """
+        采集计划的版本号变化时重新加载
+        """
+        version = cache.get(PLAN_VERSION_KEY) or '0'
+        if version != self._version:
+            self.load()
+            self._version = version
+
+    def load(self):
+        """
+        开启了监控并且配置了SNMP模板的资产，连同设置、模板、规则一共两次查询
+        """
+        devices = Device.objects.filter(
+            monitor=True, snmpsetting__template__isnull=False).select_related(
+            'snmpsetting', 'snmpsetting__template').prefetch_related(
+            'snmpsetting__template__rules')
+
+        self._devices = {}
+        self._rules = {}
+        for device in devices:
+            template = device.snmpsetting.template
+            self._devices[device.id] = device
+            if template.id not in self._rules:
+                self._rules[template.id] = list(template.rules.all())
+
+        self._heap = [
+            (self.next_due(d.snmpsetting).timestamp(), d.id)
+            for d in self._devices.values()
+        ]
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def next_due(cls, setting: SNMPSetting) -> datetime:
+        return setting.last_run_time + timedelta(
+            minutes=max(setting.frequency, 1))
+
+    def due(self, current: datetime) -> List[Device]:
+        """
+        取出到了采集时间的资产，并按采集周期放回堆里
+        """
+        self.refresh()
+        now = current.timestamp()
+        devices = []
+        while self._heap and self._heap[0][0] <= now:
+            due, device_id = heapq.heappop(self._heap)
+            devices.append(self._devices[device_id])
+            self._lags[device_id] = now - due
+
+        for device in devices:
+            device.snmpsetting.last_run_time = current
+            heapq.heappush(self._heap, (
+                self.next_due(device.snmpsetting).timestamp(), device.id))
+        return devices
+
+    def seconds_until_next(self, current: datetime) -> Optional[float]:
+        """
+        距离下一个资产需要采集的秒数，没有需要采集的资产时返回None
+        """
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - current.timestamp(), 0)
+
+    def lag(self, device: Device) -> float:
+        """
+        调度延迟：资产最近一次被取出采集的时间比计划的晚了多少秒
+        """
+        return self._lags.get(device.id, 0)
+
+    def rules(self, device: Device) -> List[SNMPRule]:
+        return self._rules[device.snmpsetting.template_id]
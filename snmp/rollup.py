@@ -0,0 +1,235 @@
+"""
+资产性能数据降采样：原始数据 -> 5分钟 -> 1小时，各个粒度按自己的保留时间清理，
+查询历史数据时按时间范围选择粒度
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Avg, Count, DateTimeField, F, FloatField, Func, \
+    Max, Min, Q, QuerySet, Sum
+from django.utils import timezone
+
+from snmp.models import SNMPData, SNMPDataRollup
+from utils.partition import partition_register
+from utils.runnable import TaskRun
+
+TIERS = [SNMPDataRollup.TIER_RAW, SNMPDataRollup.TIER_5MIN,
+         SNMPDataRollup.TIER_1HOUR]
+
+
+class TimeBucket(Func):
+    """
+    把时间对齐到所在区间的开始时间，date_trunc只能按分钟、小时对齐，
+    5分钟这样的区间要按时间戳计算
+    """
+    template = 'to_timestamp(floor(extract(epoch from %(expressions)s) / ' \
+               '%(seconds)s) * %(seconds)s)'
+    output_field = DateTimeField()
+
+    def __init__(self, expression, seconds: int, **extra):
+        super().__init__(expression, seconds=int(seconds), **extra)
+
+
+def align(time: datetime, seconds: int) -> datetime:
+    """
+    和TimeBucket一样，把时间对齐到所在区间的开始时间
+    """
+    timestamp = int(time.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+class SNMPDataRollupTask(TaskRun):
+    """
+    模块：资产性能数据降采样
+    更新周期：5分钟
+    描述：把已经结束的区间聚合到下一级粒度，再按各个粒度的保留时间清理过期数据，
+    原始数据和5分钟数据只有在聚合过之后才会被清理
+    """
+    # 每次最多聚合的时间范围，停机很久之后分多次补算，每次从上次聚合到的地方继续
+    max_batch = timedelta(days=1)
+
+    @classmethod
+    def run(cls, current: datetime):
+        cls.rollup(SNMPDataRollup.TIER_5MIN, current)
+        cls.rollup(SNMPDataRollup.TIER_1HOUR, current)
+        cls.clean(current)
+
+    @classmethod
+    def rollup(cls, tier: int, current: datetime) -> int:
+        """
+        聚合上次聚合之后已经结束的区间
+        :param tier: 聚合到的粒度
+        :return: 生成的聚合数据条数
+        """
+        end = align(current, tier)
+        time_field = cls.time_field(tier)
+        queryset = cls.source(tier).filter(**{time_field + '__lt': end})
+        last = cls.rolled_until(tier)
+        if last:
+            queryset = queryset.filter(**{time_field + '__gte': last})
+        # 从上次聚合到的地方之后的第一条数据开始，中间没有数据的区间直接跳过，
+        # 有数据的区间不会被跳过
+        first = queryset.aggregate(first=Min(time_field))['first']
+        if not first:
+            return 0
+        start = align(first, tier)
+        end = min(end, start + cls.max_batch)
+
+        rollups = [SNMPDataRollup(tier=tier, **row)
+                   for row in cls.aggregate(tier, start, end)]
+        with transaction.atomic():
+            SNMPDataRollup.objects.bulk_create(
+                rollups, batch_size=1000, ignore_conflicts=True)
+        return len(rollups)
+
+    @classmethod
+    def rolled_until(cls, tier: int) -> Optional[datetime]:
+        """
+        已经聚合到的时间，即最后一个聚合区间的结束时间
+        """
+        last = SNMPDataRollup.objects.filter(tier=tier).aggregate(
+            last=Max('start_time'))['last']
+        return last + timedelta(seconds=tier) if last else None
+
+    @classmethod
+    def source(cls, tier: int) -> QuerySet:
+        """
+        5分钟数据由原始数据聚合，1小时数据由5分钟数据聚合
+        """
+        if tier == SNMPDataRollup.TIER_5MIN:
+            return SNMPData.objects.order_by()
+        return SNMPDataRollup.objects.filter(
+            tier=SNMPDataRollup.TIER_5MIN).order_by()
+
+    @classmethod
+    def time_field(cls, tier: int) -> str:
+        return 'update_time' if tier == SNMPDataRollup.TIER_5MIN \
+            else 'start_time'
+
+    @classmethod
+    def aggregate(cls, tier: int, start: datetime, end: datetime) -> List[Dict]:
+        """
+        按资产和区间分组，一条SQL聚合[start, end)内的所有区间
+        由5分钟数据聚合时，平均值按每个区间的原始数据条数加权
+        """
+        time_field = cls.time_field(tier)
+        queryset = cls.source(tier).filter(**{
+            time_field + '__gte': start, time_field + '__lt': end})
+
+        aggregates = {}
+        if tier == SNMPDataRollup.TIER_5MIN:
+            aggregates['agg_count'] = Count('id')
+            for field in SNMPDataRollup.FIELDS:
+                aggregates['agg_{}_min'.format(field)] = Min(field)
+                aggregates['agg_{}_avg'.format(field)] = Avg(field)
+                aggregates['agg_{}_max'.format(field)] = Max(field)
+        else:
+            aggregates['agg_count'] = Sum('sample_count')
+            for field in SNMPDataRollup.FIELDS:
+                avg = field + '_avg'
+                aggregates['agg_{}_min'.format(field)] = Min(field + '_min')
+                aggregates['agg_{}_max'.format(field)] = Max(field + '_max')
+                aggregates['agg_{}_sum'.format(field)] = Sum(
+                    F(avg) * F('sample_count'), output_field=FloatField())
+                aggregates['agg_{}_weight'.format(field)] = Sum(
+                    'sample_count', filter=Q(**{avg + '__isnull': False}))
+
+        rows = queryset.annotate(
+            bucket=TimeBucket(time_field, tier)).values(
+            'device_id', 'bucket').annotate(**aggregates)
+
+        result = []
+        for row in rows:
+            data = {
+                'device_id': row['device_id'],
+                'start_time': row['bucket'],
+                'sample_count': row['agg_count'],
+            }
+            for field in SNMPDataRollup.FIELDS:
+                data[field + '_min'] = row['agg_{}_min'.format(field)]
+                data[field + '_max'] = row['agg_{}_max'.format(field)]
+                if tier == SNMPDataRollup.TIER_5MIN:
+                    data[field + '_avg'] = row['agg_{}_avg'.format(field)]
+                else:
+                    weight = row['agg_{}_weight'.format(field)]
+                    data[field + '_avg'] = row['agg_{}_sum'.format(field)] / \
+                        weight if weight else None
+            result.append(data)
+        return result
+
+    @classmethod
+    def clean(cls, current: datetime):
+        """
+        按各个粒度的保留时间清理数据，还没有聚合到下一级粒度的数据不清理
+        """
+        retention = SNMPDataRollup.RETENTION
+        raw_time = current - timedelta(days=retention[SNMPDataRollup.TIER_RAW])
+        rolled = cls.rolled_until(SNMPDataRollup.TIER_5MIN)
+        if rolled:
+            partition_register.get(SNMPData).drop_before(
+                min(raw_time, rolled))
+            SNMPData.objects.filter(
+                update_time__lt=min(raw_time, rolled)).delete()
+
+        five_min_time = current - timedelta(
+            days=retention[SNMPDataRollup.TIER_5MIN])
+        rolled = cls.rolled_until(SNMPDataRollup.TIER_1HOUR)
+        if rolled:
+            SNMPDataRollup.objects.filter(
+                tier=SNMPDataRollup.TIER_5MIN,
+                start_time__lt=min(five_min_time, rolled)).delete()
+
+        SNMPDataRollup.objects.filter(
+            tier=SNMPDataRollup.TIER_1HOUR,
+            start_time__lt=current - timedelta(
+                days=retention[SNMPDataRollup.TIER_1HOUR])).delete()
+
+
+def select_tier(start: datetime, end: datetime, max_points: int = 300,
+                current: Optional[datetime] = None) -> int:
+    """
+    按查询的时间范围选择数据粒度
+    每个点的时间间隔 = 时间范围 / max_points，选择不超过这个间隔的最粗粒度；
+    开始时间已经超出这个粒度的保留时间时，使用更粗的粒度
+    :return: 粒度(秒)
+    """
+    current = current or timezone.now()
+    resolution = (end - start).total_seconds() / max_points
+    selected = 0
+    for i, tier in enumerate(TIERS):
+        if tier <= resolution:
+            selected = i
+    for tier in TIERS[selected:]:
+        if start >= current - timedelta(days=SNMPDataRollup.RETENTION[tier]):
+            return tier
+    return TIERS[-1]
+
+
+def snmp_metric_series(device_id: int, field: str, start: datetime,
+                       end: datetime, max_points: int = 300,
+                       current: Optional[datetime] = None
+                       ) -> Tuple[int, List[Dict]]:
+    """
+    查询资产某个性能指标在时间范围内的数据，自动选择数据粒度
+    :param field: SNMPDataRollup.FIELDS里的字段，如cpu_in_use
+    :return: (粒度, [{'time': 时间, 'min': 最小值, 'avg': 平均值, 'max': 最大值}, ...])
+    """
+    if field not in SNMPDataRollup.FIELDS:
+        raise ValueError('不支持的性能指标: {}'.format(field))
+    tier = select_tier(start, end, max_points, current)
+
+    if tier == SNMPDataRollup.TIER_RAW:
+        rows = SNMPData.objects.filter(
+            device_id=device_id, update_time__gte=start, update_time__lt=end,
+        ).order_by('update_time').values_list('update_time', field)
+        return tier, [{'time': t, 'min': v, 'avg': v, 'max': v}
+                      for t, v in rows]
+
+    rows = SNMPDataRollup.objects.filter(
+        device_id=device_id, tier=tier, start_time__gte=align(start, tier),
+        start_time__lt=end,
+    ).order_by('start_time').values_list(
+        'start_time', field + '_min', field + '_avg', field + '_max')
+    return tier, [{'time': t, 'min': min_, 'avg': avg, 'max': max_}
+                  for t, min_, avg, max_ in rows]
@@ -3,7 +3,8 @@ from typing import Dict, List, Optional
 from drf_yasg import openapi
 from rest_framework import serializers
 
-from snmp.models import SNMPRule, SNMPTemplate, SNMPData, SNMPSetting
+from snmp.models import SNMPRule, SNMPTemplate, SNMPData, SNMPSetting, \
+    SNMPDataRollup
 from utils.core.exceptions import CustomError
 from statistic.serializers import UpdateTimeSerializer
 from snmp.snmp_run import NetworkUsageClient
@@ -406,3 +407,17 @@ class SNMPDataSerializer(serializers.ModelSerializer):
 
     def get_update_time(self, instance: SNMPData):
         return [d.update_time for d in self.snmp_data]
+
+
+class SNMPHistoryQuerySerializer(serializers.Serializer):
+    device = serializers.IntegerField(help_text='资产ID')
+    field = serializers.ChoiceField(SNMPDataRollup.FIELDS, help_text='性能指标')
+    start_time = serializers.DateTimeField(help_text='开始时间')
+    end_time = serializers.DateTimeField(help_text='结束时间')
+    max_points = serializers.IntegerField(
+        default=300, min_value=10, max_value=2000, help_text='最多返回的点数')
+
+    def validate(self, attrs):
+        if attrs['start_time'] >= attrs['end_time']:
+            raise serializers.ValidationError('开始时间必须早于结束时间')
+        return attrs
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from base_app.models import Device
+from snmp.models import SNMPSetting, SNMPTemplate, SNMPRule
+from snmp.planner import invalidate_poll_plan
+
+# 资产的这些字段会影响性能采集
+DEVICE_PLAN_FIELDS = {'monitor', 'ip', 'name'}
+
+
+@receiver(post_save, sender=SNMPSetting)
+@receiver(post_delete, sender=SNMPSetting)
+@receiver(post_save, sender=SNMPTemplate)
+@receiver(post_delete, sender=SNMPTemplate)
+@receiver(post_save, sender=SNMPRule)
+@receiver(post_delete, sender=SNMPRule)
+@receiver(m2m_changed, sender=SNMPTemplate.rules.through)
+@receiver(post_delete, sender=Device)
+def snmp_setting_changed(sender, **kwargs):
+    invalidate_poll_plan()
+
+
+@receiver(post_save, sender=Device)
+def device_post_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    资产的在线状态等字段更新很频繁，只有影响性能采集的字段变化时才重新加载采集计划
+    """
+    if update_fields and not DEVICE_PLAN_FIELDS & set(update_fields):
+        return
+    invalidate_poll_plan()
@@ -1,12 +1,18 @@
+import asyncio
+import json
+import logging
 import os
 import re
+import threading
 import time
 from abc import ABC, abstractmethod
-from typing import List, Union, Dict, Tuple
+from typing import List, Union, Dict, Tuple, Optional
 
 import django
+from django.db import transaction
 from django.utils import timezone
-from pysnmp.hlapi import *
+from pyasn1.type import univ
+from pysnmp.hlapi.asyncio import *
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE",
                       "unified_management_platform.settings")
@@ -15,8 +21,12 @@ django.setup()
 from base_app.models import Device
 from snmp.models import SNMPRule, SNMPSetting, SNMPData, SNMPTemplate
 from utils.core.exceptions import SNMPError
+from utils.helper import get_today
+from utils.unified_redis import cache
 from log.tasks import ping_status
-from log.security_event import AssetsCPUEvent, AssetsMemoryEvent, AssetsDiskEvent, ProcessEvent
+from utils.ping import pinger, BatchPinger
+from log.security_event import AssetsCPUEvent, AssetsMemoryEvent, AssetsDiskEvent, ProcessEvent, \
+    EventCollector
 
 AUTH_PROTOCOLS = {
     SNMPSetting.AUTH_SHA: usmHMAC128SHA224AuthProtocol,
@@ -34,6 +44,127 @@ PRIV_PROTOCOLS = {
 pattern = re.compile(r'.*? = (.*?: )?(.*)')
 pattern_disk = re.compile(r'.*? = (\w+: )?(.*)')
 
+logger = logging.getLogger('snmp_task')
+
+
+class SNMPEnginePool(object):
+    """
+    常驻的SNMP引擎池
+    SnmpEngine初始化要加载MIB，是pysnmp里开销最大的操作之一，所以引擎常驻复用，
+    不再每个资产每次采集都新建。所有引擎挂在同一个后台线程的asyncio事件循环上，
+    几百个GET/WALK请求在一个循环里同时等待响应，一轮采集的耗时取决于最慢的资产，
+    而不是线程数
+    V1/V2的团体字在引擎里按团体字区分，可以共用一个引擎；V3的用户在引擎里按用户名
+    缓存，同名用户不同密码会互相覆盖，所以不同的V3认证参数各用一个引擎
+    """
+
+    def __init__(self):
+        self._engines: Dict[Optional[tuple], SnmpEngine] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self._run_forever, args=(loop,),
+                                  name='snmp-engine', daemon=True)
+        # 引擎的传输层绑定在事件循环上，换了循环要重新创建引擎
+        self._engines = {}
+        self._loop = loop
+        self._thread = thread
+        thread.start()
+
+    @staticmethod
+    def _run_forever(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def get_engine(self, key: Optional[tuple] = None) -> SnmpEngine:
+        """
+        只能在事件循环的线程里调用，引擎第一次发请求时会把传输层绑定到当前的事件循环
+        :param key: 认证参数，V1/V2为None，共用同一个引擎
+        """
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = self._engines[key] = SnmpEngine()
+        return engine
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """
+        在引擎的事件循环里执行协程，阻塞等待结果，不能在事件循环的线程里调用
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+
+snmp_engine_pool = SNMPEnginePool()
+
+
+class SNMPCounterStore(object):
+    """
+    保存每个资产上一次采集到的计数器，按(资产, OID)保存，计算磁盘读写、网卡流量这类
+    速率时和上一次采集的数据比较，一次采集只需要walk一次
+    数据结构: snmp-counter-<资产ID> -> {'oid1,oid2': {'time': 时间戳, 'rows': {名称: [计数...]}}}
+    """
+    COUNTER32 = 2 ** 32
+    COUNTER64 = 2 ** 64
+
+    def __init__(self, key_pattern: str = 'snmp-counter-',
+                 expire: int = 60 * 60 * 24):
+        self.key_pattern = key_pattern
+        self.expire = expire
+
+    def key(self, device_id: int) -> str:
+        return self.key_pattern + str(device_id)
+
+    def load(self, device_id: int) -> Dict[str, Dict]:
+        return {oid: json.loads(sample) for oid, sample in
+                cache.hgetall(self.key(device_id)).items()}
+
+    def save(self, device_id: int, samples: Dict[str, Dict]):
+        self.save_many({device_id: samples})
+
+    def save_many(self, device_samples: Dict[int, Dict[str, Dict]]):
+        """
+        一轮采集的计数器通过一个pipeline保存
+        :param device_samples: {资产ID: {oid: sample}}
+        """
+        with cache.pipeline() as pipe:
+            for device_id, samples in device_samples.items():
+                if not samples:
+                    continue
+                key = self.key(device_id)
+                pipe.hset(key, mapping={oid: json.dumps(sample)
+                                        for oid, sample in samples.items()})
+                pipe.expire(key, self.expire)
+            pipe.execute()
+
+    @classmethod
+    def delta(cls, previous: int, current: int) -> int:
+        """
+        计算两次采集之间计数器的增量
+        计数器变小说明发生了回绕，按上一次的值判断是32位还是64位计数器；回绕后的增量
+        超过计数器范围的一半，更可能是资产重启后计数器清零，这时增量就是当前值
+        """
+        if current >= previous:
+            return current - previous
+        width = cls.COUNTER32 if previous < cls.COUNTER32 else cls.COUNTER64
+        delta = current + width - previous
+        if delta > width // 2:
+            return current
+        return delta
+
+
+counter_store = SNMPCounterStore()
+
 
 class AbstractSNMPClient(ABC):
 
@@ -85,62 +216,112 @@ snmp_config = SNMPConfig()
 
 
 class SNMPClient(AbstractSNMPClient):
-    def __init__(self, device: Device, interval=1, current=None):
-        self._engine = SnmpEngine()
+    # 单个请求的重试次数，每次等待SNMPSetting.overtime秒
+    RETRIES = 1
+    # walk最多请求的行数，防止设备返回的OID不递增时死循环
+    MAX_WALK_ROWS = 10000
+
+    def __init__(self, device: Device, current=None,
+                 rules: Optional[List[SNMPRule]] = None):
+        """
+        构造时只做数据库查询，不发送SNMP请求，也不保存数据，方便在主线程里准备好再
+        交给引擎的事件循环并发采集
+        :param device: 资产
+        :param current: 采集时间
+        :param rules: 采集计划里缓存的规则，这时资产的snmpsetting和模板也已经加载过，
+                      不用再查询数据库
+        """
         self._device: Device = device
-        tmp = Device.objects.select_related(
-            'snmpsetting', 'snmpsetting__template').only(
-            'snmpsetting', 'snmpsetting__template').get(
-            id=self._device.id)
-        self._setting: SNMPSetting = tmp.snmpsetting
-        self._template: SNMPTemplate = tmp.snmpsetting.template
-        self._rules: List[SNMPRule] = self._template.rules.all()
+        if rules is None:
+            tmp = Device.objects.select_related(
+                'snmpsetting', 'snmpsetting__template').only(
+                'snmpsetting', 'snmpsetting__template').get(
+                id=self._device.id)
+            self._setting: SNMPSetting = tmp.snmpsetting
+            self._template: SNMPTemplate = tmp.snmpsetting.template
+            # 事件循环里不能访问数据库，规则要提前查出来
+            self._rules: List[SNMPRule] = list(self._template.rules.all())
+        else:
+            self._setting = device.snmpsetting
+            self._template = self._setting.template
+            self._rules = rules
         self._oids = []
         self._watchers = {}
-        self._interval = interval
+        # 上一次采集的计数器和这一次采集到的计数器，save_data时保存
+        self._counters: Dict[str, Dict] = counter_store.load(self._device.id)
+        self._new_counters: Dict[str, Dict] = {}
         self._result = {}
         self._processed = False
+        # 采集是否超过了deadline
+        self.timed_out = False
         self._active = None
-        self.current = current
-
-        self.set_current_run_time()
+        self.current = current or timezone.now()
 
     def set_current_run_time(self):
-        if not self.current:
-            self.current = timezone.now()
+        """
+        只更新last_run_time一个字段，批量采集时由snmp_task统一更新
+        """
         self._setting.last_run_time = self.current
-        self._setting.save()
+        SNMPSetting.objects.filter(id=self._setting.id).update(
+            last_run_time=self.current)
+
+    @property
+    def deadline(self) -> float:
+        """
+        单个资产一次采集的总时长不能超过采集周期
+        """
+        return max(self._setting.frequency, 1) * 60
 
     def snmp_get(self) -> Dict:
         """
-        对外只暴露snmp_get方法
+        同步调用的入口，在常驻引擎的事件循环里执行一次采集
+        """
+        return snmp_engine_pool.run(self.async_snmp_get())
+
+    async def async_snmp_get(self) -> Dict:
+        """
         内部逻辑
             1. 对于使用walk的请求，需要在循环内单独调用对应OID的Client获取数据
             2. 对于使用get的请求，因为循环内单独请求效率比较低，因此是将oid注册到SNMPClient
                类里的_oids里，统一进行请求
+        各个Client的请求在事件循环里并发执行，超过deadline的返回已经获取到的数据
         :return: [{'name': '系统信息', 'data': 'xxx'}, ...]
         """
-        if not self.is_device_active():
-            self._processed = True
-            return {}
+        try:
+            await asyncio.wait_for(self._async_snmp_get(), self.deadline)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            logger.error('资产: {}, 资产ID: {}, SNMP采集超时'.format(
+                self._device.name, self._device.id))
+        self._processed = True  # 已经获取完所有数据
+        return self.result
 
+    async def _async_snmp_get(self):
+        if not await self.async_is_device_active():
+            return
+
+        clients = []
         for rule in self._rules:
             config = snmp_config.get_config(rule.field)
             client = config['client']  # 请求字段对应的数据需要使用的Client类
-            temp = client(rule, self, self._interval).snmp_get()
+            clients.append(client(rule, self))
+        results = await asyncio.gather(*[c.snmp_get() for c in clients])
+        for temp in results:
             if temp:
                 self._result.update(temp)
         if self._oids:
             # 对于get的情况，snmp_get里不实际获取数据，而是将oid注册到SNMPClient的oids
             # 里，然后统一调用_snmp_get批量获取
-            self._result.update(self.snmp_batch_get(self._oids))
-        self._processed = True  # 已经获取完所有数据
-        return self.result
+            self._result.update(await self.snmp_batch_get(self._oids))
 
     @property
     def result(self):
         return self._result
 
+    @property
+    def device(self) -> Device:
+        return self._device
+
     def is_device_active(self) -> bool:
         """
         判断资产在线状态，根据ping是否返回结果判断
@@ -149,20 +330,49 @@ class SNMPClient(AbstractSNMPClient):
             self._active = ping_status(self._device.ip)
         return self._active
 
-    def save_data(self):
+    async def async_is_device_active(self) -> bool:
+        """
+        一轮采集时由snmp_task批量ping后通过set_active设置，单独采集时才在这里ping
+        """
+        if self._active is None:
+            if BatchPinger.split([self._device.ip])[0]:
+                result = await pinger.async_ping([self._device.ip])
+                self._active = result[self._device.ip].alive
+            else:
+                loop = asyncio.get_event_loop()
+                self._active = await loop.run_in_executor(
+                    None, ping_status, self._device.ip)
+        return self._active
+
+    def set_active(self, active: bool):
+        self._active = active
+
+    @property
+    def counters(self) -> Dict[str, Dict]:
+        return self._new_counters
+
+    def build_data(self) -> SNMPData:
+        """
+        生成还未保存的SNMPData，批量采集时由SNMPDataBuffer统一写入
+        """
         if not self._processed:
             raise SNMPError('还未获取过SNMP数据，请先执行snmp_get()')
-        data = SNMPData(device=self._device, **self.result)
+        return SNMPData(device=self._device, **self.result)
+
+    def save_data(self):
+        data = self.build_data()
         data.save()
+        counter_store.save(self._device.id, self._new_counters)
 
         self.check_device_healthy()
 
-    def check_device_healthy(self):
+    def check_device_healthy(self, process_average: Optional[float] = None):
         """
         检查资产运行健康状态
         资产CPU不能大于80
         资产内存不能大于80
         资产存储空间不能大于80
+        :param process_average: 批量计算好的平均进程数
         :return:
         """
         cpu = AssetsCPUEvent(self._result.get('cpu_in_use', 0),
@@ -177,30 +387,30 @@ class SNMPClient(AbstractSNMPClient):
                                         partition=p['name'])
             partition.generate()
         process = ProcessEvent(self._result.get('process_count', 0),
-                               self.current, device=self._device)
+                               self.current, device=self._device,
+                               average=process_average)
         process.generate()
 
-    def snmp_batch_get(self, oids: List[Tuple[str, ObjectType]]) -> Dict:
+    async def snmp_batch_get(self, oids: List[Tuple[str, ObjectType]]) -> Dict:
         """
         获取注册到_oids里的使用snmp-get的数据，对于GetClient，默认情况下都不需要自己获取
         统一注册到_oid里即可。
         :param oids:
         :return: [{'name': 'xxx', 'data': 13}, {'name': 'xxxx', 'data': 23}]
         """
-        iterator = getCmd(
+        error_indication, error_status, error_index, var_binds = await getCmd(
             *self.cmd_parameters(),
             *[o[1] for o in oids],
         )
         result = {}
 
-        error_indication, error_status, error_index, var_binds = next(iterator)
-
         if error_indication:
-            print(error_indication)
+            logger.warning('{}: {}'.format(self._device.ip, error_indication))
         else:
             if error_status:  # SNMP agent errors
-                print('%s at %s' % (error_status.prettyPrint(), var_binds[
-                    int(error_index) - 1] if error_index else '?'))
+                logger.warning('%s: %s at %s' % (
+                    self._device.ip, error_status.prettyPrint(),
+                    var_binds[int(error_index) - 1] if error_index else '?'))
             else:
                 for i, var_bind in enumerate(
                         var_binds):  # SNMP response contents
@@ -214,6 +424,43 @@ class SNMPClient(AbstractSNMPClient):
                     result.update(self.notify(temp))
         return result
 
+    async def snmp_walk(self, oids: List[str]) -> List[List[ObjectType]]:
+        """
+        asyncio版本的nextCmd每次只请求一步，需要自己循环，直到返回的OID超出了请求的
+        OID子树，效果和同步版本的lexicographicMode=False一样
+        :param oids: ['.1.3.6.1.2.1.25.3.3.1.2', ...]
+        :return: [[ObjectType, ObjectType], ...] 每一行是各个oid下同一个索引的数据
+        """
+        roots = [ObjectIdentifier(oid.strip('.')) for oid in oids]
+        var_binds = [ObjectType(ObjectIdentity(oid)) for oid in oids]
+        result = []
+
+        for _ in range(self.MAX_WALK_ROWS):
+            error_indication, error_status, error_index, var_bind_table = \
+                await nextCmd(*self.cmd_parameters(), *var_binds)
+            if error_indication:
+                logger.warning('{}: {}'.format(self._device.ip, error_indication))
+                break
+            if error_status:
+                # SNMPv1用noSuchName表示walk到了MIB的末尾
+                if error_status != 2:
+                    logger.warning('%s: %s at %s' % (
+                        self._device.ip, error_status.prettyPrint(),
+                        var_binds[int(error_index) - 1] if error_index else '?'))
+                break
+            if not var_bind_table:
+                break
+
+            row = var_bind_table[0]
+            names = [var_bind[0].getOid() for var_bind in row]
+            # noSuchObject、endOfMibView等都是Null的子类
+            if any(isinstance(var_bind[1], univ.Null) or not root.isPrefixOf(name)
+                   for root, name, var_bind in zip(roots, names, row)):
+                break
+            result.append(row)
+            var_binds = [(name, Null('')) for name in names]
+        return result
+
     def notify(self, result: Dict) -> Dict:
         """
         通知子Client可以来处理获取到的原始数据了
@@ -238,6 +485,16 @@ class SNMPClient(AbstractSNMPClient):
     def register_watcher(self, name: str, client: AbstractSNMPClient):
         self._watchers[name] = client
 
+    def update_counter(self, key: str, sample: Dict) -> Optional[Dict]:
+        """
+        记录这一次采集的计数器
+        :param key: 计数器对应的OID
+        :param sample: {'time': 时间戳, 'rows': {名称: [计数...]}}
+        :return: 上一次采集的计数器，没有时返回None
+        """
+        self._new_counters[key] = sample
+        return self._counters.get(key)
+
     def cmd_parameters(self) -> List:
         """
         通用的snmp请求参数，get和next都可以使用
@@ -250,14 +507,26 @@ class SNMPClient(AbstractSNMPClient):
         :return:
         """
         return [
-            self._engine,
+            snmp_engine_pool.get_engine(self._engine_key()),
             self._authentication(),
             self._transport_target(),
             ContextData(),
         ]
 
+    def _engine_key(self) -> Optional[tuple]:
+        """
+        V1/V2共用一个引擎，V3按认证参数区分引擎
+        """
+        if self._setting.version in [SNMPSetting.SNMP_V1, SNMPSetting.SNMP_V2]:
+            return None
+        return (self._setting.username, self._setting.security_level,
+                self._setting.auth, self._setting.auth_password,
+                self._setting.priv, self._setting.priv_password)
+
     def _transport_target(self):
-        return UdpTransportTarget((self._device.ip, self._setting.port))
+        return UdpTransportTarget((self._device.ip, self._setting.port),
+                                  timeout=self._setting.overtime,
+                                  retries=self.RETRIES)
 
     def _authentication(self) -> Union[CommunityData, UsmUserData]:
         if self._setting.version in [SNMPSetting.SNMP_V1, SNMPSetting.SNMP_V2]:
@@ -305,12 +574,67 @@ class SNMPClient(AbstractSNMPClient):
         )
 
 
+class SNMPDataBuffer(object):
+    """
+    一轮采集的结果先放在内存里，最后在一个事务里用bulk_create写入，
+    不再每个资产单独INSERT一次
+    """
+
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+        self._clients: List[SNMPClient] = []
+        self._data: List[SNMPData] = []
+
+    def __len__(self):
+        return len(self._data)
+
+    def add(self, client: SNMPClient):
+        self._data.append(client.build_data())
+        self._clients.append(client)
+
+    def flush(self) -> int:
+        """
+        写入采集数据和计数器，然后检查资产的健康状态
+        :return: 写入的数据条数
+        """
+        if not self._data:
+            return 0
+        with transaction.atomic():
+            SNMPData.objects.bulk_create(self._data, batch_size=self.batch_size)
+        counter_store.save_many({c.device.id: c.counters for c in self._clients})
+
+        # 平均进程数按采集时间分组，每组一次查询
+        groups = {}
+        for client in self._clients:
+            groups.setdefault(client.current, []).append(client.device.id)
+        averages = {}
+        for current, device_ids in groups.items():
+            for device_id, average in ProcessEvent.averages(
+                    device_ids, current).items():
+                averages[(device_id, current)] = average
+
+        # 这一批资产产生的安全事件一起去重、写入和推送
+        with EventCollector(get_today(timezone.now()), kinds=[ProcessEvent]):
+            for client in self._clients:
+                try:
+                    client.check_device_healthy(
+                        averages[(client.device.id, client.current)])
+                except Exception as e:
+                    logger.error(e)
+                    logger.error('资产: {}, 资产ID: {}'.format(
+                        client.device.name, client.device.id))
+        count = len(self._data)
+        self._clients = []
+        self._data = []
+        return count
+
+
 class BaseClient(AbstractSNMPClient):
     def __init__(self, rule: SNMPRule, client: SNMPClient, *args, **kwargs):
         self.rule = rule
         self.client = client
 
-    def snmp_get(self):
+    async def snmp_get(self):
         """
         将oid注册到SNMPClient里，交由它来处理，如果子类需要定制化请求，继承的时候就重写
         这个方法，返回Dict的数据结构
@@ -318,40 +642,27 @@ class BaseClient(AbstractSNMPClient):
         self.client.register(
             (self.rule.field, ObjectType(ObjectIdentity(self.rule.oid[0]))))
 
-    def snmp_batch_get(self, oids: List[Tuple[str, ObjectType]]):
+    async def snmp_batch_get(self, oids: List[Tuple[str, ObjectType]]):
         """
         批量获取oid的数据
         :param oids: [('name', 'oid'), ...]
         :return:
         """
-        return self.client.snmp_batch_get(oids)
+        return await self.client.snmp_batch_get(oids)
 
-    def snmp_walk(self) -> List:
+    async def snmp_walk(self) -> List:
         """
         walk因为无法批量操作，因此对于一个oid来说，需要子类自己去请求数据，而不能交给
         SNMPClient
         :return: [['oid.1', 'oid.2', 'oid.3'], ...]
         """
-        iterator = nextCmd(
-            *self.cmd_parameters(),
-            *[ObjectType(ObjectIdentity(i)) for i in self.rule.oid],
-            lexicographicMode=False
-        )
         result = []
-
-        for errorIndication, errorStatus, errorIndex, varBinds in iterator:
-            if errorIndication:
-                print(errorIndication)
-            else:
-                if errorStatus:  # SNMP agent errors
-                    print('%s at %s' % (errorStatus.prettyPrint(), varBinds[
-                        int(errorIndex) - 1] if errorIndex else '?'))
-                else:
-                    one = []
-                    for varBind in varBinds:  # SNMP response contents
-                        res = ' = '.join([x.prettyPrint() for x in varBind])
-                        one.append(self.get_result(res))
-                    result.append(one)
+        for var_binds in await self.client.snmp_walk(self.rule.oid):
+            one = []
+            for var_bind in var_binds:  # SNMP response contents
+                res = ' = '.join([x.prettyPrint() for x in var_bind])
+                one.append(self.get_result(res))
+            result.append(one)
         return result
 
     def cmd_parameters(self):
@@ -373,8 +684,8 @@ class SystemRunTimeClient(BaseClient):
     HOUR = 60 * 60
     MINUTE = 60
 
-    def snmp_get(self):
-        super().snmp_get()
+    async def snmp_get(self):
+        await super().snmp_get()
         self.client.register_watcher(self.rule.field, self)
 
     def notify(self, result: Dict) -> Dict:
@@ -393,45 +704,73 @@ class SystemRunTimeClient(BaseClient):
         return f'{int(day)},{int(hour)},{int(hour)},{int(minute)}'
 
 
+class CounterClient(BaseClient):
+    """
+    计数器类型的数据，每次采集只walk一次，速率按和上一次采集的差值计算，
+    第一次采集没有可以比较的数据，不返回结果
+    walk的第一列是名称，后面的列是计数器
+    """
+
+    async def snmp_get(self) -> Dict:
+        result = await self.snmp_walk()
+        if not result:
+            return {}
+        sample = {'time': time.time(), 'rows': self.parse_counters(result)}
+        previous = self.client.update_counter(','.join(self.rule.oid), sample)
+        if not previous:
+            return {}
+        interval = sample['time'] - previous['time']
+        if interval <= 0:
+            return {}
+
+        rates = {}
+        for name, counters in sample['rows'].items():
+            last = previous['rows'].get(name)
+            if not last or len(last) != len(counters):
+                continue
+            rates[name] = [counter_store.delta(p, c) / interval
+                           for p, c in zip(last, counters)]
+        return self.calculate_rates(rates)
+
+    def parse_counters(self, result: List[List[str]]) -> Dict[str, List[int]]:
+        rows = {}
+        for row in result:
+            try:
+                rows[row[0]] = [int(i) for i in row[1:]]
+            except ValueError:
+                continue
+        return rows
+
+    @abstractmethod
+    def calculate_rates(self, rates: Dict[str, List[float]]) -> Dict:
+        """
+        :param rates: {名称: [每秒增量...]}
+        """
+        pass
+
+
 @snmp_config.register(['.1.3.6.1.4.1.2021.13.15.1.1.2',  # 磁盘名称
                        '.1.3.6.1.4.1.2021.13.15.1.1.5',  # 磁盘读字节数 KB
                        '.1.3.6.1.4.1.2021.13.15.1.1.6'],  # 磁盘写字节数 KB
                       'walk', 'disk_info')
-class DiskClient(BaseClient):
-    def __init__(self, rule, client, interval=1):
-        super().__init__(rule, client)
-        self._interval = interval
-
-    def snmp_get(self) -> Dict[str, List]:
-        start = time.time()
-        result1 = self.snmp_walk()
-        time.sleep(self._interval)
-        result2 = self.snmp_walk()
-        end = time.time()
-        if result1 and result2:
-            result = self.calculate_disk(result1, result2, (end-start))
-            return {self.rule.field: result}
-        else:
-            return {}
-
-    def calculate_disk(self, result1: List, result2: List, interval: float):
+class DiskClient(CounterClient):
+    def calculate_rates(self, rates: Dict[str, List[float]]) -> Dict:
         result = []
-        for i in range(len(result1)):
-            r1, r2 = result1[i], result2[i]
+        for name, (read, write) in rates.items():
             result.append(
                 {
-                    'name': r1[0],
-                    'read': self.safe_divide(int(r2[1]) - int(r1[1]),  interval),
-                    'write': self.safe_divide(int(r2[2]) - int(r1[2]), interval),
+                    'name': name,
+                    'read': round(read, 2),
+                    'write': round(write, 2),
                 }
             )
-        return result
+        return {self.rule.field: result}
 
 
 @snmp_config.register('.1.3.6.1.2.1.25.3.3.1.2', 'walk', 'cpu_usage')
 class CPUUsageClient(BaseClient):
-    def snmp_get(self) -> Dict:
-        result = self.snmp_walk()
+    async def snmp_get(self) -> Dict:
+        result = await self.snmp_walk()
         if not result:
             return {}
         cpu_cores = len(result)
@@ -455,8 +794,8 @@ class CPUUsageClient(BaseClient):
 
 @snmp_config.register('.1.3.6.1.2.1.25.4.2.1.2', 'walk', 'process_count')
 class ProcessClient(BaseClient):
-    def snmp_get(self) -> Dict[str, int]:
-        result = self.snmp_walk()
+    async def snmp_get(self) -> Dict[str, int]:
+        result = await self.snmp_walk()
         if not result:
             return {}
         return {self.rule.field: len(result)}
@@ -475,7 +814,7 @@ class MemoryUsage(BaseClient):
     https://serverfault.com/questions/640459/snmp-memory-values-do-not-match-free
     """
 
-    def snmp_get(self) -> Dict:
+    async def snmp_get(self) -> Dict:
         oids = [
             ('total_memory', ObjectType(ObjectIdentity(self.rule.oid[0]))),
             ('avail_memory', ObjectType(ObjectIdentity(self.rule.oid[1]))),
@@ -484,7 +823,7 @@ class MemoryUsage(BaseClient):
             ('total_swap_memory', ObjectType(ObjectIdentity(self.rule.oid[4]))),
             ('avail_swap_memory', ObjectType(ObjectIdentity(self.rule.oid[5]))),
         ]
-        result = self.snmp_batch_get(oids)
+        result = await self.snmp_batch_get(oids)
         if not result:
             return {}
         return self.calculate_usage(result)
@@ -525,8 +864,8 @@ class MemoryUsage(BaseClient):
                        '.1.3.6.1.4.1.2021.9.1.6',
                        '.1.3.6.1.4.1.2021.9.1.8'], 'walk', 'partition_usage')
 class DiskPartitionUsageClient(BaseClient):
-    def snmp_get(self) -> Dict[str, List]:
-        disk_usage = self.snmp_walk()
+    async def snmp_get(self) -> Dict[str, List]:
+        disk_usage = await self.snmp_walk()
         if not disk_usage:
             return {}
         return self.calculate_disk_usage(disk_usage)
@@ -563,39 +902,19 @@ class DiskPartitionUsageClient(BaseClient):
 @snmp_config.register(['.1.3.6.1.2.1.31.1.1.1.1',
                        '.1.3.6.1.2.1.2.2.1.10',
                        '.1.3.6.1.2.1.2.2.1.16'], 'walk', 'network_usage')
-class NetworkUsageClient(BaseClient):
+class NetworkUsageClient(CounterClient):
     NON_PHYSICAL_INTERFACE = ['lo', 'docker', 'br', 'veth']
 
-    def __init__(self, rule, client, interval=1):
-        super().__init__(rule, client)
-        self._interval = interval
-
-    def snmp_get(self) -> Dict:
-        start_time = time.time()
-        result1 = self.snmp_walk()
-        time.sleep(self._interval)
-        result2 = self.snmp_walk()
-        end_time = time.time()
-        if result1 and result2:
-            return self.calculate_network_usage(result1, result2,
-                                                end_time-start_time)
-        else:
-            return {}
-
-    def calculate_network_usage(self, result1: List[Dict],
-                                result2: List[Dict], interval) -> Dict:
+    def calculate_rates(self, rates: Dict[str, List[float]]) -> Dict:
         result = []
         network_in_speed = 0
         network_out_speed = 0
 
-        for i in range(len(result1)):
-            r1, r2 = result1[i], result2[i]
+        for name, (in_, out) in rates.items():
             temp = {
-                'name': r1[0],
-                'in': self.safe_divide(
-                    int(r2[1]) - int(r1[1]), interval * 1024, 2),  # KB
-                'out': self.safe_divide(
-                    int(r2[2]) - int(r1[2]), interval * 1024, 2),  # KB
+                'name': name,
+                'in': round(in_ / 1024, 2),  # KB
+                'out': round(out / 1024, 2),  # KB
             }
             result.append(temp)
 
@@ -631,8 +950,8 @@ class NetworkUsageClient(BaseClient):
 class WinPartitionUsage(BaseClient):
     DISK_NAME = re.compile(r'(\w+:).*')
 
-    def snmp_get(self) -> Dict:
-        result = self.snmp_walk()
+    async def snmp_get(self) -> Dict:
+        result = await self.snmp_walk()
         if not result:
             return {}
         data = []
@@ -686,8 +1005,8 @@ class WinPartitionUsage(BaseClient):
                        '.1.3.6.1.2.1.25.2.3.1.6',  # 已使用数量
                        ], 'walk', 'win_memory')
 class WindowsMemoryUsage(BaseClient):
-    def snmp_get(self):
-        result = self.snmp_walk()
+    async def snmp_get(self):
+        result = await self.snmp_walk()
         data = {}
         for disk in result:
             for i in range(1, len(disk)):
@@ -1,62 +1,165 @@
+import asyncio
 import logging
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict, List, Optional
 
 import django
+from django.conf import settings
 from django.db import connections
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE",
                       "unified_management_platform.settings")
 django.setup()
 
-from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 
-from snmp.snmp_run import SNMPClient
+from snmp.models import SNMPSetting
+from snmp.planner import SNMPPollPlanner
+from snmp.snmp_run import SNMPClient, SNMPDataBuffer, snmp_engine_pool
+from snmp.throttle import AdaptiveConcurrency, SubnetRateLimiter, PollStats
 from base_app.models import Device
+from utils.ping import pinger, BatchPinger
 
 
 logger = logging.getLogger('snmp_task')
 
 
 def snmp_task():
-    pool = ThreadPoolExecutor(20)
+    """
+    采集计划缓存在SNMPPollPlanner里，每次只取出到了采集时间的资产，
+    最多等待30秒就检查一次采集计划有没有变化
+    并发数按目标轮次耗时和最近的采集耗时自动调整，同一网段的资产按速率限制开始采集
+    """
+    planner = SNMPPollPlanner()
+    concurrency = AdaptiveConcurrency(settings.SNMP_TARGET_CYCLE,
+                                      maximum=settings.SNMP_MAX_CONCURRENCY)
+    limiter = SubnetRateLimiter(settings.SNMP_SUBNET_RATE)
     while True:
         current = timezone.now()
-        logger.info('开始执行性能采集任务')
-        devices = []
-        for d in Device.objects.all():
-            if check_should_snmp(d):
-                devices.append(d)
-
-        tasks = [pool.submit(snmp_run, device, current) for device in devices]
-        cnt = 0
-        for t in tasks:
-            cnt += 1
-            t.result()
-        time.sleep(30)
+        # 数据库、redis出错时只跳过这一轮，采集线程不能退出
+        try:
+            devices = planner.due(current)
+            if devices:
+                logger.info('开始执行性能采集任务')
+                snmp_cycle(devices, current, planner, concurrency, limiter)
+        except Exception:
+            logger.exception('性能采集任务执行失败')
+
+        wait = planner.seconds_until_next(timezone.now())
+        time.sleep(30 if wait is None else min(max(wait, 1), 30))
+
+
+def snmp_cycle(devices: List[Device], current: datetime,
+               planner: Optional[SNMPPollPlanner] = None,
+               concurrency: Optional[AdaptiveConcurrency] = None,
+               limiter: Optional[SubnetRateLimiter] = None):
+    """
+    一轮采集：数据库查询和保存在当前线程里完成，SNMP请求全部交给常驻引擎的事件循环
+    并发执行，并发数由concurrency决定，同一网段的资产由limiter限速。
+    采集结果在一个事务里批量写入，每个资产的耗时、超时、调度延迟和这一轮的汇总
+    记录在PollStats里
+    :return: 写入的数据条数
+    """
+    concurrency = concurrency or AdaptiveConcurrency(
+        settings.SNMP_TARGET_CYCLE, maximum=settings.SNMP_MAX_CONCURRENCY)
+    limiter = limiter or SubnetRateLimiter(settings.SNMP_SUBNET_RATE)
+    start = time.perf_counter()
+    clients = []
+    for device in devices:
+        try:
+            rules = planner.rules(device) if planner else None
+            clients.append(SNMPClient(device, current=current, rules=rules))
+        except Exception as e:
+            logger.error(e)
+            logger.error('资产: {}, 资产ID: {}'.format(device.name, device.id))
+    SNMPSetting.objects.filter(
+        device_id__in=[d.id for d in devices]).update(last_run_time=current)
+
+    buffer = SNMPDataBuffer()
+    stats = PollStats()
+    limit = concurrency.limit(len(clients))
+    try:
+        latencies = snmp_engine_pool.run(
+            poll_clients(clients, limit, limiter))
+        for client in clients:
+            setting = client.device.snmpsetting
+            stats.record(client.device.id, latencies.get(client.device.id, 0),
+                         client.timed_out,
+                         planner.lag(client.device) if planner else 0,
+                         max(setting.frequency, 1) * 60)
+        for client in clients:
+            try:
+                buffer.add(client)
+            except Exception as e:
+                logger.error(e)
+                logger.error('资产: {}, 资产ID: {}'.format(
+                    client.device.name, client.device.id))
+        flush_start = time.perf_counter()
+        count = buffer.flush()
+        end = time.perf_counter()
+    finally:
+        connections.close_all()
 
+    concurrency.observe(stats.latencies())
+    summary = stats.summary(end - start, limit)
+    try:
+        stats.save(summary)
+    except Exception as e:
+        logger.error(e)
 
-def check_should_snmp(device: Device) -> bool:
+    logger.info('性能采集完成，资产数: {}, 并发: {}, 耗时: {:.2f}s, 写入: {}条, '
+                '{:.0f}条/s'.format(
+                    len(devices), limit, end - start, count,
+                    count / (end - flush_start) if end > flush_start else 0))
+    if summary['timeouts'] or summary['missed'] or \
+            summary['duration'] > concurrency.target:
+        logger.warning(
+            '性能采集积压，耗时: {duration}s, 超时: {timeouts}个, '
+            '错过采集周期: {missed}个, 最大调度延迟: {max_lag}s'.format(
+                **summary))
+    return count
+
+
+async def poll_clients(clients: List[SNMPClient], limit: int,
+                       limiter: SubnetRateLimiter) -> Dict[int, float]:
     """
-    只要有当前时间超过采集周期才能执行任务
-    :param device: 需要snmp查数据的资产
-    :return True or False用于判断是否要执行snmp任务
+    最多limit个资产同时采集，开始采集前按资产所在网段限速
+    :return: {资产ID: 采集耗时(秒)}
     """
-    try:
-        setting = device.snmpsetting
-    except ObjectDoesNotExist:
-        return False
-    if not (setting and device.monitor and setting.template):
-        return False
-    return (timezone.now() - setting.last_run_time).total_seconds() >= 60
+    # 所有资产用一个ICMP socket批量ping，不能批量ping的资产采集时各自ping
+    batch, _ = BatchPinger.split({c.device.ip for c in clients})
+    statuses = await pinger.async_ping(batch)
+    for client in clients:
+        if client.device.ip in statuses:
+            client.set_active(statuses[client.device.ip].alive)
+
+    semaphore = asyncio.Semaphore(limit)
+    latencies = {}
+
+    async def poll(client: SNMPClient):
+        # 先等网段限速再占并发名额，等待限速的资产不占用其他网段的并发
+        await limiter.acquire(client.device.ip)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await client.async_snmp_get()
+            finally:
+                latencies[client.device.id] = time.perf_counter() - start
+
+    results = await asyncio.gather(
+        *[poll(c) for c in clients], return_exceptions=True)
+    for client, result in zip(clients, results):
+        if isinstance(result, Exception):
+            logger.error(result)
+            logger.error('资产: {}, 资产ID: {}'.format(
+                client.device.name, client.device.id))
+    return latencies
 
 
 def snmp_run(device: Device, current: datetime):
     try:
-        # 间隔采数间隔10s
         _snmp_run(device, current)
     except Exception as e:
         logger.error(e)
@@ -66,8 +169,8 @@ def snmp_run(device: Device, current: datetime):
 
 
 def _snmp_run(device: Device, current: datetime):
-    # 间隔采数间隔10s
-    snmp_client = SNMPClient(device, interval=10, current=current)
+    snmp_client = SNMPClient(device, current=current)
+    snmp_client.set_current_run_time()
     snmp_client.snmp_get()
     snmp_client.save_data()
 
@@ -1,3 +1,5 @@
+import logging
+import time
 from typing import List
 
 import pytest
@@ -6,8 +8,11 @@ from base_app.factory_data import DeviceFactory
 from base_app.models import Device
 from snmp.factory_data import SNMPSettingFactory, SNMPTemplateFactory, \
     SNMPRuleFactory
-from snmp.models import SNMPRule, SNMPTemplate, SNMPSetting
-from snmp.snmp_run import SNMPClient, snmp_config
+from snmp.models import SNMPRule, SNMPTemplate, SNMPSetting, SNMPData
+from snmp.snmp_run import SNMPClient, snmp_config, SNMPCounterStore, \
+    SNMPDataBuffer
+
+logger = logging.getLogger(__name__)
 
 rules_factory = [
     {
@@ -126,7 +131,7 @@ class TestSNMPClient:
         device.status = Device.OFFLINE
         device.save()
 
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res != {}
         client.save_data()
@@ -136,7 +141,7 @@ class TestSNMPClient:
         device.ip = '11.1.1.1'
         device.save()
         s.save()
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res == {}
         client.save_data()
@@ -149,7 +154,7 @@ class TestSNMPClient:
         s.community = 'tesss'
         device.save()
         s.save()
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res == {}
         client.save_data()
@@ -161,7 +166,7 @@ class TestSNMPClient:
         setting.security_level = setting.NO_AUTH_NO_PRIV
         setting.save()
 
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res != {}
 
@@ -174,7 +179,7 @@ class TestSNMPClient:
         setting.auth = setting.AUTH_MD5
         setting.save()
 
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res != {}
 
@@ -189,7 +194,7 @@ class TestSNMPClient:
         setting.priv = setting.PRIV_AES128
         setting.save()
 
-        client = SNMPClient(device, interval=0)
+        client = SNMPClient(device)
         res = client.snmp_get()
         assert res != {}
 
@@ -214,3 +219,70 @@ class TestSNMPConfig:
 
         assert snmp_config.get_config('test') == \
                {'method': 'walk', 'client': TestConfig, 'oid': ['1234']}
+
+
+class TestSNMPCounterStore:
+    def test_delta(self):
+        assert SNMPCounterStore.delta(100, 150) == 50
+        # 32位计数器回绕
+        assert SNMPCounterStore.delta(2 ** 32 - 10, 5) == 15
+        # 64位计数器回绕
+        assert SNMPCounterStore.delta(2 ** 64 - 10, 5) == 15
+        # 资产重启计数器清零
+        assert SNMPCounterStore.delta(1000, 20) == 20
+
+    def test_save_and_load(self):
+        store = SNMPCounterStore(key_pattern='test-snmp-counter-')
+        sample = {'time': 1600000000.0, 'rows': {'eth0': [100, 200]}}
+        store.save(1, {'.1.3.6.1.2.1.2.2.1.10': sample})
+
+        assert store.load(1) == {'.1.3.6.1.2.1.2.2.1.10': sample}
+        assert store.load(2) == {}
+
+
+@pytest.mark.django_db
+class TestSNMPDataBuffer:
+    def processed_clients(self, count: int) -> List[SNMPClient]:
+        clients = []
+        for device in DeviceFactory.create_batch_normal(count):
+            SNMPSettingFactory.create(device=device)
+            client = SNMPClient(device)
+            client._result = {'cpu_in_use': 10, 'memory_in_use': 10,
+                              'process_count': 50, 'hostname': device.name}
+            client._processed = True
+            clients.append(client)
+        return clients
+
+    def test_flush(self):
+        clients = self.processed_clients(10)
+        buffer = SNMPDataBuffer()
+        for client in clients:
+            buffer.add(client)
+
+        assert buffer.flush() == 10
+        assert len(buffer) == 0
+        assert SNMPData.objects.filter(
+            device_id__in=[c.device.id for c in clients]).count() == 10
+
+    def test_flush_benchmark(self):
+        """
+        逐条INSERT和一轮批量写入每秒写入的条数
+        """
+        clients = self.processed_clients(200)
+
+        start = time.perf_counter()
+        for client in clients[:100]:
+            client.build_data().save()
+        single = 100 / (time.perf_counter() - start)
+
+        buffer = SNMPDataBuffer()
+        start = time.perf_counter()
+        for client in clients[100:]:
+            buffer.add(client)
+        count = buffer.flush()
+        duration = time.perf_counter() - start
+
+        logger.info('single: %.0f rows/s, bulk: %.0f rows/s, cycle: %.3fs',
+                    single, count / duration, duration)
+        assert SNMPData.objects.filter(
+            device_id__in=[c.device.id for c in clients]).count() == 200
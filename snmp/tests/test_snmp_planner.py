@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from base_app.factory_data import DeviceFactory
+from base_app.models import Device
+from snmp.factory_data import SNMPSettingFactory, SNMPTemplateFactory, \
+    SNMPRuleFactory
+from snmp.models import SNMPSetting
+from snmp.planner import SNMPPollPlanner, PLAN_VERSION_KEY
+from utils.unified_redis import cache
+
+
+@pytest.mark.django_db
+class TestSNMPPollPlanner:
+    @pytest.fixture(scope='function')
+    def devices(self):
+        template = SNMPTemplateFactory.create(
+            rules=SNMPRuleFactory.create_batch(5))
+        devices = DeviceFactory.create_batch_normal(10, monitor=True)
+        for i, device in enumerate(devices):
+            SNMPSettingFactory.create(device=device, template=template,
+                                      frequency=1)
+            SNMPSetting.objects.filter(device=device).update(
+                last_run_time=timezone.now() - timedelta(seconds=30 * i))
+        return devices
+
+    def test_load_queries(self, devices, django_assert_num_queries):
+        planner = SNMPPollPlanner()
+        with django_assert_num_queries(2):
+            planner.refresh()
+            for device in planner.due(timezone.now()):
+                assert len(planner.rules(device)) == 5
+
+    def test_due_by_next_time(self, devices):
+        planner = SNMPPollPlanner()
+        current = timezone.now()
+        due = planner.due(current)
+        # last_run_time在60秒之前的资产
+        assert {d.id for d in due} == {d.id for d in devices[2:]}
+        # 计划在30秒之前采集
+        assert 30 <= planner.lag(devices[3]) < 40
+        assert planner.due(current) == []
+        assert planner.seconds_until_next(current) <= 60
+
+        due = planner.due(current + timedelta(minutes=1))
+        assert {d.id for d in due} == {d.id for d in devices}
+
+    def test_invalidate_on_setting_change(self, devices):
+        planner = SNMPPollPlanner()
+        planner.refresh()
+        version = cache.get(PLAN_VERSION_KEY)
+
+        device = devices[0]
+        device.monitor = False
+        device.save()
+        assert cache.get(PLAN_VERSION_KEY) != version
+
+        planner.refresh()
+        assert device.id not in {d.id for d in planner.due(
+            timezone.now() + timedelta(minutes=10))}
+
+        # 在线状态的更新不影响采集计划
+        version = cache.get(PLAN_VERSION_KEY)
+        device.status = Device.OFFLINE
+        device.save(update_fields=['status'])
+        assert cache.get(PLAN_VERSION_KEY) == version
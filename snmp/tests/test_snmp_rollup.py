@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+from django.utils import timezone
+
+from base_app.factory_data import DeviceFactory
+from snmp.factory_data import SNMPDataFactory
+from snmp.models import SNMPData, SNMPDataRollup
+from snmp.rollup import SNMPDataRollupTask, select_tier, snmp_metric_series, \
+    align
+
+current = datetime(2020, 10, 1, 12, 3, tzinfo=timezone.utc)
+
+
+def create_data(device, time: datetime, cpu: float) -> SNMPData:
+    data = SNMPDataFactory.create(device=device, cpu_in_use=cpu)
+    SNMPData.objects.filter(id=data.id).update(update_time=time)
+    return data
+
+
+@pytest.mark.django_db
+class TestSNMPDataRollupTask:
+    def test_rollup_5min(self):
+        device = DeviceFactory.create_normal()
+        start = datetime(2020, 10, 1, 11, 50, tzinfo=timezone.utc)
+        for i, cpu in enumerate([10, 20, 30, 40, 50, 60, 70]):
+            create_data(device, start + timedelta(minutes=i), cpu)
+
+        assert SNMPDataRollupTask.rollup(SNMPDataRollup.TIER_5MIN, current) == 2
+        first, second = SNMPDataRollup.objects.filter(
+            tier=SNMPDataRollup.TIER_5MIN).order_by('start_time')
+        assert first.start_time == start
+        assert first.sample_count == 5
+        assert (first.cpu_in_use_min, first.cpu_in_use_avg,
+                first.cpu_in_use_max) == (10, 30, 50)
+        assert second.sample_count == 2
+        assert second.cpu_in_use_avg == 65
+
+        # 已经聚合过的区间不会重复聚合
+        assert SNMPDataRollupTask.rollup(SNMPDataRollup.TIER_5MIN, current) == 0
+
+    def test_rollup_1hour_weighted_avg(self):
+        device = DeviceFactory.create_normal()
+        start = datetime(2020, 10, 1, 10, tzinfo=timezone.utc)
+        SNMPDataRollup.objects.create(
+            device=device, tier=SNMPDataRollup.TIER_5MIN, start_time=start,
+            sample_count=1, cpu_in_use_min=10, cpu_in_use_avg=10,
+            cpu_in_use_max=10)
+        SNMPDataRollup.objects.create(
+            device=device, tier=SNMPDataRollup.TIER_5MIN,
+            start_time=start + timedelta(minutes=5), sample_count=3,
+            cpu_in_use_min=20, cpu_in_use_avg=30, cpu_in_use_max=40)
+
+        assert SNMPDataRollupTask.rollup(
+            SNMPDataRollup.TIER_1HOUR, current) == 1
+        hour = SNMPDataRollup.objects.get(tier=SNMPDataRollup.TIER_1HOUR)
+        assert hour.start_time == start
+        assert hour.sample_count == 4
+        assert (hour.cpu_in_use_min, hour.cpu_in_use_avg,
+                hour.cpu_in_use_max) == (10, 25, 40)
+        assert hour.memory_in_use_avg is None
+
+    def test_clean(self):
+        device = DeviceFactory.create_normal()
+        old = current - timedelta(
+            days=SNMPDataRollup.RETENTION[SNMPDataRollup.TIER_RAW] + 1)
+        create_data(device, old, 10)
+        create_data(device, current - timedelta(minutes=1), 10)
+
+        # 还没有聚合的原始数据不清理
+        SNMPDataRollupTask.clean(current)
+        assert SNMPData.objects.filter(device=device).count() == 2
+
+        SNMPDataRollupTask.run(current)
+        assert SNMPData.objects.filter(device=device).count() == 1
+        assert SNMPDataRollup.objects.filter(
+            tier=SNMPDataRollup.TIER_5MIN, start_time=align(
+                old, SNMPDataRollup.TIER_5MIN)).exists()
+
+    def test_catch_up_in_batches(self):
+        """
+        停机之后每次最多聚合max_batch，下一次从上次聚合到的地方继续，不跳过任何区间
+        """
+        device = DeviceFactory.create_normal()
+        times = [current - timedelta(days=3), current - timedelta(days=2),
+                 current - timedelta(minutes=10)]
+        for time in times:
+            create_data(device, time, 10)
+
+        for _ in times:
+            assert SNMPDataRollupTask.rollup(
+                SNMPDataRollup.TIER_5MIN, current) == 1
+        assert SNMPDataRollupTask.rollup(SNMPDataRollup.TIER_5MIN, current) == 0
+        assert list(SNMPDataRollup.objects.filter(
+            tier=SNMPDataRollup.TIER_5MIN).order_by('start_time').values_list(
+            'start_time', flat=True)) == [
+            align(t, SNMPDataRollup.TIER_5MIN) for t in times]
+
+
+@pytest.mark.django_db
+class TestSNMPMetricSeries:
+    def test_select_tier(self):
+        assert select_tier(current - timedelta(hours=1), current,
+                           current=current) == SNMPDataRollup.TIER_RAW
+        assert select_tier(current - timedelta(days=7), current,
+                           current=current) == SNMPDataRollup.TIER_5MIN
+        assert select_tier(current - timedelta(days=30), current,
+                           current=current) == SNMPDataRollup.TIER_1HOUR
+        # 超出原始数据的保留时间
+        assert select_tier(current - timedelta(days=10),
+                           current - timedelta(days=10, hours=-1),
+                           current=current) == SNMPDataRollup.TIER_5MIN
+
+    def test_series(self):
+        device = DeviceFactory.create_normal()
+        create_data(device, current - timedelta(minutes=2), 10)
+        create_data(device, current - timedelta(minutes=1), 20)
+
+        tier, series = snmp_metric_series(
+            device.id, 'cpu_in_use', current - timedelta(hours=1), current,
+            current=current)
+        assert tier == SNMPDataRollup.TIER_RAW
+        assert [s['avg'] for s in series] == [10, 20]
+
+        with pytest.raises(ValueError):
+            snmp_metric_series(device.id, 'hostname',
+                               current - timedelta(hours=1), current)
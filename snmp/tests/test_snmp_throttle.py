@@ -0,0 +1,134 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from snmp.tasks import poll_clients
+from snmp.throttle import AdaptiveConcurrency, SubnetRateLimiter, PollStats
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeClient(object):
+    """
+    模拟的SNMP采集，每个资产采集固定的时间，记录同时采集的资产数
+    """
+    running = 0
+    max_running = 0
+
+    def __init__(self, device_id: int, ip: str, latency: float):
+        self.device = SimpleNamespace(id=device_id, ip=ip, name=str(device_id))
+        self.latency = latency
+
+    def set_active(self, active: bool):
+        pass
+
+    async def async_snmp_get(self):
+        cls = type(self)
+        cls.running += 1
+        cls.max_running = max(cls.max_running, cls.running)
+        await asyncio.sleep(self.latency)
+        cls.running -= 1
+
+
+class TestAdaptiveConcurrency:
+    def test_limit(self):
+        concurrency = AdaptiveConcurrency(10, minimum=2, maximum=50,
+                                          latency=1)
+        assert concurrency.limit(100) == 10
+        assert concurrency.limit(1) == 2
+        assert concurrency.limit(1000) == 50
+
+    def test_observe(self):
+        concurrency = AdaptiveConcurrency(10, alpha=0.5, latency=1)
+        concurrency.observe([3, 5])
+        assert concurrency.latency == 2.5
+        # 采集变慢之后提高并发数
+        assert concurrency.limit(100) == 25
+        concurrency.observe([])
+        assert concurrency.latency == 2.5
+
+
+class TestSubnetRateLimiter:
+    def test_subnet(self):
+        limiter = SubnetRateLimiter(10)
+        assert limiter.subnet('192.168.1.20') == '192.168.1.0/24'
+        assert limiter.subnet('fe80::1') == 'fe80::/64'
+
+    def test_same_subnet(self):
+        limiter = SubnetRateLimiter(10, burst=1)
+
+        async def acquire():
+            for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.3']:
+                await limiter.acquire(ip)
+
+        start = time.monotonic()
+        run(acquire())
+        assert time.monotonic() - start >= 0.18
+
+    def test_different_subnet(self):
+        limiter = SubnetRateLimiter(1, burst=1)
+
+        async def acquire():
+            for ip in ['10.0.1.1', '10.0.2.1', '10.0.3.1']:
+                await limiter.acquire(ip)
+
+        start = time.monotonic()
+        run(acquire())
+        assert time.monotonic() - start < 0.1
+
+
+class TestPollClients:
+    def test_concurrency_limit(self):
+        FakeClient.running = FakeClient.max_running = 0
+        clients = [FakeClient(i, '127.0.0.{}'.format(i + 1), 0.1)
+                   for i in range(6)]
+        latencies = run(poll_clients(clients, 2, SubnetRateLimiter(0)))
+
+        assert FakeClient.max_running == 2
+        assert sorted(latencies) == list(range(6))
+        assert all(v >= 0.09 for v in latencies.values())
+
+    def test_throttled_subnet_not_holding_slots(self):
+        """
+        同一网段等待限速的资产不占用并发名额，其他网段的资产不用排在它们后面
+        """
+        started = []
+
+        class OrderedClient(FakeClient):
+            async def async_snmp_get(self):
+                started.append(self.device.id)
+                await super().async_snmp_get()
+
+        clients = [OrderedClient(i, '10.0.0.{}'.format(i + 1), 0.05)
+                   for i in range(4)]
+        clients.append(OrderedClient(9, '10.0.9.1', 0.05))
+        run(poll_clients(clients, 1, SubnetRateLimiter(5, burst=1)))
+
+        assert started[:2] == [0, 9]
+        assert sorted(started) == [0, 1, 2, 3, 9]
+
+
+class TestPollStats:
+    def test_summary(self):
+        stats = PollStats()
+        stats.record(1, 0.5, False, 2, 60)
+        stats.record(2, 3, True, 90, 60)
+        summary = stats.summary(3.5, 4)
+
+        assert summary['devices'] == 2
+        assert summary['avg_latency'] == 1.75
+        assert summary['timeouts'] == 1
+        assert summary['missed'] == 1
+        assert summary['max_lag'] == 90
+
+        stats.save(summary)
+        assert PollStats.load_device(2)['timeout'] is True
+        assert PollStats.load_cycle()['concurrency'] == 4
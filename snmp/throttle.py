@@ -0,0 +1,153 @@
+"""
+性能采集的并发控制：按目标轮次耗时自动调整并发数，按网段限速避免同一网段的网络设备
+瞬间收到大量请求，并记录每个资产的采集耗时、超时和调度延迟
+"""
+import asyncio
+import ipaddress
+import json
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.unified_redis import cache
+
+
+class AdaptiveConcurrency(object):
+    """
+    按Little定律估算并发数：并发数 = 资产数 * 平均采集耗时 / 目标轮次耗时
+    平均采集耗时是每轮观测值的指数加权平均，超时的资产按实际等待的时间计入
+
+    :param target: 一轮采集的目标耗时(秒)
+    :param minimum: 最小并发数
+    :param maximum: 最大并发数，避免资产很多时占满文件描述符和网络
+    :param alpha: 指数加权平均的系数，越大越偏向最近一轮
+    :param latency: 没有观测值时假设的单个资产采集耗时(秒)
+    """
+
+    def __init__(self, target: float, minimum: int = 1, maximum: int = 200,
+                 alpha: float = 0.3, latency: float = 1.0):
+        self.target = target
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alpha = alpha
+        self.latency = latency
+
+    def limit(self, count: int) -> int:
+        """
+        :param count: 这一轮需要采集的资产数
+        :return: 这一轮的并发数
+        """
+        limit = math.ceil(count * self.latency / self.target)
+        return max(self.minimum, min(self.maximum, limit))
+
+    def observe(self, latencies: List[float]):
+        """
+        一轮采集结束后更新平均采集耗时
+        """
+        if not latencies:
+            return
+        average = sum(latencies) / len(latencies)
+        self.latency = self.alpha * average + (1 - self.alpha) * self.latency
+
+
+class SubnetRateLimiter(object):
+    """
+    按网段的令牌桶限速，每个网段每秒最多开始rate个资产的采集
+    只在采集引擎的事件循环里使用，不需要加锁
+
+    :param rate: 每个网段每秒开始采集的资产数，小于等于0时不限速
+    :param burst: 令牌桶容量，即一个网段最多同时开始采集的资产数
+    :param prefix: IPv4网段的前缀长度，IPv6固定按/64划分
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None,
+                 prefix: int = 24):
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self.prefix = prefix
+        # 网段 -> (剩余令牌, 上次更新的时间)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def subnet(self, ip: str) -> str:
+        address = ipaddress.ip_address(ip)
+        prefix = self.prefix if address.version == 4 else 64
+        return str(ipaddress.ip_network(
+            '{}/{}'.format(ip, prefix), strict=False))
+
+    async def acquire(self, ip: str):
+        if self.rate <= 0:
+            return
+        key = self.subnet(ip)
+        while True:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return
+            self._buckets[key] = (tokens, now)
+            await asyncio.sleep((1 - tokens) / self.rate)
+
+
+class PollStats(object):
+    """
+    每个资产最近一次采集的耗时、是否超时、调度延迟，以及最近一轮采集的汇总，
+    保存在redis里供排查采集积压的问题
+    """
+    DEVICE_KEY = 'snmp-poll-stats'
+    CYCLE_KEY = 'snmp-poll-cycle'
+
+    def __init__(self):
+        self.devices: Dict[int, Dict] = {}
+
+    def record(self, device_id: int, latency: float, timeout: bool,
+               lag: float, interval: float):
+        """
+        :param latency: 采集耗时(秒)
+        :param timeout: 是否超过了采集的deadline
+        :param lag: 实际开始采集的时间比计划的晚了多少秒
+        :param interval: 资产的采集周期(秒)，延迟超过一个周期说明错过了一次采集
+        """
+        self.devices[device_id] = {
+            'latency': round(latency, 3),
+            'timeout': timeout,
+            'lag': round(lag, 3),
+            'missed': lag >= interval,
+        }
+
+    def latencies(self) -> List[float]:
+        return [d['latency'] for d in self.devices.values()]
+
+    def summary(self, duration: float, concurrency: int) -> Dict:
+        latencies = self.latencies()
+        lags = [d['lag'] for d in self.devices.values()]
+        return {
+            'time': time.time(),
+            'devices': len(self.devices),
+            'duration': round(duration, 3),
+            'concurrency': concurrency,
+            'avg_latency': round(sum(latencies) / len(latencies), 3)
+            if latencies else 0,
+            'max_latency': max(latencies, default=0),
+            'timeouts': sum(d['timeout'] for d in self.devices.values()),
+            'missed': sum(d['missed'] for d in self.devices.values()),
+            'max_lag': max(lags, default=0),
+        }
+
+    def save(self, summary: Dict):
+        pipeline = cache.pipeline()
+        if self.devices:
+            pipeline.hset(self.DEVICE_KEY, mapping={
+                k: json.dumps(v) for k, v in self.devices.items()})
+        pipeline.set(self.CYCLE_KEY, json.dumps(summary))
+        pipeline.execute()
+
+    @classmethod
+    def load_device(cls, device_id: int) -> Optional[Dict]:
+        data = cache.hget(cls.DEVICE_KEY, device_id)
+        return json.loads(data) if data else None
+
+    @classmethod
+    def load_cycle(cls) -> Optional[Dict]:
+        data = cache.get(cls.CYCLE_KEY)
+        return json.loads(data) if data else None
@@ -15,7 +15,7 @@ from auditor.models import RiskCountry, AttackIPStatistic
 from base_app.models import Device
 from log.models import DeviceAllAlert, SecurityEvent, AlertDistribution, \
     IncrementDistribution
-from setting.models import Setting
+from setting.helpers import get_setting
 from statistic.helpers import IPDistributionHelper
 from statistic.models import MainView, LogCenter, \
     LogStatistic, LogStatisticDay, LogDstIP, LogCategoryDistribution, \
@@ -307,7 +307,7 @@ class SystemRunningStatusSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         # 从setting里补上阈值信息
-        setting = Setting.objects.get(pk=1)
+        setting = get_setting()
         instance.cpu_percent = setting.cpu_alert_percent
         instance.memory_percent = setting.memory_alert_percent
         instance.disk_percent = setting.disk_alert_percent
@@ -1226,7 +1226,7 @@ class LockedUsernameSerializer(serializers.ModelSerializer):
         fields = ('name', 'last_failure', 'mark')
 
     def to_representation(self, instance: UserExtension):
-        self.setting, _ = Setting.objects.get_or_create(id=1)
+        self.setting = get_setting()
         instance.mark = self.get_mark(instance)
 
         return super().to_representation(instance)
@@ -20,7 +20,7 @@ from base_app.models import Device
 from firewall.models import FirewallSysEvent, FirewallSecEvent
 from log.models import DeviceAllAlert, UnifiedForumLog, SecurityEvent
 from log.security_event import NetworkEvent, LogAbnormalEvent, SecurityEventLog, \
-    AlertEvent, HighAlertEvent
+    AlertEvent, HighAlertEvent, EventCollector
 from statistic.models import MainView, AssetsCenter, MonitorCenter, LogCenter, \
     LogStatistic, LogStatisticDay, LogDstIPTopFive, LogCategoryDistribution, \
     LogPortDistribution, SystemRunning, IPDistribution, ExternalIPTopFive, \
@@ -36,6 +36,7 @@ from unified_log.elastic.elastic_model import BaseDocument
 from unified_log.models import LogStatistic as DeviceLog
 from utils.constants import CATEGORY_DICT
 from utils.constants import NETWORK_STATUS
+from utils.db import counted_upsert
 from utils.helper import get_today, get_last_day, safe_divide
 from utils.runnable import TaskRun, TaskRunWebsocket
 
@@ -592,20 +593,22 @@ class SystemRunningTask(TaskRunWebsocket):
         now = psutil.net_io_counters(pernic=True)
         status = cls.get_network_status()
 
-        for i, name in enumerate(cls.interfaces):
-            speed = round((now[name].bytes_recv - last[name].bytes_recv) / 1024,
-                          2)
-            s = status[name]
-            if cls.mgmt == name:
-                nic_name = 'MGMT'
-            else:
-                nic_name = cls.key + str(i)
-            result[nic_name] = {'speed': speed, 'status': s}
-
-            if s == NETWORK_STATUS['link beat detected'] and \
-                    not cls.check_interface_normal(i, current):
-                event = NetworkEvent(name=nic_name)
-                event.generate()
+        with EventCollector(current - timedelta(minutes=NetworkEvent.duration),
+                            kinds=[NetworkEvent]):
+            for i, name in enumerate(cls.interfaces):
+                speed = round(
+                    (now[name].bytes_recv - last[name].bytes_recv) / 1024, 2)
+                s = status[name]
+                if cls.mgmt == name:
+                    nic_name = 'MGMT'
+                else:
+                    nic_name = cls.key + str(i)
+                result[nic_name] = {'speed': speed, 'status': s}
+
+                if s == NETWORK_STATUS['link beat detected'] and \
+                        not cls.check_interface_normal(i, current):
+                    event = NetworkEvent(name=nic_name)
+                    event.generate()
 
         result_list = [{'name': key, 'speed': val['speed'],
                         'status': val['status']} for key, val in result.items()]
@@ -727,7 +730,8 @@ class ProtocolIPRankTask(TaskRun):
     """
     模块：流量中心——今日IP统计
     更新周期：1天
-    描述：每天凌晨统计一次，保存昨天的IP排名统计，保存后删除redis数据
+    描述：每天凌晨统计一次，合并昨天24个小时的计数桶，保存昨天的IP排名统计，
+    redis里的计数桶会自动过期，不用删除
     """
 
     @classmethod
@@ -738,14 +742,14 @@ class ProtocolIPRankTask(TaskRun):
 
         data['update_time'] = current
         ProtocolIPRank.objects.create(**data)
-        ip_rank.clean()
 
 
 class AttackIPRankTask(TaskRun):
     """
     模块：流量中心——今日IP统计
     更新周期：1天
-    描述：每天凌晨统计一次，保存昨天的IP排名统计，保存后删除redis数据
+    描述：每天凌晨统计一次，合并昨天24个小时的计数桶，保存昨天的IP排名统计，
+    redis里的计数桶会自动过期，不用删除
     """
 
     @classmethod
@@ -756,7 +760,6 @@ class AttackIPRankTask(TaskRun):
 
         data['update_time'] = current
         AttackIPRank.objects.create(**data)
-        ip_rank.clean()
 
 
 class AuditorProtocolSynchronizeTask(TaskRun):
@@ -787,14 +790,17 @@ class AttackIPStatisticTask(TaskRun):
     @classmethod
     def run(cls, current: datetime) -> AttackIPStatistic:
         last = get_last_day(current)
-        statistic, _ = AttackIPStatistic.objects.get_or_create(id=1)
         attack = IPSource(last)
         attack_data = attack.get_attack_data()
-        statistic.count += int(attack_data['count'])
-        statistic.src_ip += int(attack_data['history_src_ip'])
-        statistic.foreign += int(attack_data['history_foreign'])
-        statistic.external_ip += int(attack_data['external_ip'])
-        statistic.save()
+        statistic = counted_upsert(
+            AttackIPStatistic,
+            [{'id': 1,
+              'count': int(attack_data['count']),
+              'src_ip': int(attack_data['history_src_ip']),
+              'foreign': int(attack_data['history_foreign']),
+              'external_ip': int(attack_data['external_ip'])}],
+            conflict_fields=('id',),
+            count_fields=('count', 'src_ip', 'foreign', 'external_ip'))[0]
 
         attack.clean()
         return statistic
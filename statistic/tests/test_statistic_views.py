@@ -1,12 +1,15 @@
+from datetime import timedelta
 from typing import Dict
 
 import pytest
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
 from utils.base_testcase import ConfigEngineerPermission, BaseViewTest
 from base_app.factory_data import DeviceFactory
 from snmp.factory_data import SNMPDataFactory
+from snmp.models import SNMPDataRollup
 from statistic.factory_data import LogCenterFactory
 
 
@@ -38,6 +41,27 @@ class TestPermission(BaseViewTest):
         assert len(data['parsed']['data']) == 10
         assert len(data['update_time']) == 10
 
+    def test_snmp_history(self, config_client: APIClient):
+        """
+        查询一个月的数据时使用1小时粒度
+        """
+        device = DeviceFactory.create_normal()
+        end = timezone.now()
+        SNMPDataRollup.objects.create(
+            device=device, tier=SNMPDataRollup.TIER_1HOUR,
+            start_time=end - timedelta(days=1), sample_count=60,
+            cpu_in_use_min=10, cpu_in_use_avg=20, cpu_in_use_max=30)
+
+        response = config_client.get(reverse('snmp-history'), data={
+            'device': device.id, 'field': 'cpu_in_use',
+            'start_time': (end - timedelta(days=30)).isoformat(),
+            'end_time': end.isoformat(),
+        })
+
+        assert response.status_code == 200
+        assert response.data['tier'] == SNMPDataRollup.TIER_1HOUR
+        assert [d['avg'] for d in response.data['data']] == [20]
+
     def test_snmp_data(self, config_client: APIClient):
         device = DeviceFactory.create_normal()
         snmp_data = SNMPDataFactory.create(device=device)
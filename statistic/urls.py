@@ -19,6 +19,8 @@ main_view = [
 
 performance_view = [
     url(r'snmp_data/', views.SNMPDataView.as_view(), name='snmp-data'),
+    url(r'snmp_history/', views.SNMPHistoryView.as_view(),
+        name='snmp-history'),
 ]
 
 running_view = [
@@ -18,7 +18,8 @@ from log.models import DeviceAllAlert, AlertDistribution, IncrementDistribution
 from setting.models import Setting
 from snmp.filters import SNMPDataFilter
 from snmp.models import SNMPData
-from snmp.serializers import SNMPDataSerializer
+from snmp.rollup import snmp_metric_series
+from snmp.serializers import SNMPDataSerializer, SNMPHistoryQuerySerializer
 from statistic.filters import DeviceFilter
 from statistic.models import MainView, LogCenter, \
     LogStatistic, LogStatisticDay, LogDstIPTopFive, \
@@ -155,6 +156,27 @@ class SNMPDataView(GenericAPIView):
         return Response(data)
 
 
+class SNMPHistoryView(BaseView):
+    permission_classes = (IsAuthenticated,)
+
+    @method_decorator(swagger_auto_schema(
+        query_serializer=SNMPHistoryQuerySerializer(),
+        operation_summary='性能指标历史数据',
+        operation_description='按时间范围自动选择原始数据、5分钟或1小时粒度，'
+                              'tier为粒度(秒)'
+    ))
+    def get(self, request):
+        serializer = SNMPHistoryQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if not Device.objects.filter(id=data['device']).exists():
+            raise CustomError(error_code=CustomError.ASSET_NOT_FOUND)
+        tier, series = snmp_metric_series(
+            data['device'], data['field'], data['start_time'],
+            data['end_time'], data['max_points'])
+        return Response({'tier': tier, 'data': series})
+
+
 class LogStatisticView(GenericAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = LogStatisticTotalSerializer
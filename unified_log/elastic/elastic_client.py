@@ -163,6 +163,18 @@ class ElasticClient(object):
             indices = indices[:-1]
         return indices
 
+    def list_index_size(self, index: str) -> List[Dict]:
+        """
+        获取按时间排序的所有符合index的索引和占用的空间
+        :param index: 索引模式
+        :return: [{'index': 索引名, 'size': 字节数, 'created': 创建时间戳(毫秒)}]
+        """
+        indices = self._client.cat.indices(
+            index, h='index,store.size,creation.date', s='creation.date',
+            bytes='b', format='json')
+        return [{'index': i['index'], 'size': int(i['store.size'] or 0),
+                 'created': int(i['creation.date'])} for i in indices]
+
     def delete_index_by_percent(self, index: str, percent: float):
         """
         删除前百分之几的索引，根据时间排序
@@ -22,9 +22,10 @@ from statistic.tasks import MainViewTask, AssetsCenterTask, MonitorCenterTask, \
     AttackIPStatisticTask, AlertWeekTrendTask, AttackIPRankTask
 from log.tasks import check_device_status_task
 from auditor.tasks import AuditorLogTask
-from setting.tasks import DiskCheckTask
+from setting.tasks import DiskCheckTask, PartitionMaintainTask
 from utils.unified_redis import IPDuplicateCleanTask
 from setting.tasks import StatisticDataCleanTask
+from snmp.rollup import SNMPDataRollupTask
 
 logging.basicConfig()
 logger = logging.getLogger('apscheduler')
@@ -122,6 +123,7 @@ def task_run_every_day():
     ProtocolPortRankTask.run(current)
     AttackIPStatisticTask.run(current)
     AlertWeekTrendTask.run(current)
+    PartitionMaintainTask.run(current)
 
 
 def clean_statistic_data():
@@ -143,6 +145,12 @@ def task_run_every_2_minutes():
     check_device_status_task()
 
 
+def task_run_every_5_minutes():
+    current = timezone.now()
+    current = current.replace(second=0, microsecond=0)
+    SNMPDataRollupTask.run(current)
+
+
 def task_run_every_5_seconds():
     current = timezone.now()
     SystemRunningTask.run(current)
@@ -177,6 +185,9 @@ scheduler.add_job(auditor_alert_synchronize, id='auditor_alert_synchronize',
 scheduler.add_job(task_run_every_2_minutes, id='task_run_every_2_minutes',
                   max_instances=1, trigger='cron', minute='*/2',
                   replace_existing=True)
+scheduler.add_job(task_run_every_5_minutes, id='task_run_every_5_minutes',
+                  max_instances=1, trigger='cron', minute='*/5',
+                  replace_existing=True)
 
 if __name__ == '__main__':
     scheduler.start()
@@ -63,10 +63,10 @@ INSTALLED_APPS = [
     'auditor.apps.AuditorConfig',
     'log',
     'user.apps.UserConfig',
-    'setting',
+    'setting.apps.SettingConfig',
     'unified_management_platform',
     'unified_log',
-    'snmp',
+    'snmp.apps.SnmpConfig',
     'statistic',
     'channels',
 ]
@@ -261,6 +261,19 @@ SWAGGER_SETTINGS = {
 ELASTICSEARCH_HOST = env.str('ELASTICSEARCH_HOST')
 KAFKA_BROKER = env.str('KAFKA_BROKER')
 LOG_PARTITION = env.int('LOG_PARTITION', 4)    # 日志解析需要的partition数量
+SNMP_TARGET_CYCLE = env.int('SNMP_TARGET_CYCLE', 30)    # 一轮性能采集的目标耗时(秒)
+SNMP_MAX_CONCURRENCY = env.int('SNMP_MAX_CONCURRENCY', 200)    # 性能采集的最大并发数
+SNMP_SUBNET_RATE = env.int('SNMP_SUBNET_RATE', 20)    # 每个网段每秒最多开始采集的资产数
+AUDIT_LOG_ASYNC = env.bool('AUDIT_LOG_ASYNC', True)    # 操作日志是否由后台线程批量写入
+AUDIT_LOG_QUEUE_SIZE = env.int('AUDIT_LOG_QUEUE_SIZE', 10000)    # 操作日志队列的最大长度，超过之后丢弃
+EVENT_RETENTION_DAYS = env.int('EVENT_RETENTION_DAYS', 0)    # 分区后的日志、告警表保留的天数，0表示不按时间清理
+PARTITION_DETACH = env.bool('PARTITION_DETACH', False)    # 过期的分区只分离不删除，用于归档
+RETENTION_CHUNK_SIZE = env.int('RETENTION_CHUNK_SIZE', 5000)    # 清理过期数据时每一批的主键范围
+RETENTION_CHUNK_SLEEP = env.float('RETENTION_CHUNK_SLEEP', 0.1)    # 清理过期数据时两批之间暂停的秒数
+RETENTION_MAX_SECONDS = env.int('RETENTION_MAX_SECONDS', 1800)    # 每张表一次最多清理的秒数，没删完的下次继续
+DISK_RECLAIM_MARGIN = env.int('DISK_RECLAIM_MARGIN', 5)    # 存储空间清理到比覆盖阈值低多少个百分点
+ALERT_RESOLVE_SYNC_LIMIT = env.int('ALERT_RESOLVE_SYNC_LIMIT', 1000)    # 批量处理告警超过多少条时在后台执行
+ALERT_RESOLVE_CHUNK_SIZE = env.int('ALERT_RESOLVE_CHUNK_SIZE', 5000)    # 批量处理告警每个事务处理的id范围
 
 AUTH_USER_MODEL = 'user.User'
 REDIS_URL = env.str('REDIS_URL')
@@ -2,11 +2,12 @@ from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
+from utils.core.authentication import token_user_cache
 from utils.core.field_error import UserField
 
 GROUP_AUDITOR = 'Auditor'
@@ -135,3 +136,34 @@ class UserExtension(models.Model):
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def purge_user_token_cache(sender, instance=None, update_fields=None,
+                           **kwargs):
+    """
+    修改密码、修改用户信息、删除用户之后，缓存的token不能再使用
+    登录时只更新last_login，不用清空
+    """
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    token_user_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def purge_token_cache(sender, instance=None, **kwargs):
+    """
+    登出时会保存token
+    """
+    token_user_cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=UserExtension)
+def purge_banned_user_token_cache(sender, instance=None, **kwargs):
+    """
+    用户被锁定
+    """
+    if instance.banned:
+        token_user_cache.invalidate()
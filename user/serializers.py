@@ -10,7 +10,7 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from log.security_event import PasswordErrorEventLog
-from setting.models import Setting
+from setting.helpers import get_setting
 from user.models import UserExtension, GROUP_AUDITOR, \
     GROUP_CONFIG_ENGINEER, GROUP_SECURITY_ENGINEER, Group, ALL_GROUPS, \
     USERNAME_MAX_LENGTH, USERNAME_MIN_LENGTH
@@ -117,7 +117,7 @@ class LoginSerializer(serializers.Serializer):
                 raise CustomError(error_code=CustomError.PASSWORD_FORMAT_ERROR)
 
         # 获取用户登录失败处理参数
-        setting, created = Setting.objects.get_or_create(id=1)
+        setting = get_setting()
         lockout_threshold = setting.lockout_threshold  # 最大登录失败次数
         lockout_duration = setting.lockout_duration  # 锁定时间，分钟
         reset_lockout_counter_after = setting.reset_lockout_counter_after  # 重新计数时间，分钟
@@ -1,5 +1,19 @@
 from utils.unified_redis import rs
 import time
+import uuid
+
+# 只有锁的值还是自己写入的token时才释放，锁过期后被别人拿到的锁不能删掉
+RELEASE_SCRIPT = rs.register_script("""
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('setex', KEYS[1], ARGV[2], ARGV[1])
+else
+    redis.call('del', KEYS[1])
+end
+return 1
+""")
 
 
 class ForceDropError(Exception):
@@ -20,6 +34,7 @@ class RedisLock(object):
         self.expired_time = expired_time
         self.force_drop = force_drop
         self.delay = delay
+        self.token = uuid.uuid4().hex
 
     def __enter__(self):
         self._acquire()
@@ -28,7 +43,7 @@ class RedisLock(object):
         self._release()
 
     def _have_acquired(self):
-        return rs.set(self.key, 1, ex=self.expired_time, nx=True)
+        return rs.set(self.key, self.token, ex=self.expired_time, nx=True)
 
     def _acquire(self):
         curr = 0
@@ -43,7 +58,4 @@ class RedisLock(object):
             time.sleep(0.2)
 
     def _release(self):
-        if self.delay:
-            rs.setex(self.key, self.delay, 1)
-        else:
-            rs.delete(self.key)
+        RELEASE_SCRIPT(keys=[self.key], args=[self.token, self.delay])
@@ -1,14 +1,21 @@
+import copy
 import random
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union
 
-import redis
 from Crypto.Cipher import AES
 from django.conf import settings
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication, get_authorization_header
 
+from utils.unified_redis import rs, cache
+
 CHARSET = [chr(i) for i in range(256)]
-r = redis.StrictRedis()
+# 用过的盐的保存时间，秒
+SALT_EXPIRE = 900
 
 
 class TokenCipher:
@@ -40,8 +47,126 @@ class TokenCipher:
 cipher = TokenCipher('Bl666666666666lB')
 
 
+class TokenUserCache(object):
+    """
+    token -> (用户, token)的进程内缓存，看板每隔几秒轮询十几个接口时不用每次都查询数据库
+    用户登出、修改密码、被锁定时清空缓存：本进程立即清空，其他进程通过redis里的版本号
+    最多check_interval秒之后清空
+
+    :param ttl: 缓存的秒数
+    :param check_interval: 检查版本号的间隔秒数
+    :param max_size: 最多缓存的token数，超过时清空
+    """
+    VERSION_KEY = 'auth-token-version'
+
+    def __init__(self, ttl: float = 30, check_interval: float = 1.0,
+                 max_size: int = 1024):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # token -> (过期时间, 用户, token)
+        self._tokens: Dict[str, Tuple] = {}
+        self._version: Optional[str] = None
+        self._checked = 0.0
+
+    def get(self, key: str) -> Optional[Tuple]:
+        """
+        :return: (用户, token)的副本，请求里修改用户不会影响缓存
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked >= self.check_interval:
+                self._checked = now
+                version = cache.get(self.VERSION_KEY)
+                if version != self._version:
+                    self._tokens = {}
+                    self._version = version
+            item = self._tokens.get(key)
+            if not item:
+                return None
+            if item[0] < now:
+                del self._tokens[key]
+                return None
+            return copy.deepcopy((item[1], item[2]))
+
+    def set(self, key: str, user, token):
+        with self._lock:
+            if len(self._tokens) >= self.max_size:
+                self._tokens = {}
+            self._tokens[key] = (time.monotonic() + self.ttl,
+                                 *copy.deepcopy((user, token)))
+
+    def clear(self):
+        with self._lock:
+            self._tokens = {}
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """
+        :param user_id: 只清空这个用户的token，为None时清空所有
+        """
+        with self._lock:
+            if user_id is None:
+                self._tokens = {}
+            else:
+                self._tokens = {k: v for k, v in self._tokens.items()
+                                if v[1].id != user_id}
+        transaction.on_commit(lambda: cache.incr(self.VERSION_KEY))
+
+
+token_user_cache = TokenUserCache()
+
+
 class EncryptedTokenAuthentication(TokenAuthentication):
+    """
+    token每次请求都用新的盐加密，用过的盐保存在redis里，防止重放
+    CheckIPAndTimeoutMiddleware已经认证过的请求把结果保存在request上，视图里不再重复认证
+    """
+    request_attr = '_encrypted_token_auth'
+
     def authenticate(self, request):
+        authenticated = getattr(request, self.request_attr, None)
+        if authenticated is not None:
+            return authenticated
+
+        decrypted = self.decrypt_header(request)
+        if decrypted is None:
+            return None
+        token, salt = decrypted
+
+        user, auth = self.authenticate_credentials(token)
+        if not self.use_salt(user.username, salt):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return user, auth
+
+    def authenticate_credentials(self, key):
+        """
+        token对应的用户先从进程内缓存里取
+        """
+        cached = token_user_cache.get(key)
+        if cached:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_user_cache.set(key, user, token)
+        return user, token
+
+    @classmethod
+    def use_salt(cls, name: str, salt: Union[str, bytes]) -> bool:
+        """
+        记录用过的盐，一次往返
+        :return: 盐没被用过时返回True
+        """
+        pipeline = rs.pipeline()
+        pipeline.sadd(name, salt)
+        pipeline.expire(name, SALT_EXPIRE)
+        added, _ = pipeline.execute()
+        return bool(added)
+
+    def decrypt_header(self, request) -> Optional[Tuple[str, Union[str, bytes]]]:
+        """
+        解析请求头里的token，没有token时返回None
+        :return: (token, 盐)
+        """
         auth = get_authorization_header(request).split()
 
         if not auth or auth[0].lower() != self.keyword.lower().encode():
@@ -61,15 +186,6 @@ class EncryptedTokenAuthentication(TokenAuthentication):
             raise exceptions.AuthenticationFailed(msg)
 
         try:
-            token, salt = cipher.decrypt(with_salt)
-
+            return cipher.decrypt(with_salt)
         except (TypeError, ValueError):
-            raise exceptions.AuthenticationFailed(_('Invalid token.'))
-
-        user, auth = self.authenticate_credentials(token)
-        name = user.username
-        if r.sadd(name, salt):  # salt没被用过，Redis返回1
-            r.expire(name, 900)
-            return user, auth
-        else:  # salt已经存在，Redis返回0
             raise exceptions.AuthenticationFailed(_('Invalid token.'))
\ No newline at end of file
@@ -1,7 +1,17 @@
+import base64
+import json
+import math
 from collections import OrderedDict
+from typing import Optional, Tuple
 
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
@@ -27,3 +37,193 @@ class CustomPagination(PageNumberPagination):
                 ('results', data),
                 ('page_count', self.page.paginator.num_pages)
             ]))
+
+
+def estimate_count(queryset: QuerySet) -> Optional[int]:
+    """
+    不执行COUNT(*)估算查询结果的行数：没有过滤条件时用pg_class.reltuples，
+    有过滤条件时用EXPLAIN的估算行数
+    :return: 不是postgres或者表还没有被ANALYZE过时返回None
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    queryset = queryset.order_by()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+    return int(estimate) if estimate >= 0 else None
+
+
+def count_queryset(queryset: QuerySet, threshold: int) -> Tuple[int, bool]:
+    """
+    估算的行数达到threshold时直接返回估算值，否则执行COUNT(*)
+    :return: (行数, 是否是估算值)
+    """
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate, True
+    return queryset.count(), False
+
+
+class EstimatedCountPaginator(DjangoPaginator):
+    """
+    大表的总数用估算值，approximate表示count是否是估算值
+    """
+    threshold = 100000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.approximate = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        count, self.approximate = count_queryset(self.object_list,
+                                                 self.threshold)
+        return count
+
+
+class LargeTablePagination(CustomPagination):
+    """
+    用于千万级的日志、告警表，视图通过pagination_class开启
+    默认仍然是页码分页，只是总数超过阈值时用估算值，响应里count_approximate为True；
+    请求带cursor参数时(第一页传空值)改用(排序字段, id)的keyset分页，
+    不用OFFSET，翻到多深都只查询page_size条
+    排序取查询集的第一个排序字段，只支持模型本身的字段，排序字段为NULL的记录不会返回
+    """
+    django_paginator_class = EstimatedCountPaginator
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '无效的cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        field, descending = self.get_ordering(queryset)
+        self.count, self.approximate = count_queryset(
+            queryset, EstimatedCountPaginator.threshold)
+        self.page_count = max(math.ceil(self.count / page_size), 1)
+
+        cursor = self.decode_cursor(
+            request.query_params[self.cursor_query_param])
+        previous = cursor is not None and cursor[2]
+        # 往前翻页时反向排序，取出之后再倒过来
+        reverse = descending != previous
+        keys = [field, 'id'] if field != 'id' else ['id']
+        if field != 'id':
+            queryset = queryset.filter(**{field + '__isnull': False})
+        if cursor is not None:
+            queryset = queryset.filter(
+                self.seek(keys, cursor[:2], reverse))
+        queryset = queryset.order_by(
+            *[('-' if reverse else '') + k for k in keys])
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if previous:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.next_cursor = self.encode_cursor(rows[-1], field, False) \
+            if rows and self.has_next else None
+        self.previous_cursor = self.encode_cursor(rows[0], field, True) \
+            if rows and self.has_previous else None
+        return rows
+
+    @classmethod
+    def get_ordering(cls, queryset: QuerySet) -> Tuple[str, bool]:
+        """
+        :return: (排序字段, 是否降序)，没有可用的排序时按id降序
+        """
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        for item in ordering:
+            if not isinstance(item, str):
+                break
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            if '__' in name or name == '?':
+                break
+            if name not in {f.name for f in queryset.model._meta.concrete_fields}:
+                break
+            return name, descending
+        return 'id', True
+
+    @classmethod
+    def seek(cls, keys, values, reverse: bool) -> Q:
+        """
+        (field, id) > (value, pk)展开成 field > value OR (field = value AND id > pk)
+        """
+        op = 'lt' if reverse else 'gt'
+        if len(keys) == 1:
+            return Q(**{'id__' + op: values[1]})
+        field = keys[0]
+        return Q(**{field + '__' + op: values[0]}) | Q(
+            **{field: values[0], 'id__' + op: values[1]})
+
+    @classmethod
+    def encode_cursor(cls, obj, field: str, previous: bool) -> str:
+        value = getattr(obj, field)
+        # DjangoJSONEncoder会把时间截断到毫秒，游标需要精确的值
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        data = json.dumps([value, obj.id, previous], default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, value: str):
+        """
+        :return: [排序字段的值, id, 是否往前翻页]，第一页返回None
+        """
+        if not value:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(value.encode()))
+            assert isinstance(cursor, list) and len(cursor) == 3
+        except (ValueError, TypeError, AssertionError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_cursor_link(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data, select_ids=None):
+        if not self.keyset:
+            response = super().get_paginated_response(data, select_ids)
+            response.data['count_approximate'] = \
+                self.page.paginator.approximate
+            return response
+
+        items = [
+            ('count', self.count),
+            ('count_approximate', self.approximate),
+            ('next', self.get_cursor_link(self.next_cursor)),
+            ('previous', self.get_cursor_link(self.previous_cursor)),
+            ('results', data),
+        ]
+        if select_ids is not None:
+            items.append(('select_ids', select_ids))
+        items.append(('page_count', self.page_count))
+        return Response(OrderedDict(items))
@@ -0,0 +1,266 @@
+"""
+数据库相关的辅助方法，主要是ORM不方便表达的批量SQL
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from django.db import OperationalError, connections, models, transaction
+from django.utils import timezone
+
+from utils.unified_redis import cache
+
+logger = logging.getLogger(__name__)
+
+# postgres锁等待超时的错误码
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def _merge_rows(rows: Iterable[Dict], conflict_fields: Sequence[str],
+                count_fields: Sequence[str]) -> List[Dict]:
+    """
+    ON CONFLICT DO UPDATE 在一条语句里不能重复更新同一行，所以先把冲突键相同的行合并
+    """
+    merged: Dict[tuple, Dict] = {}
+    for row in rows:
+        key = tuple(row[f] for f in conflict_fields)
+        if key in merged:
+            for f in count_fields:
+                merged[key][f] += row.get(f, 0)
+        else:
+            merged[key] = dict(row)
+    return list(merged.values())
+
+
+def counted_upsert(model: Type[models.Model], rows: Iterable[Dict],
+                   conflict_fields: Sequence[str],
+                   count_fields: Sequence[str],
+                   using: str = 'default') -> List[models.Model]:
+    """
+    批量累加计数，一批数据只用一条SQL：
+    INSERT ... ON CONFLICT (conflict_fields) DO UPDATE
+    SET count = table.count + EXCLUDED.count
+    累加在数据库内完成，并发同步时不会像get/save那样丢失计数
+    auto_now和auto_now_add的时间字段会自动填充，冲突时刷新auto_now字段
+    :param model: 模型，conflict_fields上必须有唯一约束
+    :param rows: [{'country': '中国', 'count': 100}, ...]
+    :param conflict_fields: 冲突判断的字段，如('country', )
+    :param count_fields: 需要累加的字段，如('count', )
+    :param using: 数据库
+    :return: 插入或更新后的模型实例
+    """
+    rows = _merge_rows(rows, conflict_fields, count_fields)
+    if not rows:
+        return []
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    now = timezone.now()
+
+    touch_fields = [f.name for f in opts.concrete_fields
+                    if getattr(f, 'auto_now', False)]
+    fill_fields = touch_fields + [
+        f.name for f in opts.concrete_fields
+        if getattr(f, 'auto_now_add', False) and f.name not in touch_fields]
+    field_names = list(rows[0].keys())
+    field_names += [f for f in fill_fields if f not in field_names]
+    fields = [opts.get_field(f) for f in field_names]
+
+    values = []
+    params = []
+    for row in rows:
+        values.append('({})'.format(', '.join(['%s'] * len(fields))))
+        for field in fields:
+            value = row.get(field.name, now if field.name in fill_fields
+                            else field.get_default())
+            params.append(field.get_db_prep_save(value, connection))
+
+    updates = ['{col} = {table}.{col} + EXCLUDED.{col}'.format(
+        col=qn(opts.get_field(f).column), table=table) for f in count_fields]
+    updates += ['{col} = EXCLUDED.{col}'.format(col=qn(opts.get_field(f).column))
+                for f in touch_fields if f not in count_fields]
+
+    returning = opts.concrete_fields
+    sql = 'INSERT INTO {table} ({columns}) VALUES {values} ' \
+          'ON CONFLICT ({conflict}) DO UPDATE SET {updates} ' \
+          'RETURNING {returning}'.format(
+            table=table,
+            columns=', '.join(qn(f.column) for f in fields),
+            values=', '.join(values),
+            conflict=', '.join(qn(opts.get_field(f).column)
+                               for f in conflict_fields),
+            updates=', '.join(updates),
+            returning=', '.join(qn(f.column) for f in returning))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        result = cursor.fetchall()
+
+    attnames = [f.attname for f in returning]
+    converters = []
+    for field in returning:
+        col = field.get_col(opts.db_table)
+        converters.append((col, connection.ops.get_db_converters(col) +
+                           col.get_db_converters(connection)))
+    instances = []
+    for r in result:
+        r = list(r)
+        for i, (col, funcs) in enumerate(converters):
+            for converter in funcs:
+                r[i] = converter(r[i], col, connection)
+        instances.append(model.from_db(using, attnames, r))
+    return instances
+
+
+class ChunkedDelete(object):
+    """
+    按主键范围分批删除过期数据，代替Model.objects.filter(...).delete()：
+    Django的delete会先把所有要删除的主键读进内存再触发信号，大表会占用大量内存并长时间锁表
+    每一批在单独的事务里先用SELECT ... FOR UPDATE锁定这一批的行，再按主键DELETE，
+    锁定的耗时计为锁等待时间；两批之间sleep，给其他写入让出时间
+    每一批完成之后把进度和cutoff保存在redis里，中途退出或者超过max_seconds之后，
+    下次用同一个cutoff删除时从断点继续；cutoff不同时断点作废，重新计算主键范围，
+    已经删除的行不在范围内，不会重复扫描
+    不会触发信号，也不会级联删除，只能用于没有被外键引用的表
+
+    :param model: 模型
+    :param field: 时间字段，删除 field <= cutoff 的数据
+    :param cutoff: 删除这个时间之前的数据
+    :param chunk_size: 每一批的主键范围大小
+    :param sleep: 两批之间暂停的秒数
+    :param lock_timeout: 锁等待超时的毫秒数，超时之后这一批稍后重试
+    :param max_seconds: 一次最多执行的秒数，None表示不限制
+    """
+    CHECKPOINT_KEY = 'retention-checkpoint'
+    max_retries = 3
+
+    def __init__(self, model: Type[models.Model], field: str,
+                 cutoff: datetime, chunk_size: int = 5000,
+                 sleep: float = 0.1, lock_timeout: int = 2000,
+                 max_seconds: Optional[float] = None, using: str = 'default'):
+        self.model = model
+        self.field = field
+        self.cutoff = cutoff
+        self.chunk_size = chunk_size
+        self.sleep = sleep
+        self.lock_timeout = lock_timeout
+        self.max_seconds = max_seconds
+        self.using = using
+        self.connection = connections[using]
+        qn = self.connection.ops.quote_name
+        self.table = qn(model._meta.db_table)
+        self.column = qn(model._meta.get_field(field).column)
+        self.pk = qn(model._meta.pk.column)
+
+    @property
+    def name(self) -> str:
+        return self.model._meta.db_table
+
+    def load_checkpoint(self) -> Optional[Dict]:
+        data = cache.hget(self.CHECKPOINT_KEY, self.name)
+        return json.loads(data) if data else None
+
+    def save_checkpoint(self, next_id: int, upper: int):
+        cache.hset(self.CHECKPOINT_KEY, self.name,
+                   json.dumps({'next_id': next_id, 'upper': upper,
+                               'cutoff': self.cutoff.isoformat()}))
+
+    def clear_checkpoint(self):
+        cache.hdel(self.CHECKPOINT_KEY, self.name)
+
+    def id_range(self) -> Optional[List[int]]:
+        """
+        :return: [起始主键, 结束主键]，上次用同一个cutoff没有删完时从断点继续
+        """
+        checkpoint = self.load_checkpoint()
+        if checkpoint:
+            # 断点的结束主键是按当时的cutoff计算的，cutoff变了之后继续用会漏掉
+            # 之后过期的数据
+            if checkpoint.get('cutoff') == self.cutoff.isoformat():
+                return [checkpoint['next_id'], checkpoint['upper']]
+            self.clear_checkpoint()
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT min({pk}), max({pk}) FROM {table} '
+                'WHERE {column} <= %s'.format(
+                    pk=self.pk, table=self.table, column=self.column),
+                [self.cutoff])
+            lower, upper = cursor.fetchone()
+        if lower is None:
+            return None
+        return [lower, upper]
+
+    def delete_chunk(self, lower: int, upper: int) -> Tuple[int, float]:
+        """
+        :return: (删除的行数, 锁等待的秒数)
+        """
+        with transaction.atomic(using=self.using), \
+                self.connection.cursor() as cursor:
+            cursor.execute('SET LOCAL lock_timeout = %s',
+                           ['{}ms'.format(self.lock_timeout)])
+            start = time.monotonic()
+            cursor.execute(
+                'SELECT {pk} FROM {table} WHERE {pk} BETWEEN %s AND %s '
+                'AND {column} <= %s FOR UPDATE'.format(
+                    pk=self.pk, table=self.table, column=self.column),
+                [lower, upper, self.cutoff])
+            ids = [row[0] for row in cursor.fetchall()]
+            lock_wait = time.monotonic() - start
+            if ids:
+                cursor.execute('DELETE FROM {table} WHERE {pk} = ANY(%s)'.format(
+                    table=self.table, pk=self.pk), [ids])
+        return len(ids), lock_wait
+
+    def run(self) -> Dict:
+        """
+        :return: 删除的行数、耗时、每秒删除的行数、锁等待时间、是否删完
+        """
+        started = time.monotonic()
+        stats = {'table': self.name, 'deleted': 0, 'chunks': 0,
+                 'lock_wait': 0.0, 'lock_timeouts': 0, 'finished': True}
+        id_range = self.id_range()
+        lower, upper = id_range if id_range else (1, 0)
+        retries = 0
+        while lower <= upper:
+            if self.max_seconds is not None and \
+                    time.monotonic() - started >= self.max_seconds:
+                stats['finished'] = False
+                break
+            chunk_upper = min(lower + self.chunk_size - 1, upper)
+            try:
+                deleted, lock_wait = self.delete_chunk(lower, chunk_upper)
+            except OperationalError as e:
+                if getattr(e.__cause__, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+                    raise
+                stats['lock_timeouts'] += 1
+                stats['lock_wait'] += self.lock_timeout / 1000
+                retries += 1
+                if retries > self.max_retries:
+                    stats['finished'] = False
+                    break
+                time.sleep(self.sleep * 10)
+                continue
+            retries = 0
+            stats['deleted'] += deleted
+            stats['chunks'] += 1
+            stats['lock_wait'] += lock_wait
+            lower = chunk_upper + 1
+            self.save_checkpoint(lower, upper)
+            if lower <= upper and self.sleep:
+                time.sleep(self.sleep)
+
+        if stats['finished']:
+            self.clear_checkpoint()
+        else:
+            self.save_checkpoint(lower, upper)
+        seconds = time.monotonic() - started
+        stats['seconds'] = round(seconds, 3)
+        stats['rows_per_sec'] = round(stats['deleted'] / seconds, 1) \
+            if seconds else 0
+        stats['lock_wait'] = round(stats['lock_wait'], 3)
+        logger.info('retention delete %s', stats)
+        return stats
@@ -1,12 +1,17 @@
 import json
+import logging
 import os
-from typing import Dict, Optional
+import threading
+from functools import lru_cache
+from ipaddress import ip_address
+from typing import Dict, Iterable, Optional
 
 from IP2Location import IP2Location
 from django.conf import settings
 
 
 SHAANXI = 'SHAANXI'
+logger = logging.getLogger(__name__)
 
 
 def _load_geography():
@@ -22,6 +27,20 @@ def _load_foreign_country():
     return data
 
 
+def _open_ip_database() -> IP2Location:
+    """
+    优先用mmap(SHARED_MEMORY)打开IP库，查询时直接切片读取，不用每次seek/read，
+    多个进程打开同一个文件时也共享操作系统的页缓存
+    mmap需要文件的写权限，没有权限时退回到普通的文件读取
+    """
+    path = os.path.join(settings.MEDIA_ROOT, 'IP2LOCATION-LITE-DB5.BIN')
+    try:
+        return IP2Location(path, mode='SHARED_MEMORY')
+    except (OSError, ValueError) as e:
+        logger.warning('IP库无法使用mmap打开，使用文件读取, {}'.format(e))
+        return IP2Location(path)
+
+
 class IPRecord(object):
     def __init__(self, ip, country=None, province=None, city=None,
                  latitude=None, longitude=None):
@@ -34,16 +53,66 @@ class IPRecord(object):
 
 
 class IPSearch(object):
-    _geo_data = _load_geography()
-    _foreign_country = _load_foreign_country()
-    _ip_search: IP2Location = IP2Location(os.path.join(
-        settings.MEDIA_ROOT, 'IP2LOCATION-LITE-DB5.BIN'))
+    """
+    IP地理位置查询，查询结果放在LRU缓存里，同一批外网IP反复查询时不用再读IP库
+    缓存里的IPRecord是共享的，调用方不要修改返回的IPRecord
+    IP库和地理信息字典在第一次查询时才加载，导入模块不会有解析文件的开销
+    """
+    _geo_data: Optional[Dict] = None
+    _foreign_country: Optional[Dict] = None
+    _ip_search: Optional[IP2Location] = None
+    _lock = threading.Lock()
     chinese = ['China', 'Taiwan (Province of China)', 'Macao', 'Hong Kong']
 
+    def __init__(self, cache_size: int = 65536):
+        self._cached_search = lru_cache(maxsize=cache_size)(self._search)
+
+    @classmethod
+    def load(cls):
+        """
+        加载IP库和地理信息字典，查询时会自动调用
+        IP库是mmap打开的，多个进程共享同一份页缓存；如果需要在fork之前加载，
+        可以在主进程里提前调用一次
+        """
+        if cls._ip_search is not None:
+            return
+        with cls._lock:
+            if cls._ip_search is not None:
+                return
+            cls._geo_data = _load_geography()
+            cls._foreign_country = _load_foreign_country()
+            # 最后赋值_ip_search，其他线程看到它不为None时字典一定已经加载好了
+            cls._ip_search = _open_ip_database()
+
     def search_ip_location(self, ip) -> Optional[IPRecord]:
+        return self._cached_search(ip)
+
+    def search_ip_locations(self, ips: Iterable[str]) -> Dict[str, IPRecord]:
+        """
+        批量查询，重复的IP只查一次
+        :param ips: IP列表
+        :return: {ip: IPRecord}
+        """
+        return {ip: self._cached_search(ip) for ip in set(ips)}
+
+    def cache_info(self):
+        return self._cached_search.cache_info()
+
+    def cache_clear(self):
+        self._cached_search.cache_clear()
+
+    def _search(self, ip) -> IPRecord:
+        try:
+            address = ip_address(ip)
+        except ValueError:
+            return IPRecord(ip)
+        if not address.is_global:
+            # 内网、保留地址IP库里没有地理信息，不用再查
+            return IPRecord(ip)
+        self.load()
         record = self._ip_search.get_all(ip)
         if not record:
-            IPRecord(None, None, None, None, None, None)
+            return IPRecord(ip)
         country = record.country_long
         if self.is_chinese(country):
             country = '中国'
@@ -7,15 +7,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth import logout
 from django.http.response import JsonResponse
 from django.urls import reverse
+from django.utils.translation import ugettext_lazy as _
 from rest_framework import status
 from rest_framework.exceptions import AuthenticationFailed
 
 from log.log_config import ModelLog
 from log.log_content import additional_before_delete
 from log.models import UnifiedForumLog
-from setting.models import Setting
+from setting.helpers import get_setting
 from utils.async_lock import RedisLock, ForceDropError
-from utils.core.authentication import EncryptedTokenAuthentication
+from utils.core.authentication import EncryptedTokenAuthentication, SALT_EXPIRE
 from utils.core.exceptions import CustomError
 from utils.unified_redis import rs
 
@@ -38,6 +39,23 @@ REDIS_ACTIVATION_VALID_UNTIL = 'valid_until'
 REDIS_ALLOWED_IP = 'allowed_ip'
 REDIS_INACTIVITY_TIMEOUT = 'inactivity_timeout'
 
+# 一次往返完成请求的安全检查：记录token的盐、检查IP白名单、读取超时时间
+# KEYS: 用户名(盐的集合), IP白名单, 超时时间
+# ARGV: 盐(未登录时为空), 盐的保存时间, 来源IP
+# 返回: {盐是否没被用过, IP是否允许访问, 超时时间}
+REQUEST_GATE_SCRIPT = rs.register_script("""
+local salt_ok = 1
+if ARGV[1] ~= '' then
+    salt_ok = redis.call('SADD', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+local ip_ok = 1
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    ip_ok = redis.call('SISMEMBER', KEYS[2], ARGV[3])
+end
+return {salt_ok, ip_ok, redis.call('GET', KEYS[3])}
+""")
+
 
 class CheckIPAndTimeoutMiddleware(object):
     """
@@ -48,7 +66,7 @@ class CheckIPAndTimeoutMiddleware(object):
     """
 
     def __init__(self, get_response):
-        setting, created = Setting.objects.get_or_create(id=1)
+        setting = get_setting()
         self.get_response = get_response
 
         # self.inactivity_timeout = setting.login_timeout_duration * 60
@@ -75,25 +93,37 @@ class CheckIPAndTimeoutMiddleware(object):
         # has_token = request.META.get('HTTP_AUTHORIZATION')
         # 从 Token 中取出 user
         # auth = TokenAuthentication()
-        auth = EncryptedTokenAuthentication()
+        authentication = EncryptedTokenAuthentication()
 
         try:
-            user_auth_tuple = auth.authenticate(request)
-            if user_auth_tuple is None:
-                user = None
-            else:
-                user, auth = user_auth_tuple
+            decrypted = authentication.decrypt_header(request)
+            user, auth, salt = None, None, ''
+            if decrypted is not None:
+                token, salt = decrypted
+                user, auth = authentication.authenticate_credentials(token)
         except AuthenticationFailed as exc:
             return JsonResponse(status=401, data={'detail': exc.detail})
 
-        if self.ip_has_been_banned(remote_addr):
+        salt_ok, ip_ok, inactivity_timeout = REQUEST_GATE_SCRIPT(
+            keys=[user.username if user else ANONYMOUS_NAME, REDIS_ALLOWED_IP,
+                  REDIS_INACTIVITY_TIMEOUT],
+            args=[salt, SALT_EXPIRE, remote_addr])
+        if not salt_ok:
+            # 盐已经用过，token被重放
+            return JsonResponse(
+                status=401,
+                data={'detail': AuthenticationFailed(_('Invalid token.')).detail})
+        if user:
+            # 视图里的认证直接使用这里的结果，不再记录一次盐
+            setattr(request, EncryptedTokenAuthentication.request_attr,
+                    (user, auth))
+
+        if not ip_ok:
+            self.ip_banned_log(remote_addr)
             return JsonResponse(
                 data=CustomError(error_code=CustomError.IP_LIMIT_ERROR).detail,
                 status=CustomError.status_code
             )
-        # 禁止所有用户登录
-        setting, created = Setting.objects.get_or_create(id=1)
-
         # 旧版综管方法
         # if self.ip_limit_enable and (remote_addr not in self.allowed_ip):
         #     UnifiedForumLog.objects.create(
@@ -121,7 +151,9 @@ class CheckIPAndTimeoutMiddleware(object):
 
         # 超时登出
         if request.path != LOGIN_PATH:
-            inactivity_timeout = int(rs.get(REDIS_INACTIVITY_TIMEOUT))
+            if inactivity_timeout is None:
+                inactivity_timeout = get_setting().login_timeout_duration * 60
+            inactivity_timeout = int(inactivity_timeout)
             if (LAST_TOUCH in session and
                     time.time() - session[LAST_TOUCH] > inactivity_timeout):
                 request.user = user
@@ -156,24 +188,18 @@ class CheckIPAndTimeoutMiddleware(object):
         except ForceDropError:
             pass
 
-    def ip_has_been_banned(self, remote_addr: str):
+    def ip_banned_log(self, remote_addr: str):
         """
-        判断用户ip是不是被禁止访问
+        用户ip不在允许列表里，记录日志
         :param remote_addr: 用户ip
-        :return: 如果用户ip被禁，需要记录日志
         """
-        if rs.exists(REDIS_ALLOWED_IP) and not rs.sismember(
-                REDIS_ALLOWED_IP, remote_addr
-        ):
-            UnifiedForumLog.objects.create(
-                ip=remote_addr,
-                type=UnifiedForumLog.TYPE_LOGIN,
-                result=False,
-                category=UnifiedForumLog.CATEGORY_LOGIN_LOGOUT,
-                content='IP {}未在允许列表中，访问失败'.format(remote_addr)
-            )
-            return True
-        return False
+        UnifiedForumLog.objects.create(
+            ip=remote_addr,
+            type=UnifiedForumLog.TYPE_LOGIN,
+            result=False,
+            category=UnifiedForumLog.CATEGORY_LOGIN_LOGOUT,
+            content='IP {}未在允许列表中，访问失败'.format(remote_addr)
+        )
 
     def __call__(self, request):
         response = self.get_response(request)
@@ -0,0 +1,298 @@
+"""
+postgres按时间范围分区的日志、事件表：
+按月或按天分区，定时任务提前创建后面的分区，过期数据直接DROP/DETACH整个分区，
+不再DELETE大量的行；查询带时间条件时postgres只扫描相关的分区
+
+已有的表需要用 manage.py partition_tables --convert 转换一次，没有转换的表
+所有的方法都不做任何操作，原来的DELETE清理逻辑照常生效
+"""
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple, Type
+
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class PartitionedTable(object):
+    """
+    :param model: 分区的模型
+    :param column: 分区字段，时间类型
+    :param interval: 按月(MONTH)或按天(DAY)分区
+    :param premake: 提前创建多少个分区，默认按月3个，按天7个
+    :param retention_days: 保留的天数，None表示不按时间清理
+    """
+    MONTH = 'month'
+    DAY = 'day'
+
+    def __init__(self, model: Type[models.Model], column: str,
+                 interval: str = MONTH, premake: Optional[int] = None,
+                 retention_days: Optional[int] = None):
+        self.model = model
+        self.column = column
+        self.interval = interval
+        self.premake = premake if premake is not None else (
+            3 if interval == self.MONTH else 7)
+        self.retention_days = retention_days
+
+    @property
+    def table(self) -> str:
+        return self.model._meta.db_table
+
+    @property
+    def legacy_table(self) -> str:
+        return '{}_legacy'.format(self.table)
+
+    @property
+    def default_table(self) -> str:
+        return '{}_default'.format(self.table)
+
+    def period_start(self, time: datetime) -> datetime:
+        """
+        time所在分区的开始时间，按本地时间对齐
+        """
+        local = timezone.localtime(time).replace(
+            hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        if self.interval == self.MONTH:
+            local = local.replace(day=1)
+        return timezone.make_aware(local)
+
+    def next_period(self, start: datetime) -> datetime:
+        local = timezone.localtime(start).replace(tzinfo=None)
+        if self.interval == self.MONTH:
+            if local.month == 12:
+                local = local.replace(year=local.year + 1, month=1)
+            else:
+                local = local.replace(month=local.month + 1)
+        else:
+            local = local + timedelta(days=1)
+        return timezone.make_aware(local)
+
+    def partition_name(self, start: datetime) -> str:
+        fmt = '%Y%m' if self.interval == self.MONTH else '%Y%m%d'
+        return '{}_p{}'.format(self.table,
+                               timezone.localtime(start).strftime(fmt))
+
+    @classmethod
+    def qn(cls, name: str) -> str:
+        return connection.ops.quote_name(name)
+
+    @classmethod
+    def literal(cls, time: datetime) -> str:
+        """
+        postgres 11的分区范围只能是常量，不能用参数生成的'...'::timestamptz
+        """
+        return "'{}'".format(time.isoformat())
+
+    def is_partitioned(self) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c '
+                'ON c.oid = p.partrelid WHERE c.relname = %s', [self.table])
+            return cursor.fetchone() is not None
+
+    @classmethod
+    def parse_bound(cls, value: str) -> Optional[datetime]:
+        if value in ('MINVALUE', 'MAXVALUE'):
+            return None
+        return parse_datetime(value.strip("'"))
+
+    def partitions(self) -> List[Tuple[str, Optional[datetime],
+                                       Optional[datetime]]]:
+        """
+        :return: [(分区名, 开始时间, 结束时间)]，MINVALUE/MAXVALUE为None，
+        默认分区不返回；按开始时间排序
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) '
+                'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s',
+                [self.table])
+            rows = cursor.fetchall()
+
+        result = []
+        for name, bound in rows:
+            match = BOUND_RE.search(bound)
+            if not match:
+                continue
+            result.append((name, self.parse_bound(match.group(1)),
+                           self.parse_bound(match.group(2))))
+        result.sort(key=lambda p: p[1] or datetime.min.replace(
+            tzinfo=timezone.utc))
+        return result
+
+    def create_partition(self, start: datetime) -> str:
+        """
+        创建[start, 下个周期)的分区。分区不存在期间写入的数据在默认分区里，
+        先建成普通表把这些数据移过去再ATTACH，否则postgres不允许创建分区
+        """
+        end = self.next_period(start)
+        name = self.partition_name(start)
+        qn = self.qn
+        column = qn(self.model._meta.get_field(self.column).column)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS '
+                'INCLUDING CONSTRAINTS INCLUDING STORAGE)'.format(
+                    name=qn(name), table=qn(self.table)))
+            cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id)'.format(
+                qn(name)))
+            cursor.execute(
+                'WITH moved AS (DELETE FROM {default} WHERE {column} >= %s '
+                'AND {column} < %s RETURNING *) '
+                'INSERT INTO {name} SELECT * FROM moved'.format(
+                    default=qn(self.default_table), column=column,
+                    name=qn(name)), [start, end])
+            cursor.execute(
+                'ALTER TABLE {table} ATTACH PARTITION {name} '
+                'FOR VALUES FROM ({start}) TO ({end})'.format(
+                    table=qn(self.table), name=qn(name),
+                    start=self.literal(start), end=self.literal(end)))
+        return name
+
+    def ensure(self, current: datetime) -> List[str]:
+        """
+        创建当前周期和之后premake个周期的分区，和已有分区重叠的跳过
+        :return: 新创建的分区名
+        """
+        if not self.is_partitioned():
+            return []
+        existing = self.partitions()
+        created = []
+        start = self.period_start(current)
+        for _ in range(self.premake + 1):
+            end = self.next_period(start)
+            overlap = any((lower is None or lower < end) and
+                          (upper is None or upper > start)
+                          for _, lower, upper in existing)
+            if not overlap:
+                created.append(self.create_partition(start))
+            start = end
+        return created
+
+    def drop_before(self, cutoff: datetime, detach: bool = False) -> List[str]:
+        """
+        删除所有数据都早于cutoff的分区，分区里还有不早于cutoff的数据时不处理，
+        这部分数据继续由原来的DELETE清理
+        :param detach: True时只从分区表上分离，保留数据用于归档
+        :return: 删除或分离的分区名
+        """
+        if not self.is_partitioned():
+            return []
+        removed = []
+        for name, _, upper in self.partitions():
+            if upper is None or upper > cutoff:
+                continue
+            self.drop_partition(name, detach)
+            removed.append(name)
+        return removed
+
+    def drop_partition(self, name: str, detach: bool = False):
+        """
+        只删除或分离指定的一个分区
+        """
+        with connection.cursor() as cursor:
+            if detach:
+                cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                    self.qn(self.table), self.qn(name)))
+            else:
+                cursor.execute('DROP TABLE {}'.format(self.qn(name)))
+
+    def convert(self, current: datetime) -> bool:
+        """
+        把已有的普通表转换成分区表，只需要执行一次：
+        原来的表改名为<table>_legacy，作为 [MINVALUE, 下个周期开始) 的分区挂到
+        新的分区表上，不复制数据；分区字段为空或者超出范围的数据移到默认分区
+        给旧表加CHECK约束时需要扫描一遍全表，期间表被锁住，需要在维护窗口执行
+        外键约束只保留在旧表上，删除资产时的级联删除由Django完成
+        :return: 是否做了转换，已经是分区表时返回False
+        """
+        if self.is_partitioned():
+            return False
+        qn = self.qn
+        boundary = self.next_period(self.period_start(current))
+        column = qn(self.model._meta.get_field(self.column).column)
+        table, legacy, default = qn(self.table), qn(self.legacy_table), \
+            qn(self.default_table)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(table, legacy))
+            # 索引名在schema内唯一，旧表的索引改名之后分区表才能用模型里的索引名
+            cursor.execute('SELECT indexname FROM pg_indexes '
+                           'WHERE tablename = %s', [self.legacy_table])
+            for (index,) in cursor.fetchall():
+                cursor.execute('ALTER INDEX {} RENAME TO {}'.format(
+                    qn(index), qn(index[:55] + '_legacy')))
+            cursor.execute(
+                'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS '
+                'INCLUDING STORAGE) PARTITION BY RANGE ({column})'.format(
+                    table=table, legacy=legacy, column=column))
+            # 自增序列属于旧表的id字段，旧表的分区被删除时不能把序列一起删掉
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)',
+                           [self.legacy_table, 'id'])
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(
+                    sequence, table))
+
+            with connection.schema_editor() as editor:
+                for sql in editor._model_indexes_sql(self.model):
+                    editor.execute(sql)
+
+            cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+                default, table))
+            cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id)'.format(
+                default))
+            cursor.execute(
+                'WITH moved AS (DELETE FROM {legacy} WHERE {column} IS NULL '
+                'OR {column} >= %s RETURNING *) '
+                'INSERT INTO {default} SELECT * FROM moved'.format(
+                    legacy=legacy, column=column, default=default),
+                [boundary])
+            # 有了CHECK约束，ATTACH时postgres不用再扫描旧表
+            cursor.execute(
+                'ALTER TABLE {legacy} ADD CONSTRAINT {name} CHECK ('
+                '{column} IS NOT NULL AND {column} < %s)'.format(
+                    legacy=legacy, name=qn(self.legacy_table[:57] + '_range'),
+                    column=column), [boundary])
+            cursor.execute(
+                'ALTER TABLE {table} ATTACH PARTITION {legacy} '
+                'FOR VALUES FROM (MINVALUE) TO ({boundary})'.format(
+                    table=table, legacy=legacy,
+                    boundary=self.literal(boundary)))
+        self.ensure(boundary)
+        return True
+
+
+class PartitionRegister(object):
+    """
+    将需要按时间分区的模型注册到这里，定时任务取出注册的表创建分区和清理过期分区
+    """
+    def __init__(self):
+        self._register: List[PartitionedTable] = []
+
+    def register(self, column: str, interval: str = PartitionedTable.MONTH,
+                 premake: Optional[int] = None,
+                 retention_days: Optional[int] = None):
+        def wrapper(clazz):
+            self._register.append(PartitionedTable(
+                clazz, column, interval, premake, retention_days))
+            return clazz
+
+        return wrapper
+
+    def get_all(self) -> List[PartitionedTable]:
+        return self._register
+
+    def get(self, model: Type[models.Model]) -> Optional[PartitionedTable]:
+        for table in self._register:
+            if table.model is model:
+                return table
+        return None
+
+
+partition_register = PartitionRegister()
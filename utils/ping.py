@@ -0,0 +1,279 @@
+"""
+批量ping：一个ICMP socket同时向所有主机发送echo请求，统计每个主机的往返时间和丢包，
+不再每个主机fork一个ping进程
+优先使用不需要root权限的ICMP datagram socket（需要net.ipv4.ping_group_range允许），
+不可用时使用raw socket；IPv4和IPv6主机分别用ICMP和ICMPv6的socket
+"""
+import asyncio
+import ipaddress
+import itertools
+import os
+import socket
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+
+def host_family(host: str) -> int:
+    """
+    主机地址的协议族，不是合法IP的按IPv4处理，发送时失败算作丢包
+    """
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return socket.AF_INET
+    return socket.AF_INET6 if address.version == 6 else socket.AF_INET
+
+
+def normalize(host: str) -> str:
+    """
+    IPv6地址有多种写法，和回复的源地址比较前统一格式
+    """
+    try:
+        return str(ipaddress.ip_address(host))
+    except ValueError:
+        return host
+
+
+class PingResult(object):
+    def __init__(self, host: str):
+        self.host = host
+        self.sent = 0
+        self.rtts: List[float] = []
+
+    @property
+    def received(self) -> int:
+        return len(self.rtts)
+
+    @property
+    def alive(self) -> bool:
+        return self.received > 0
+
+    @property
+    def loss(self) -> float:
+        """
+        丢包率，0 ~ 1
+        """
+        if not self.sent:
+            return 1.0
+        return round(1 - self.received / self.sent, 2)
+
+    @property
+    def avg_rtt(self) -> Optional[float]:
+        """
+        平均往返时间，毫秒
+        """
+        if not self.rtts:
+            return None
+        return round(sum(self.rtts) / len(self.rtts), 3)
+
+    def __repr__(self):
+        return '<PingResult {} sent={} received={} avg_rtt={}>'.format(
+            self.host, self.sent, self.received, self.avg_rtt)
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class BatchPinger(object):
+    """
+    :param count: 每个主机发送的echo请求数
+    :param timeout: 最后一个请求发出后等待回复的秒数
+    :param interval: 每一轮请求之间的间隔秒数
+    """
+    PAYLOAD_SIZE = 56
+
+    def __init__(self, count: int = 2, timeout: float = 5.0,
+                 interval: float = 0.2):
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self._ident = os.getpid() & 0xffff
+        self._seq = itertools.count()
+
+    @classmethod
+    def open_socket(cls, family: int = socket.AF_INET) -> \
+            Tuple[socket.socket, bool]:
+        """
+        :return: (socket, 是否是raw socket)
+        """
+        proto = socket.IPPROTO_ICMP if family == socket.AF_INET \
+            else socket.IPPROTO_ICMPV6
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            raw = False
+        except (PermissionError, OSError):
+            sock = socket.socket(family, socket.SOCK_RAW, proto)
+            raw = True
+        sock.setblocking(False)
+        return sock, raw
+
+    @classmethod
+    def available(cls, family: int = socket.AF_INET) -> bool:
+        try:
+            sock, _ = cls.open_socket(family)
+        except OSError:
+            return False
+        sock.close()
+        return True
+
+    @classmethod
+    def split(cls, hosts: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """
+        按能否创建对应协议族的ICMP socket把主机分成两组
+        :return: (可以批量ping的主机, 需要调用方用ping命令处理的主机)
+        """
+        supported, unsupported = [], []
+        available = {}
+        for host in hosts:
+            family = host_family(host)
+            if family not in available:
+                available[family] = cls.available(family)
+            (supported if available[family] else unsupported).append(host)
+        return supported, unsupported
+
+    def packet(self, seq: int, family: int = socket.AF_INET) -> bytes:
+        payload = struct.pack('!d', time.time()).ljust(self.PAYLOAD_SIZE, b'Q')
+        if family == socket.AF_INET6:
+            # ICMPv6的校验和包含IPv6伪首部，由内核计算
+            return struct.pack('!BBHHH', ICMPV6_ECHO_REQUEST, 0, 0,
+                               self._ident, seq) + payload
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0,
+                             self._ident, seq)
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0,
+                             checksum(header + payload), self._ident, seq)
+        return header + payload
+
+    def parse_reply(self, data: bytes, raw: bool,
+                    family: int = socket.AF_INET) -> Optional[int]:
+        """
+        :return: echo回复的序号，不是本进程发出的请求的回复时返回None
+        """
+        if raw and family == socket.AF_INET:
+            # IPv4的raw socket收到的数据包含IP头，IPv6的不包含
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < 8:
+            return None
+        icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+        reply = ICMP_ECHO_REPLY if family == socket.AF_INET \
+            else ICMPV6_ECHO_REPLY
+        if icmp_type != reply:
+            return None
+        # datagram socket的标识由内核分配，内核已经按socket过滤过回复
+        if raw and ident != self._ident:
+            return None
+        return seq
+
+    @staticmethod
+    async def sendto(sock: socket.socket, data: bytes, address: Tuple):
+        """
+        发送缓冲区满时等socket可写之后重发同一个报文，没有发出去的请求不能算作丢包
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                return sock.sendto(data, address)
+            except (BlockingIOError, InterruptedError):
+                pass
+            writable = loop.create_future()
+            loop.add_writer(sock.fileno(), lambda: writable.done() or
+                            writable.set_result(None))
+            try:
+                await writable
+            finally:
+                loop.remove_writer(sock.fileno())
+
+    def ping(self, hosts: Iterable[str]) -> Dict[str, PingResult]:
+        """
+        同步调用的入口，在新的事件循环里执行一次批量ping
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.async_ping(hosts))
+        finally:
+            loop.close()
+
+    async def async_ping(self, hosts: Iterable[str]) -> Dict[str, PingResult]:
+        results = {host: PingResult(host) for host in hosts}
+        if not results:
+            return results
+
+        loop = asyncio.get_event_loop()
+        families = {host: host_family(host) for host in results}
+        # 协议族 -> (socket, 是否是raw socket)，创建不了socket的协议族的主机算作丢包
+        sockets: Dict[int, Tuple[socket.socket, bool]] = {}
+        # 序号 -> (主机, 发送时间)
+        pending: Dict[int, Tuple[str, float]] = {}
+        finished = asyncio.Event()
+        sending = True
+
+        def on_readable(family: int):
+            sock, raw = sockets[family]
+            while True:
+                try:
+                    data, addr = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    break
+                received = time.perf_counter()
+                seq = self.parse_reply(data, raw, family)
+                if seq is None or seq not in pending:
+                    continue
+                host, sent = pending[seq]
+                if normalize(addr[0]) != normalize(host):
+                    continue
+                del pending[seq]
+                results[host].rtts.append((received - sent) * 1000)
+            if not sending and not pending:
+                finished.set()
+
+        try:
+            for family in set(families.values()):
+                try:
+                    sockets[family] = self.open_socket(family)
+                except OSError:
+                    continue
+                loop.add_reader(sockets[family][0].fileno(), on_readable,
+                                family)
+            for i in range(self.count):
+                for host in results:
+                    seq = next(self._seq) & 0xffff
+                    results[host].sent += 1
+                    family = families[host]
+                    if family not in sockets:
+                        continue
+                    try:
+                        await self.sendto(sockets[family][0],
+                                          self.packet(seq, family), (host, 0))
+                    except OSError:
+                        # 地址不合法、网络不可达等，算作丢包
+                        continue
+                    pending[seq] = (host, time.perf_counter())
+                if i < self.count - 1:
+                    await asyncio.sleep(self.interval)
+            sending = False
+            if pending:
+                try:
+                    await asyncio.wait_for(finished.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for sock, _ in sockets.values():
+                loop.remove_reader(sock.fileno())
+                sock.close()
+        return results
+
+
+pinger = BatchPinger()
@@ -4,6 +4,7 @@ import time
 import pytest
 
 from utils.async_lock import RedisLock, ForceDropError
+from utils.unified_redis import rs
 
 
 LOCK = 1
@@ -100,3 +101,15 @@ class TestAsyncLock:
             t.join()
 
         assert DELAY == -1
+
+    def test_release_own_lock_only(self):
+        """
+        锁过期后被其他任务拿到，原来的任务结束时不能释放别人的锁
+        """
+        first = RedisLock('expired_lock', expired_time=1)
+        first.__enter__()
+        rs.delete('expired_lock')
+        with RedisLock('expired_lock', expired_time=10, force_drop=True):
+            first.__exit__(None, None, None)
+            assert rs.exists('expired_lock')
+        assert not rs.exists('expired_lock')
@@ -0,0 +1,52 @@
+import pytest
+from rest_framework.authtoken.models import Token
+
+from user.models import User, Group, UserExtension
+from utils.base_testcase import BaseUser
+from utils.core.authentication import EncryptedTokenAuthentication
+
+
+@pytest.mark.django_db
+class TestTokenUserCache:
+    @pytest.fixture(scope='function')
+    def token(self) -> Token:
+        user = User.objects.create_user(
+            username='Cached', password=BaseUser.right_password,
+            group=Group.objects.first())
+        token, _ = Token.objects.get_or_create(user=user)
+        return token
+
+    @pytest.fixture(scope='function')
+    def auth(self, token: Token) -> EncryptedTokenAuthentication:
+        auth = EncryptedTokenAuthentication()
+        auth.authenticate_credentials(token.key)
+        return auth
+
+    def test_cached(self, token: Token, auth, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            for _ in range(10):
+                user, cached_token = auth.authenticate_credentials(token.key)
+        assert user == token.user
+        assert cached_token.key == token.key
+
+    def test_password_changed(self, token: Token, auth,
+                              django_assert_num_queries):
+        user = token.user
+        user.set_password('Bl@888888')
+        user.save(update_fields=['password'])
+        with django_assert_num_queries(1):
+            user, _ = auth.authenticate_credentials(token.key)
+        assert user.check_password('Bl@888888')
+
+    def test_logout(self, token: Token, auth, django_assert_num_queries):
+        token.save()
+        with django_assert_num_queries(1):
+            auth.authenticate_credentials(token.key)
+
+    def test_banned(self, token: Token, auth, django_assert_num_queries):
+        user_ext, _ = UserExtension.objects.get_or_create(
+            name=token.user.username)
+        user_ext.banned = True
+        user_ext.save()
+        with django_assert_num_queries(1):
+            auth.authenticate_credentials(token.key)
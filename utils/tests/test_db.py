@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from auditor.models import RiskCountry, AttackIPStatistic
+from statistic.factory_data import LogCenterFactory
+from statistic.models import LogCenter
+from utils.db import counted_upsert, ChunkedDelete
+
+
+@pytest.mark.django_db
+class TestCountedUpsert:
+    def test_insert_and_accumulate(self):
+        RiskCountry.objects.all().delete()
+        counted_upsert(RiskCountry,
+                       [{'country': '美国', 'count': 3},
+                        {'country': '日本', 'count': 2}],
+                       conflict_fields=('country',), count_fields=('count',))
+        counted_upsert(RiskCountry,
+                       [{'country': '美国', 'count': 4},
+                        {'country': '英国', 'count': 1}],
+                       conflict_fields=('country',), count_fields=('count',))
+
+        result = {r.country: r.count for r in RiskCountry.objects.all()}
+        assert result == {'美国': 7, '日本': 2, '英国': 1}
+
+    def test_duplicate_key_in_batch(self):
+        """
+        同一批数据里重复的冲突键要先合并，否则ON CONFLICT会报错
+        """
+        RiskCountry.objects.all().delete()
+        result = counted_upsert(RiskCountry,
+                                [{'country': '美国', 'count': 3},
+                                 {'country': '美国', 'count': 2}],
+                                conflict_fields=('country',),
+                                count_fields=('count',))
+
+        assert len(result) == 1
+        assert result[0].count == 5
+        assert RiskCountry.objects.get(country='美国').count == 5
+
+    def test_multiple_count_fields(self):
+        AttackIPStatistic.objects.all().delete()
+        for _ in range(2):
+            statistic = counted_upsert(
+                AttackIPStatistic,
+                [{'id': 1, 'count': 5, 'src_ip': 2, 'foreign': 1,
+                  'external_ip': 3}],
+                conflict_fields=('id',),
+                count_fields=('count', 'src_ip', 'foreign', 'external_ip'))[0]
+
+        assert AttackIPStatistic.objects.count() == 1
+        assert statistic.count == 10
+        assert statistic.src_ip == 4
+        assert statistic.foreign == 2
+        assert statistic.external_ip == 6
+        assert statistic.update_time is not None
+
+
+@pytest.mark.django_db
+class TestChunkedDelete:
+    @pytest.fixture
+    def current(self):
+        current = timezone.now()
+        LogCenter.objects.all().delete()
+        LogCenterFactory.create_batch(
+            5, update_time=current - timedelta(days=10))
+        LogCenterFactory.create_batch(2, update_time=current)
+        return current
+
+    def test_delete(self, current):
+        delete = ChunkedDelete(LogCenter, 'update_time',
+                               current - timedelta(days=1), chunk_size=2,
+                               sleep=0)
+        delete.clear_checkpoint()
+        stats = delete.run()
+
+        assert stats['deleted'] == 5
+        assert stats['chunks'] == 3
+        assert stats['finished'] is True
+        assert LogCenter.objects.count() == 2
+        assert delete.load_checkpoint() is None
+
+    def test_resume(self, current):
+        """
+        超过max_seconds之后保存断点，下次从断点继续删除
+        """
+        cutoff = current - timedelta(days=1)
+        first = ChunkedDelete(LogCenter, 'update_time', cutoff,
+                              sleep=0, max_seconds=0)
+        first.clear_checkpoint()
+        stats = first.run()
+        assert stats['finished'] is False
+        assert first.load_checkpoint() is not None
+        assert LogCenter.objects.count() == 7
+
+        stats = ChunkedDelete(LogCenter, 'update_time', cutoff,
+                              sleep=0).run()
+        assert stats['deleted'] == 5
+        assert first.load_checkpoint() is None
+
+    def test_checkpoint_other_cutoff(self, current):
+        """
+        断点是按别的cutoff保存的时候作废，按新的cutoff重新计算主键范围
+        """
+        first = ChunkedDelete(LogCenter, 'update_time',
+                              current - timedelta(days=20), sleep=0)
+        first.save_checkpoint(1, 1)
+
+        delete = ChunkedDelete(LogCenter, 'update_time',
+                               current - timedelta(days=1), sleep=0)
+        stats = delete.run()
+
+        assert stats['deleted'] == 5
+        assert LogCenter.objects.count() == 2
+        assert delete.load_checkpoint() is None
@@ -1,6 +1,16 @@
+import logging
+import subprocess
+import sys
+import time
+
 import pytest
+from django.conf import settings
+from faker import Faker
+
+from utils.ip_search import ip_search, IPRecord, IPSearch
 
-from utils.ip_search import ip_search, IPRecord
+fake = Faker()
+logger = logging.getLogger(__name__)
 
 
 class TestIPSearch:
@@ -40,3 +50,75 @@ class TestIPSearch:
 
         assert record.province == province
         assert record.city == city
+
+    def test_private_ip(self):
+        """
+        内网IP不查IP库，直接返回空的地理信息
+        """
+        record = ip_search.search_ip_location('192.168.1.1')
+
+        assert record.ip == '192.168.1.1'
+        assert record.country is None
+
+    def test_search_ip_locations(self):
+        ips = ['67.220.91.30', '133.242.187.207', '67.220.91.30', '10.0.0.1']
+        result = ip_search.search_ip_locations(ips)
+
+        assert set(result.keys()) == {'67.220.91.30', '133.242.187.207',
+                                      '10.0.0.1'}
+        assert result['67.220.91.30'].country == '美国'
+        assert result['133.242.187.207'].country == '日本'
+
+    def test_lookup_cache(self):
+        """
+        同一个IP第二次查询直接命中缓存，不再查询IP库；
+        记录冷缓存和热缓存下每秒的查询次数，耗时受机器负载影响，不作为断言
+        """
+        ips = list({fake.ipv4_public() for _ in range(2000)})
+        ip_search.cache_clear()
+
+        start = time.perf_counter()
+        for ip in ips:
+            ip_search.search_ip_location(ip)
+        cold = len(ips) / (time.perf_counter() - start)
+        info = ip_search.cache_info()
+        assert info.hits == 0
+        assert info.misses == len(ips)
+
+        start = time.perf_counter()
+        for ip in ips:
+            ip_search.search_ip_location(ip)
+        warm = len(ips) / (time.perf_counter() - start)
+        logger.info('cold: %.0f lookups/s, warm: %.0f lookups/s', cold, warm)
+        info = ip_search.cache_info()
+        assert info.hits == len(ips)
+        assert info.misses == len(ips)
+
+
+class TestIPSearchImport:
+    def test_lazy_import(self):
+        """
+        导入模块时不加载IP库和地理信息字典，第一次查询时才加载，
+        导入耗时在预算内；预算留得比较宽，只用来发现重新在导入时加载的情况
+        """
+        code = ('import time, django; django.setup(); '
+                'start = time.perf_counter(); '
+                'from utils.ip_search import IPSearch; '
+                'print(time.perf_counter() - start, '
+                'IPSearch._ip_search is None, IPSearch._geo_data is None, '
+                'IPSearch._foreign_country is None)')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=str(settings.BASE_DIR))
+        duration, *lazy = output.decode().split()
+
+        logger.info('import utils.ip_search: %.3fs', float(duration))
+        assert lazy == ['True', 'True', 'True']
+        assert float(duration) < 1
+
+    def test_load_on_first_search(self):
+        search = IPSearch(cache_size=16)
+        search.search_ip_location('67.220.91.30')
+
+        assert IPSearch._ip_search is not None
+        assert IPSearch._geo_data is not None
+        assert IPSearch._foreign_country is not None
@@ -0,0 +1,112 @@
+import logging
+import time
+import uuid
+
+import pytest
+from django.conf import settings
+from django.test import RequestFactory
+from rest_framework.authtoken.models import Token
+
+from user.models import User, Group
+from utils.base_testcase import BaseUser
+from utils.core.authentication import cipher, EncryptedTokenAuthentication, \
+    SALT_EXPIRE
+from utils.middlewares import CheckIPAndTimeoutMiddleware, REDIS_ALLOWED_IP, \
+    REDIS_INACTIVITY_TIMEOUT, REQUEST_GATE_SCRIPT
+from utils.unified_redis import rs
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(fn, n: int = 2000):
+    """
+    :return: 每次调用耗时(毫秒)的p50和p99
+    """
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return durations[n // 2], durations[int(n * 0.99) - 1]
+
+
+@pytest.mark.django_db
+class TestCheckIPAndTimeoutMiddleware:
+    @pytest.fixture(scope='function')
+    def token(self) -> Token:
+        user = User.objects.create_user(
+            username='Gate', password=BaseUser.right_password,
+            group=Group.objects.first())
+        rs.delete(user.username)
+        token, _ = Token.objects.get_or_create(user=user)
+        return token
+
+    @pytest.fixture(scope='function')
+    def middleware(self) -> CheckIPAndTimeoutMiddleware:
+        return CheckIPAndTimeoutMiddleware(lambda request: None)
+
+    def request(self, header: str = None, ip: str = '127.0.0.1'):
+        kwargs = {'REMOTE_ADDR': ip}
+        if header:
+            kwargs['HTTP_AUTHORIZATION'] = header
+        request = RequestFactory().get('/', **kwargs)
+        request.session = {}
+        return request
+
+    def test_authenticated(self, token: Token, middleware):
+        header = 'Token ' + cipher.encrypt(token.key)
+        request = self.request(header)
+        assert middleware.process_view(request, None, (), {}) is None
+        assert request.user == token.user
+
+        # 视图里的认证直接使用中间件的结果
+        assert EncryptedTokenAuthentication().authenticate(request) == (
+            token.user, token)
+
+    @pytest.mark.skipif(settings.DEBUG and settings.ALLOW_TEST_LOGIN,
+                        reason='测试登录模式下token不加盐')
+    def test_replay(self, token: Token, middleware):
+        header = 'Token ' + cipher.encrypt(token.key)
+        assert middleware.process_view(
+            self.request(header), None, (), {}) is None
+        response = middleware.process_view(self.request(header), None, (), {})
+        assert response.status_code == 401
+
+    def test_ip_limit(self, middleware):
+        rs.sadd(REDIS_ALLOWED_IP, '10.0.0.1')
+        try:
+            response = middleware.process_view(
+                self.request(ip='10.0.0.2'), None, (), {})
+            assert response is not None
+            assert middleware.process_view(
+                self.request(ip='10.0.0.1'), None, (), {}) is None
+        finally:
+            rs.delete(REDIS_ALLOWED_IP)
+
+    def test_gate_benchmark(self):
+        """
+        每个请求的安全检查增加的redis延迟：改动前中间件和DRF认证逐条发送7条命令，
+        改动后一次脚本调用；耗时受机器负载影响，只记录不作为断言
+        """
+        name = 'gate-benchmark'
+        keys = [name, REDIS_ALLOWED_IP, REDIS_INACTIVITY_TIMEOUT]
+
+        def before():
+            for _ in range(2):
+                rs.sadd(name, uuid.uuid4().hex)
+                rs.expire(name, SALT_EXPIRE)
+            rs.exists(REDIS_ALLOWED_IP)
+            rs.sismember(REDIS_ALLOWED_IP, '127.0.0.1')
+            rs.get(REDIS_INACTIVITY_TIMEOUT)
+
+        def after():
+            return REQUEST_GATE_SCRIPT(
+                keys=keys, args=[uuid.uuid4().hex, SALT_EXPIRE, '127.0.0.1'])
+
+        try:
+            assert after()[0] == 1
+            logger.info('before: p50 %.3fms, p99 %.3fms', *percentile(before))
+            logger.info('after: p50 %.3fms, p99 %.3fms', *percentile(after))
+        finally:
+            rs.delete(name)
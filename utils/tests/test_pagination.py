@@ -0,0 +1,78 @@
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from log.models import UnifiedForumLog
+from utils.core.pagination import LargeTablePagination, estimate_count, \
+    EstimatedCountPaginator
+
+
+def paginate(queryset, **params):
+    request = Request(RequestFactory().get('/log/', params))
+    paginator = LargeTablePagination()
+    rows = paginator.paginate_queryset(queryset, request)
+    return paginator, rows, paginator.get_paginated_response([]).data
+
+
+def cursor_of(link):
+    return parse_qs(urlparse(link).query)['cursor'][0]
+
+
+@pytest.mark.django_db
+class TestLargeTablePagination:
+    @pytest.fixture
+    def logs(self):
+        now = timezone.now()
+        # 三条日志的时间相同，验证按id区分同一时间的记录
+        times = [now, now, now, now - timedelta(minutes=1),
+                 now - timedelta(minutes=2)]
+        for i, t in enumerate(times):
+            UnifiedForumLog.objects.create(
+                content='page-{}'.format(i), occurred_time=t, user='admin',
+                type=UnifiedForumLog.TYPE_SYSTEM)
+        return UnifiedForumLog.objects.filter(content__startswith='page-')
+
+    def test_keyset(self, logs):
+        expected = list(logs.order_by('-occurred_time', '-id'))
+        paginator, rows, data = paginate(logs, cursor='', page_size=2)
+        pages = [rows]
+        assert data['previous'] is None
+        while data['next']:
+            paginator, rows, data = paginate(
+                logs, cursor=cursor_of(data['next']), page_size=2)
+            pages.append(rows)
+
+        assert [len(p) for p in pages] == [2, 2, 1]
+        assert sum(pages, []) == expected
+        assert data['count'] == 5
+        assert data['count_approximate'] is False
+
+        # 从最后一页往前翻
+        _, rows, data = paginate(
+            logs, cursor=cursor_of(data['previous']), page_size=2)
+        assert rows == pages[1]
+        _, rows, data = paginate(
+            logs, cursor=cursor_of(data['previous']), page_size=2)
+        assert rows == pages[0]
+        assert data['previous'] is None
+
+    def test_page_number(self, logs):
+        _, rows, data = paginate(logs.order_by('-id'), page=2, page_size=2)
+        assert len(rows) == 2
+        assert data['count'] == 5
+        assert data['count_approximate'] is False
+
+    def test_approximate(self, logs, monkeypatch):
+        assert estimate_count(logs) is not None
+        monkeypatch.setattr(EstimatedCountPaginator, 'threshold', 0)
+        _, _, data = paginate(logs, cursor='')
+        assert data['count_approximate'] is True
+
+    def test_invalid_cursor(self, logs):
+        with pytest.raises(NotFound):
+            paginate(logs, cursor='xxx')
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+from django.utils import timezone
+
+from base_app.factory_data import DeviceFactory
+from snmp.models import SNMPData
+from utils.partition import PartitionedTable, partition_register
+
+
+def local(*args) -> datetime:
+    return timezone.make_aware(datetime(*args))
+
+
+class TestPeriod:
+    def test_month(self):
+        table = PartitionedTable(SNMPData, 'update_time')
+        start = table.period_start(local(2020, 12, 15, 10, 30))
+
+        assert start == local(2020, 12, 1)
+        assert table.next_period(start) == local(2021, 1, 1)
+        assert table.partition_name(start) == 'snmp_snmpdata_p202012'
+
+    def test_day(self):
+        table = PartitionedTable(SNMPData, 'update_time', PartitionedTable.DAY)
+        start = table.period_start(local(2020, 2, 28, 23, 59))
+
+        assert start == local(2020, 2, 28)
+        assert table.next_period(start) == local(2020, 2, 29)
+        assert table.partition_name(start) == 'snmp_snmpdata_p20200228'
+
+    def test_parse_bound(self):
+        assert PartitionedTable.parse_bound('MINVALUE') is None
+        assert PartitionedTable.parse_bound(
+            "'2020-09-30 16:00:00+00'") == local(2020, 10, 1)
+
+
+@pytest.mark.django_db
+class TestPartitionedTable:
+    """
+    测试数据库的事务在测试结束时回滚，转换分区表的DDL也一起回滚
+    """
+    def test_convert(self):
+        table = partition_register.get(SNMPData)
+        current = timezone.now()
+        device = DeviceFactory.create()
+        old = SNMPData.objects.create(device=device)
+        SNMPData.objects.filter(id=old.id).update(
+            update_time=current - timedelta(days=30))
+        SNMPData.objects.create(device=device)
+
+        assert table.convert(current)
+        assert table.is_partitioned()
+        assert not table.convert(current)
+        partitions = table.partitions()
+        assert partitions[0][0] == table.legacy_table
+        assert len(partitions) == table.premake + 2
+        assert SNMPData.objects.count() == 2
+
+        # 分区存在之后新数据写入对应的分区
+        tomorrow = table.next_period(table.period_start(current))
+        SNMPData.objects.create(device=device)
+        SNMPData.objects.filter(
+            id=SNMPData.objects.latest('id').id).update(update_time=tomorrow)
+        assert table.ensure(current) == []
+
+        removed = table.drop_before(tomorrow)
+        assert removed == [table.legacy_table]
+        assert SNMPData.objects.count() == 1
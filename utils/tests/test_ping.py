@@ -0,0 +1,110 @@
+import asyncio
+import socket
+
+import pytest
+
+from utils.ping import BatchPinger, PingResult, checksum, host_family
+
+requires_icmp = pytest.mark.skipif(not BatchPinger.available(),
+                                   reason='没有创建ICMP socket的权限')
+requires_icmpv6 = pytest.mark.skipif(
+    not BatchPinger.available(socket.AF_INET6),
+    reason='没有创建ICMPv6 socket的权限或者不支持IPv6')
+
+
+@requires_icmp
+class TestBatchPinger:
+    def test_checksum(self):
+        # 校验和写回报文后，整个报文的校验和为0
+        pinger = BatchPinger()
+        assert checksum(pinger.packet(1)) == 0
+
+    def test_ping_loopback(self):
+        pinger = BatchPinger(count=3, timeout=1, interval=0.01)
+        result = pinger.ping(['127.0.0.1', '127.0.0.2'])
+
+        for host in ['127.0.0.1', '127.0.0.2']:
+            assert result[host].alive
+            assert result[host].sent == 3
+            assert result[host].loss == 0
+            assert result[host].avg_rtt < 1000
+
+    def test_ping_invalid_host(self):
+        pinger = BatchPinger(count=2, timeout=0.5, interval=0.01)
+        result = pinger.ping(['127.0.0.1', '256.1.1.1'])
+
+        assert result['127.0.0.1'].alive
+        assert not result['256.1.1.1'].alive
+        assert result['256.1.1.1'].loss == 1
+
+    def test_async_ping(self):
+        pinger = BatchPinger(count=1, timeout=1)
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(
+                pinger.async_ping(['127.0.0.1']))
+        finally:
+            loop.close()
+        assert result['127.0.0.1'].received == 1
+
+
+@requires_icmpv6
+class TestBatchPingerIPv6:
+    def test_ping_loopback(self):
+        pinger = BatchPinger(count=2, timeout=1, interval=0.01)
+        result = pinger.ping(['::1', '127.0.0.1'])
+
+        assert result['::1'].alive
+        assert result['::1'].loss == 0
+        assert result['127.0.0.1'].alive
+
+    def test_split(self):
+        assert BatchPinger.split(['::1', '127.0.0.1']) == (
+            ['::1', '127.0.0.1'], [])
+
+
+class TestSendTo:
+    def test_retry_when_buffer_full(self):
+        """
+        发送缓冲区满时等socket可写之后重发同一个报文
+        """
+        left, right = socket.socketpair()
+
+        class FullSocket:
+            def __init__(self):
+                self.sent = []
+
+            def fileno(self):
+                return left.fileno()
+
+            def sendto(self, data, address):
+                self.sent.append(data)
+                if len(self.sent) == 1:
+                    raise BlockingIOError
+                return len(data)
+
+        sock = FullSocket()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                BatchPinger.sendto(sock, b'echo', ('127.0.0.1', 0)))
+        finally:
+            loop.close()
+            left.close()
+            right.close()
+        assert sock.sent == [b'echo', b'echo']
+
+
+class TestPingResult:
+    def test_host_family(self):
+        assert host_family('127.0.0.1') == socket.AF_INET
+        assert host_family('fe80::1') == socket.AF_INET6
+        # 不合法的地址按IPv4处理，发送失败算作丢包
+        assert host_family('256.1.1.1') == socket.AF_INET
+
+    def test_no_reply(self):
+        result = PingResult('10.0.0.1')
+        result.sent = 2
+        assert not result.alive
+        assert result.loss == 1
+        assert result.avg_rtt is None
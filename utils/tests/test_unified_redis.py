@@ -3,7 +3,8 @@ from datetime import timedelta
 from django.utils import timezone
 from faker import Faker
 
-from utils.unified_redis import IPDuplicate, cache, IPDuplicateCleanTask, RedisQueue
+from utils.unified_redis import IPDuplicate, cache, IPDuplicateCleanTask, RedisQueue, \
+    SlidingWindowTopN
 
 fake = Faker()
 
@@ -99,3 +100,41 @@ class TestRedisQueue:
         assert queue.is_full()
         for i in range(5):
             assert queue.pop() == str(i)
+
+
+class TestSlidingWindowTopN:
+    def clean(self, window: SlidingWindowTopN):
+        for k in cache.keys(window.key_pattern + '*'):
+            cache.delete(k)
+
+    def test_top_n_merge_buckets(self):
+        window = SlidingWindowTopN('test-sliding-window')
+        self.clean(window)
+        current = timezone.now()
+        window.incr({'1.1.1.1': 5, '2.2.2.2': 3}, current - timedelta(hours=2))
+        window.incr({'2.2.2.2': 4, '3.3.3.3': 1}, current - timedelta(hours=1))
+        window.incr({'3.3.3.3': 2}, current)
+
+        assert window.top_n_last(2, current, 3) == [('2.2.2.2', 7.0),
+                                                    ('1.1.1.1', 5.0)]
+        assert window.top_n_last(10, current, 2) == [('2.2.2.2', 4.0),
+                                                     ('3.3.3.3', 3.0)]
+        assert window.top_n_last(10, current, 1) == [('3.3.3.3', 2.0)]
+        self.clean(window)
+
+    def test_bounded_bucket(self):
+        """
+        每个桶只保留计数最高的capacity个成员
+        """
+        window = SlidingWindowTopN('test-sliding-window', capacity=10)
+        self.clean(window)
+        current = timezone.now()
+        data = {fake.ipv4(): 1 for _ in range(100)}
+        data['1.1.1.1'] = 100
+        window.incr(data, current)
+
+        key = window.bucket_key(window.bucket(current))
+        assert cache.zcard(key) == 10
+        assert cache.ttl(key) > 0
+        assert window.top_n_last(1, current, 1) == [('1.1.1.1', 100.0)]
+        self.clean(window)
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, List, Tuple
 import json
 from dateutil import parser
 
@@ -160,3 +160,74 @@ class IPRedisQueue(RedisQueue):
     def set(self, data):
         self._queue = data
         self.save()
+
+
+class SlidingWindowTopN(object):
+    """
+    按时间分桶的TopN统计，每个桶是一个ZSET
+    写入时每个桶只保留计数最高的capacity个成员，桶会自动过期，所以占用的内存上限是
+    retention * capacity，与出现过多少不同的IP无关；被挤出桶的低频成员计数会丢失，
+    TopN是近似值，但capacity远大于n时高频成员的计数是准确的
+    查询时用ZUNIONSTORE合并窗口内的桶，工作量只和 桶数 * capacity 有关
+    """
+    def __init__(self, key_pattern: str, bucket_seconds: int = 3600,
+                 capacity: int = 1000, retention: int = 48):
+        """
+        :param key_pattern: 桶的key前缀
+        :param bucket_seconds: 每个桶的时长，默认1小时
+        :param capacity: 每个桶最多保留的成员数
+        :param retention: 保留多少个桶
+        """
+        self.key_pattern = key_pattern
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.retention = retention
+
+    def bucket(self, current: datetime) -> int:
+        return int(current.timestamp()) // self.bucket_seconds
+
+    def bucket_key(self, bucket: int) -> str:
+        return '{}-{}'.format(self.key_pattern, bucket)
+
+    def incr(self, data: Dict[str, int], current: datetime):
+        """
+        :param data: {member: count}
+        :param current: 计数所在的时间
+        """
+        if not data:
+            return
+        key = self.bucket_key(self.bucket(current))
+        with cache.pipeline(transaction=False) as pipe:
+            for member, count in data.items():
+                pipe.zincrby(key, count, member)
+            pipe.zremrangebyrank(key, 0, -self.capacity - 1)
+            pipe.expire(key, self.bucket_seconds * self.retention)
+            pipe.execute()
+
+    def top_n(self, n: int, start: datetime,
+              end: datetime) -> List[Tuple[str, float]]:
+        """
+        :param n: 前n个
+        :param start: 窗口开始时间
+        :param end: 窗口结束时间，包含end所在的桶
+        :return: [(member, count), ...]
+        """
+        keys = [self.bucket_key(b) for b in
+                range(self.bucket(start), self.bucket(end) + 1)]
+        if len(keys) == 1:
+            return cache.zrevrange(keys[0], 0, n - 1, withscores=True)
+        dest = '{}-union-{}'.format(self.key_pattern, keys[0])
+        with cache.pipeline() as pipe:
+            pipe.zunionstore(dest, keys)
+            pipe.zrevrange(dest, 0, n - 1, withscores=True)
+            pipe.delete(dest)
+            result = pipe.execute()
+        return result[1]
+
+    def top_n_last(self, n: int, current: datetime,
+                   buckets: int) -> List[Tuple[str, float]]:
+        """
+        最近buckets个桶（包含current所在的桶）内的TopN
+        """
+        start = current - timedelta(seconds=self.bucket_seconds * (buckets - 1))
+        return self.top_n(n, start, current)